@@ -0,0 +1,72 @@
+import sys
+sys.path.insert(0, "./")
+sys.path.insert(1, "../")
+import time
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from ext.gensim_wrapper.models.word2vec import Word2VecWrapper
+from utils.corpus import index_walks
+from tne.tne import CombineSentences, CombineIndexedSentences
+
+
+def generate_synthetic_walks(number_of_nodes, number_of_walks, walk_length, number_of_comms, seed):
+
+    rng = np.random.RandomState(seed)
+    node_walks = rng.randint(0, number_of_nodes, size=(number_of_walks, walk_length))
+    node2comm = rng.randint(0, number_of_comms, size=number_of_nodes)
+    walks = [[str(node) for node in walk] for walk in node_walks]
+    community_walks = [[str(node2comm[node]) for node in walk] for walk in node_walks]
+
+    return walks, community_walks
+
+
+def measure(model, number_of_comms, comm_embedding_size, sentences, indexed, processes=None):
+
+    initial_time = time.time()
+    trained_words = model.train_community(number_of_comms, sentences, comm_embedding_size, indexed=indexed,
+                                          processes=processes)
+
+    return trained_words / (time.time() - initial_time)
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Words/sec of the community training with the queue-based job producer, "
+                                        "with the pre-batched array pipeline and with the worker processes",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--nodes', type=int, required=False, default=10000, help='The number of nodes.')
+    parser.add_argument('--walks', type=int, required=False, default=100000, help='The number of walks.')
+    parser.add_argument('--walk_length', type=int, required=False, default=40, help='The length of walks.')
+    parser.add_argument('--K', type=int, required=False, default=50, help='The number of communities.')
+    parser.add_argument('--comm_emb_size', type=int, required=False, default=32, help='Community embedding size.')
+    parser.add_argument('--iter', type=int, required=False, default=1, help='The number of epochs.')
+    parser.add_argument('--workers', type=int, nargs='+', required=False, default=[1, 4, 16, 32],
+                        help='The numbers of workers to be compared.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    walks, community_walks = generate_synthetic_walks(args.nodes, args.walks, args.walk_length, args.K, seed=1)
+
+    model = Word2VecWrapper(size=args.comm_emb_size, sg=1, hs=0, min_count=0, iter=args.iter)
+    model.build_vocab(walks)
+    indexed_walks = index_walks(walks, model.get_token2index())
+    combined_walks = CombineSentences(node_walks=walks, community_walks=community_walks)
+    combined_indexed_walks = CombineIndexedSentences(
+        indexed_walks=indexed_walks,
+        community_walks=np.asarray([int(label) for walk in community_walks for label in walk], dtype=np.int32)
+    )
+
+    print("{:>8} {:>18} {:>18} {:>18} {:>8}".format("workers", "producer words/s", "batched words/s",
+                                                    "processes words/s", "speedup"))
+    for workers in args.workers:
+        model.workers = workers
+        producer_speed = measure(model, args.K, args.comm_emb_size, combined_walks, indexed=False)
+        batched_speed = measure(model, args.K, args.comm_emb_size, combined_indexed_walks, indexed=True)
+        processes_speed = measure(model, args.K, args.comm_emb_size, combined_indexed_walks, indexed=True,
+                                  processes=workers)
+        print("{:>8} {:>18.0f} {:>18.0f} {:>18.0f} {:>8.2f}".format(workers, producer_speed, batched_speed,
+                                                                    processes_speed, processes_speed / producer_speed))
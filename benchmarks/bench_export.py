@@ -0,0 +1,44 @@
+import sys
+sys.path.insert(0, "./")
+sys.path.insert(1, "../")
+import os
+import time
+import tempfile
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from utils.export import save_text, save_word2vec_binary, save_numpy
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Running time of the embedding export formats",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--nodes', type=int, required=False, default=100000, help='The number of nodes.')
+    parser.add_argument('--dim', type=int, required=False, default=128, help='The embedding size.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    labels = [str(node) for node in range(args.nodes)]
+    vectors = np.random.RandomState(1).randn(args.nodes, args.dim).astype(np.float32)
+
+    writers = [
+        ("text", save_text),
+        ("binary", save_word2vec_binary),
+        ("numpy", save_numpy),
+        ("numpy float16", lambda file_path, labels, vectors: save_numpy(file_path, labels, vectors, float16=True)),
+    ]
+
+    temp_folder = tempfile.mkdtemp()
+    print("{:>14} {:>10} {:>12}".format("format", "secs", "MB"))
+    for name, writer in writers:
+        file_path = os.path.join(temp_folder, name.replace(" ", "_") + ".embedding")
+        initial_time = time.time()
+        writer(file_path, labels, vectors)
+        elapsed = time.time() - initial_time
+        size = sum(os.path.getsize(os.path.join(temp_folder, f)) for f in os.listdir(temp_folder)
+                   if f.startswith(os.path.basename(file_path)))
+        print("{:>14} {:>10.2f} {:>12.1f}".format(name, elapsed, size / 2.0 ** 20))
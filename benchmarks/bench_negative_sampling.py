@@ -0,0 +1,69 @@
+import sys
+sys.path.insert(0, "./")
+sys.path.insert(1, "../")
+import time
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from ext.gensim_wrapper.models.word2vec import Word2VecWrapper
+from ext.gensim_wrapper.models.word2vec_inner import set_batched_negative_max_size
+from utils.corpus import index_walks
+from tne.tne import CombineIndexedSentences
+from benchmarks.bench_community_training import generate_synthetic_walks
+
+
+def measure(model, number_of_comms, comm_embedding_size, sentences, negative, batched):
+    """Return the words/sec of the community training with the given kernel and the learned community vectors."""
+
+    # A zero size limit selects the BLAS kernel for every size
+    previous = set_batched_negative_max_size(1 << 30 if batched else 0)
+    # Both runs draw the same negative samples
+    model.random = np.random.RandomState(model.seed)
+    try:
+        initial_time = time.time()
+        trained_words = model.train_community(number_of_comms, sentences, comm_embedding_size, indexed=True,
+                                              negative=negative)
+        speed = trained_words / (time.time() - initial_time)
+    finally:
+        set_batched_negative_max_size(previous)
+
+    return speed, model.wv.syn0_community[:number_of_comms].copy()
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Words/sec of the community training with the BLAS negative sampling kernel "
+                                        "and with the batched kernel for small vectors",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--nodes', type=int, required=False, default=10000, help='The number of nodes.')
+    parser.add_argument('--walks', type=int, required=False, default=20000, help='The number of walks.')
+    parser.add_argument('--walk_length', type=int, required=False, default=40, help='The length of walks.')
+    parser.add_argument('--K', type=int, required=False, default=50, help='The number of communities.')
+    parser.add_argument('--sizes', type=int, nargs='+', required=False, default=[8, 16, 32, 64, 128, 256],
+                        help='The community embedding sizes to be compared.')
+    parser.add_argument('--negative', type=int, required=False, default=10,
+                        help='The number of negative samples of the community training.')
+    parser.add_argument('--iter', type=int, required=False, default=1, help='The number of epochs.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    walks, community_walks = generate_synthetic_walks(args.nodes, args.walks, args.walk_length, args.K, seed=1)
+    communities = np.asarray([int(label) for walk in community_walks for label in walk], dtype=np.int32)
+
+    print("{} negative samples".format(args.negative))
+    print("{:>6} {:>16} {:>18} {:>8} {:>12}".format("size", "BLAS words/s", "batched words/s", "speedup",
+                                                    "max diff"))
+    for size in args.sizes:
+        # A single worker, so that the updates of both runs are in the same order
+        model = Word2VecWrapper(size=size, sg=1, hs=0, min_count=0, iter=args.iter, workers=1)
+        model.build_vocab(walks)
+        sentences = CombineIndexedSentences(indexed_walks=index_walks(walks, model.get_token2index()),
+                                            community_walks=communities)
+        blas_speed, blas_vectors = measure(model, args.K, size, sentences, args.negative, batched=False)
+        batched_speed, batched_vectors = measure(model, args.K, size, sentences, args.negative, batched=True)
+        print("{:>6} {:>16.0f} {:>18.0f} {:>8.2f} {:>12.2e}".format(size, blas_speed, batched_speed,
+                                                                    batched_speed / blas_speed,
+                                                                    np.abs(blas_vectors - batched_vectors).max()))
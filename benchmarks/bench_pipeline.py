@@ -0,0 +1,211 @@
+import sys
+sys.path.insert(0, "./")
+sys.path.insert(1, "../")
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from tne.tne import TNE
+from tne.walks import generate_walks
+from utils.corpus import load_corpus, write_binary_corpus
+from utils.graph import load_csr_graph
+from utils.export import EXPORT_FORMATS
+from benchmarks.synthetic import synthetic_graph, write_edgelist, write_gml, SYNTHETIC_MODELS
+
+CONCATENATE_METHODS = ['average', 'max', 'sum', 'min']
+
+
+def measure(results, number_of_nodes, name, func, trace_memory=True):
+    """Run func, append its running time and the peak of the memory traced during the run to results."""
+
+    if trace_memory:
+        tracemalloc.start()
+    initial_time = time.time()
+    try:
+        output = func()
+    finally:
+        seconds = time.time() - initial_time
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        if trace_memory:
+            tracemalloc.stop()
+
+    results.append({'nodes': number_of_nodes, 'benchmark': name, 'seconds': seconds, 'peak_mb': peak / 2.0 ** 20})
+    print("{:>10} {:>36} {:>10.2f} {:>10.1f}".format(number_of_nodes, name, seconds, peak / 2.0 ** 20))
+
+    return output
+
+
+def iterate_corpus(corpus):
+
+    number_of_tokens = 0
+    for walk in corpus:
+        number_of_tokens += len(walk)
+
+    return number_of_tokens
+
+
+def tne_params(args, method, graph_path):
+
+    return {'comm_detection_method': method, 'number_of_comms': args.K, 'node_embedding_size': args.node_emb_size,
+            'comm_embedding_size': args.comm_emb_size, 'window_size': args.window_size,
+            'num_of_workers': args.workers, 'alpha': 0.025, 'min_alpha': 0.0001, 'iter': args.iter,
+            'lda_alpha': 50.0 / args.K, 'lda_beta': 0.1, 'lda_number_of_iters': args.lda_iter_num,
+            'bayesianhmm_number_of_steps': args.hmm_steps, 'graph_path': graph_path}
+
+
+def run_benchmarks(args, number_of_nodes, temp_folder, results):
+
+    trace_memory = not args.no_memory
+    folder = os.path.join(temp_folder, str(number_of_nodes))
+    os.makedirs(folder)
+
+    # The graph and the walks
+    graph, _ = measure(results, number_of_nodes, "generate_graph",
+                       lambda: synthetic_graph(number_of_nodes, args.K, average_degree=args.degree, mixing=args.mixing,
+                                               model=args.model, seed=args.seed), trace_memory)
+    # The methods using networkx read the gml file
+    edgelist_path, graph_path = os.path.join(folder, "graph.edgelist"), os.path.join(folder, "graph.gml")
+    write_edgelist(graph, edgelist_path)
+    write_gml(graph, graph_path)
+    walks = measure(results, number_of_nodes, "generate_walks",
+                    lambda: generate_walks(graph, args.num_walks, args.walk_length, workers=args.workers,
+                                           seed=args.seed), trace_memory)
+    corpus_path = os.path.join(folder, "walks.corpus")
+    with open(corpus_path, 'w') as f:
+        for walk in walks:
+            f.write(" ".join(walk) + "\n")
+    walks.save(os.path.join(folder, "walks"))
+
+    # Loading the inputs
+    measure(results, number_of_nodes, "load_graph_edgelist", lambda: load_csr_graph(edgelist_path, snapshot=False),
+            trace_memory)
+    measure(results, number_of_nodes, "load_graph_gml", lambda: load_csr_graph(graph_path, snapshot=False),
+            trace_memory)
+    measure(results, number_of_nodes, "write_graph_snapshot", lambda: load_csr_graph(graph_path), trace_memory)
+    measure(results, number_of_nodes, "load_graph_snapshot", lambda: load_csr_graph(graph_path), trace_memory)
+    measure(results, number_of_nodes, "load_corpus_text", lambda: iterate_corpus(load_corpus(corpus_path)),
+            trace_memory)
+    measure(results, number_of_nodes, "load_corpus_binary",
+            lambda: iterate_corpus(load_corpus(os.path.join(folder, "walks"))), trace_memory)
+    measure(results, number_of_nodes, "write_binary_corpus",
+            lambda: write_binary_corpus(load_corpus(corpus_path), os.path.join(folder, "converted")), trace_memory)
+
+    # The node embeddings are learned once and shared by the community detection methods
+    walks = load_corpus(os.path.join(folder, "walks"))
+    node_model_path = os.path.join(folder, "node_model")
+    for method in args.methods:
+        tne = TNE(walks=walks, params=tne_params(args, method, graph_path), suffix="bench")
+        if not os.path.exists(node_model_path):
+            measure(results, number_of_nodes, "node_embeddings", tne.fit_nodes, trace_memory)
+            tne.model.save(node_model_path)
+        else:
+            # The community training modifies the model, so each method starts from the saved node model
+            tne.fit_nodes(model=node_model_path)
+        try:
+            measure(results, number_of_nodes, "detect_communities/{}".format(method), tne.detect_communities,
+                    trace_memory)
+        except Exception as e:
+            # The methods whose executables or packages are missing are skipped
+            print("The {} method has failed: {}".format(method, e))
+            continue
+
+        measure(results, number_of_nodes, "train_community/{}".format(method), tne.fit_communities, trace_memory)
+        if method != args.methods[0]:
+            continue
+        for file_format in EXPORT_FORMATS:
+            for concatenate_method in CONCATENATE_METHODS:
+                file_path = os.path.join(folder, "{}_{}.embedding".format(file_format, concatenate_method))
+                measure(results, number_of_nodes, "write_embeddings/{}/{}".format(file_format, concatenate_method),
+                        lambda: tne.write_embeddings(file_path, concatenate_method, file_format=file_format),
+                        trace_memory)
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratio of each running time to the baseline and return the benchmarks slower than the tolerance."""
+
+    baseline = {(record['nodes'], record['benchmark']): record for record in baseline['results']}
+    regressions = []
+    print("{:>10} {:>36} {:>10} {:>10} {:>8}".format("nodes", "benchmark", "secs", "baseline", "ratio"))
+    for record in results:
+        reference = baseline.get((record['nodes'], record['benchmark']), None)
+        if reference is None:
+            continue
+        ratio = record['seconds'] / max(reference['seconds'], 1e-6)
+        # The very short benchmarks are dominated by noise
+        regression = ratio > 1.0 + tolerance and record['seconds'] - reference['seconds'] > 0.1
+        print("{:>10} {:>36} {:>10.2f} {:>10.2f} {:>8.2f}{}".format(record['nodes'], record['benchmark'],
+                                                                  record['seconds'], reference['seconds'], ratio,
+                                                                  " <-- regression" if regression else ""))
+        if regression:
+            regressions.append(record)
+
+    return regressions
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Running time and peak memory of the stages of TNE over synthetic graphs with "
+                                        "planted communities",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--nodes', type=int, nargs='+', required=False, default=[1000, 10000],
+                        help='The numbers of nodes of the synthetic graphs.')
+    parser.add_argument('--model', type=str, required=False, default='lfr', choices=SYNTHETIC_MODELS,
+                        help='The model of the synthetic graphs.')
+    parser.add_argument('--K', type=int, required=False, default=50, help='The number of communities.')
+    parser.add_argument('--degree', type=float, required=False, default=10, help='The average degree.')
+    parser.add_argument('--mixing', type=float, required=False, default=0.1,
+                        help='The fraction of the edges between the communities.')
+    parser.add_argument('--num_walks', type=int, required=False, default=10, help='The number of walks per node.')
+    parser.add_argument('--walk_length', type=int, required=False, default=40, help='The length of walks.')
+    parser.add_argument('--methods', type=str, nargs='+', required=False,
+                        default=['lda', 'louvain', 'fastlouvain', 'bigclam', 'bayesianhmm'],
+                        help='The community detection methods, the embeddings are written for the first one.')
+    parser.add_argument('--node_emb_size', type=int, required=False, default=128, help='Node embedding size.')
+    parser.add_argument('--comm_emb_size', type=int, required=False, default=128, help='Community embedding size.')
+    parser.add_argument('--window_size', type=int, required=False, default=10, help='The window size.')
+    parser.add_argument('--iter', type=int, required=False, default=1, help='The number of epochs.')
+    parser.add_argument('--lda_iter_num', type=int, required=False, default=100, help='The number of LDA iterations.')
+    parser.add_argument('--hmm_steps', type=int, required=False, default=10, help='The number of HMM steps.')
+    parser.add_argument('--workers', type=int, required=False, default=4, help='The number of workers.')
+    parser.add_argument('--seed', type=int, required=False, default=1, help='The seed of the synthetic data.')
+    parser.add_argument('--no_memory', action='store_true',
+                        help='Do not trace the memory, which slows down the allocations.')
+    parser.add_argument('--output', type=str, required=False, default='bench_pipeline.json',
+                        help='The path of the JSON file of the results.')
+    parser.add_argument('--baseline', type=str, required=False, default=None,
+                        help='The path of the results of a previous run, the running times are compared to them.')
+    parser.add_argument('--tolerance', type=float, required=False, default=0.2,
+                        help='The relative slowdown reported as a regression.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    results = []
+    temp_folder = tempfile.mkdtemp()
+    print("{:>10} {:>36} {:>10} {:>10}".format("nodes", "benchmark", "secs", "peak MB"))
+    try:
+        for number_of_nodes in args.nodes:
+            run_benchmarks(args, number_of_nodes, temp_folder, results)
+    finally:
+        shutil.rmtree(temp_folder)
+
+    with open(args.output, 'w') as f:
+        json.dump({'arguments': vars(args), 'python': platform.python_version(), 'numpy': np.__version__,
+                   'machine': platform.machine(), 'cpus': os.cpu_count(), 'created': time.time(),
+                   'results': results}, f, indent=2)
+    print("The results have been written into {}".format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("{} benchmarks are slower than the baseline!".format(len(regressions)))
+            sys.exit(1)
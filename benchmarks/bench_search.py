@@ -0,0 +1,69 @@
+import sys
+sys.path.insert(0, "./")
+sys.path.insert(1, "../")
+import time
+import numpy as np
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from tne.search import ExactIndex, IVFIndex, recall_at_k
+
+
+def generate_clustered_vectors(number_of_nodes, dim, number_of_comms, seed):
+
+    rng = np.random.RandomState(seed)
+    communities = rng.randint(0, number_of_comms, size=number_of_nodes)
+    centers = rng.randn(number_of_comms, dim)
+    vectors = centers[communities] + 0.5 * rng.randn(number_of_nodes, dim)
+
+    return vectors.astype(np.float32), communities
+
+
+def measure(index, queries, k, communities=None):
+
+    initial_time = time.time()
+    ids, _ = index.search(queries, k, communities=communities)
+
+    return ids, (time.time() - initial_time) / len(queries) * 1000.0
+
+
+def parse_arguments():
+    parser = ArgumentParser(description="Recall and latency of the exact and the approximate nearest-neighbour search",
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--nodes', type=int, required=False, default=100000, help='The number of nodes.')
+    parser.add_argument('--dim', type=int, required=False, default=128, help='The embedding size.')
+    parser.add_argument('--K', type=int, required=False, default=50, help='The number of communities.')
+    parser.add_argument('--queries', type=int, required=False, default=1000, help='The number of queries.')
+    parser.add_argument('--k', type=int, required=False, default=10, help='The number of neighbours.')
+    parser.add_argument('--probes', type=int, nargs='+', required=False, default=[1, 4, 8, 16, 32],
+                        help='The numbers of probed lists of the approximate index to be compared.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    vectors, communities = generate_clustered_vectors(args.nodes, args.dim, args.K, seed=1)
+    labels = [str(node) for node in range(args.nodes)]
+    query_rows = np.random.RandomState(2).choice(args.nodes, args.queries, replace=False)
+    queries = vectors[query_rows]
+
+    initial_time = time.time()
+    exact_index = ExactIndex(labels, vectors, communities=communities)
+    print("The exact index has been built in {:.2f} secs.".format(time.time() - initial_time))
+    initial_time = time.time()
+    ivf_index = IVFIndex(labels, vectors, communities=communities)
+    print("The approximate index with {} lists has been built in {:.2f} secs.".format(ivf_index.number_of_lists,
+                                                                                      time.time() - initial_time))
+
+    print("{:>24} {:>10} {:>14}".format("index", "recall", "ms/query"))
+    for same_community in (False, True):
+        query_communities = communities[query_rows] if same_community else None
+        suffix = " same comm." if same_community else ""
+        exact_ids, latency = measure(exact_index, queries, args.k, query_communities)
+        print("{:>24} {:>10.3f} {:>14.3f}".format("exact" + suffix, 1.0, latency))
+        for probes in args.probes:
+            ivf_index.number_of_probes = probes
+            ids, latency = measure(ivf_index, queries, args.k, query_communities)
+            print("{:>24} {:>10.3f} {:>14.3f}".format("ivf/{}".format(probes) + suffix, recall_at_k(exact_ids, ids),
+                                                     latency))
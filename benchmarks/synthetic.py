@@ -0,0 +1,89 @@
+import numpy as np
+import networkx as nx
+from utils.graph import CSRGraph
+
+SYNTHETIC_MODELS = ['sbm', 'lfr']
+
+
+def _community_sizes(number_of_nodes, number_of_comms, model, rng):
+    # Equal sizes for the stochastic block model, power-law sizes with exponent 2 for the LFR-like graphs, where the
+    # largest communities are at most 100 times larger than the smallest ones
+    if model == 'sbm':
+        weights = np.ones(shape=(number_of_comms, ), dtype=np.float64)
+    else:
+        weights = np.minimum((1.0 - rng.random_sample(number_of_comms)) ** -1.0, 100.0)
+    sizes = np.maximum(np.floor(weights / weights.sum() * number_of_nodes).astype(np.int64), 1)
+    sizes[np.argmax(sizes)] += number_of_nodes - sizes.sum()
+
+    return sizes
+
+
+def _degrees(number_of_nodes, average_degree, model, rng):
+    # Poisson degrees for the stochastic block model, power-law degrees with exponent 2.5 for the LFR-like graphs
+    if model == 'sbm':
+        return np.maximum(rng.poisson(average_degree, size=number_of_nodes), 1)
+    degrees = (1.0 - rng.random_sample(number_of_nodes)) ** (-1.0 / 1.5)
+    degrees = degrees * (average_degree / degrees.mean())
+
+    return np.clip(np.round(degrees), 1, max(number_of_nodes // 10, 1)).astype(np.int64)
+
+
+def synthetic_graph(number_of_nodes, number_of_comms, average_degree=10, mixing=0.1, model='sbm', seed=1):
+    """
+    Generate an undirected graph with planted communities, as a CSRGraph and the community label of each node. Every
+    node draws its degree from a Poisson (sbm) or a power-law (lfr) distribution, and connects each of its edge stubs
+    to a uniformly chosen node of its own community, or of the whole graph with the probability mixing. The
+    communities of the LFR-like graphs also have power-law sizes. All steps are vectorized, so graphs with tens of
+    millions of nodes can be generated.
+    """
+
+    if model not in SYNTHETIC_MODELS:
+        raise ValueError("Invalid synthetic graph model: {}".format(model))
+
+    rng = np.random.RandomState(seed)
+    sizes = _community_sizes(number_of_nodes, number_of_comms, model, rng)
+    labels = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    source = np.repeat(np.arange(number_of_nodes, dtype=np.int64), _degrees(number_of_nodes, average_degree, model, rng))
+    inter = rng.random_sample(len(source)) < mixing
+    target = np.empty_like(source)
+    target[inter] = rng.randint(0, number_of_nodes, size=np.count_nonzero(inter))
+    intra_labels = labels[source[~inter]]
+    offsets = (rng.random_sample(len(intra_labels)) * sizes[intra_labels]).astype(np.int64)
+    target[~inter] = starts[intra_labels] + offsets
+
+    # Drop the self-loops and the duplicated edges, each edge is stored in both directions
+    mask = source != target
+    source, target = source[mask], target[mask]
+    keys = np.unique(np.minimum(source, target) * number_of_nodes + np.maximum(source, target))
+    low, high = keys // number_of_nodes, keys % number_of_nodes
+    source, target = np.concatenate((low, high)), np.concatenate((high, low))
+    order = np.lexsort((target, source))
+    indptr = np.zeros(shape=(number_of_nodes + 1, ), dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=number_of_nodes), out=indptr[1:])
+
+    graph = CSRGraph(indptr=indptr, indices=target[order].astype(np.int32),
+                     weights=np.ones(shape=(len(order), ), dtype=np.float32),
+                     id2node=np.arange(number_of_nodes).astype(str))
+
+    return graph, labels
+
+
+def write_edgelist(graph, file_path):
+    """Write each undirected edge of the CSRGraph once into an edgelist file."""
+
+    source = np.repeat(np.arange(graph.number_of_nodes(), dtype=np.int64), graph.degrees())
+    mask = source < graph.indices
+    np.savetxt(file_path, np.column_stack((source[mask], graph.indices[mask])), fmt='%d')
+
+
+def write_gml(graph, file_path):
+    """Write the CSRGraph into a gml file, the format read by the methods using networkx."""
+
+    source = np.repeat(np.arange(graph.number_of_nodes(), dtype=np.int64), graph.degrees())
+    mask = source < graph.indices
+    nx_graph = nx.Graph()
+    nx_graph.add_nodes_from(str(node) for node in graph.id2node)
+    nx_graph.add_edges_from(zip(graph.id2node[source[mask]], graph.id2node[graph.indices[mask]]))
+    nx.write_gml(nx_graph, file_path)
@@ -5,4 +5,4 @@ BASE_FOLDER = dirname(os.path.abspath(__file__))
 EXT_LIBRARY_FOLDER = "ext"
 GIBBSLDA_PATH = os.path.join(BASE_FOLDER, EXT_LIBRARY_FOLDER, "gibbslda", "GibbsLDA++-0.2", "lda")
 BIGCLAM_PATH = os.path.join(BASE_FOLDER, EXT_LIBRARY_FOLDER, "agm-package", "bigclam", "bigclam")
-COMMMUNITY_DETECTION_METHODS = ['lda', 'louvain', 'bigclam', 'bayesianhmm', 'bayesianhdphmm']
\ No newline at end of file
+COMMMUNITY_DETECTION_METHODS = ['lda', 'louvain', 'fastlouvain', 'bigclam', 'bayesianhmm', 'bayesianhdphmm']
\ No newline at end of file
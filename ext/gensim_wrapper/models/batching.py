@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class JobSchedule(object):
+    """
+    Precomputed job boundaries and learning rates for training over walks stored in flat arrays. Consecutive walks
+    are packed into jobs of at most batch_words tokens (a longer walk forms a job on its own), the same boundaries are
+    used for every epoch, and the learning rate decays linearly over the number of walks pushed before each job, as
+    in the queue-based job producer of gensim. A job is only a range of walk indexes, so the workers read the shared
+    arrays without any copy.
+    """
+
+    def __init__(self, offsets, batch_words, epochs, start_alpha, end_alpha):
+
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.epochs = epochs
+
+        number_of_walks = len(self.offsets) - 1
+        bounds = [0]
+        while bounds[-1] < number_of_walks:
+            start = bounds[-1]
+            end = int(np.searchsorted(self.offsets, self.offsets[start] + batch_words, side='right')) - 1
+            bounds.append(min(max(end, start + 1), number_of_walks))
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+
+        # The progress before each job over all epochs, measured in walks
+        jobs_per_epoch = len(self.bounds) - 1
+        pushed_walks = (np.arange(epochs, dtype=np.int64)[:, None] * number_of_walks + self.bounds[None, :-1]).ravel()
+        total_walks = max(number_of_walks * epochs, 1)
+        self.alphas = np.maximum(end_alpha, start_alpha - (start_alpha - end_alpha) * pushed_walks / float(total_walks))
+        self.jobs_per_epoch = jobs_per_epoch
+
+    def __len__(self):
+        return self.jobs_per_epoch * self.epochs
+
+    def job(self, job_no):
+        """Return the walk range and the learning rate of the given job as (walk_start, walk_end, alpha)."""
+        i = job_no % self.jobs_per_epoch
+        return int(self.bounds[i]), int(self.bounds[i + 1]), float(self.alphas[job_no])
+
+    def number_of_words(self, walk_start, walk_end):
+        return int(self.offsets[walk_end] - self.offsets[walk_start])
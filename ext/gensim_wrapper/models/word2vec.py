@@ -1,5 +1,12 @@
 from gensim.models.word2vec import *
 from ext.gensim_wrapper.models.keyedvectors import *
+from ext.gensim_wrapper.models.batching import JobSchedule
+from utils.metrics import COUNT_BOUNDS
+import ctypes
+import multiprocessing
+import numpy as np
+from six.moves.queue import Empty
+from multiprocessing.sharedctypes import RawArray
 
 try:
     import pyximport
@@ -9,10 +16,23 @@ try:
 
     pyximport.install(setup_args={"include_dirs": [models_dir, get_include()]})
     #import pyximport; pyximport.install()
-    from ext.gensim_wrapper.models.word2vec_inner import train_batch_sg_community
+    from ext.gensim_wrapper.models.word2vec_inner import train_batch_sg_community, train_batch_sg_community_indexed
+    from ext.gensim_wrapper.models.word2vec_inner import BatchBuffers
 except ImportError:
     raise ValueError("An error occurred while loading the optimized version!")
 
+# The interval in seconds at which the training processes are checked while no report arrives
+PROCESS_POLL_SECONDS = 1.0
+
+
+def shared_array(array):
+    """Return a float32 copy of the array in shared memory, which is shared by the processes forked afterwards."""
+    buffer = RawArray(ctypes.c_float, int(array.size))
+    shared = np.frombuffer(buffer, dtype=REAL).reshape(array.shape)
+    shared[:] = array
+
+    return shared
+
 
 class Word2VecWrapper(Word2Vec):
 
@@ -29,12 +49,39 @@ class Word2VecWrapper(Word2Vec):
 
     def train_community(self, number_of_communities, sentences, comm_embedding_size, total_examples=None,
                         total_words=None, epochs=None, start_alpha=None, end_alpha=None, word_count=0,
-                        queue_factor=2, report_delay=1.0, compute_loss=None):
+                        queue_factor=2, report_delay=1.0, compute_loss=None, indexed=False, community_weights=None,
+                        start_job=0, checkpoint_jobs=None, checkpoint_callback=None, processes=None, metrics=None,
+                        negative=10):
+        """
+        Train the community embeddings over the sentences of (node, community) pairs with the given number of
+        negative samples, which replaces the one of the node embeddings during the training. If indexed is True, the
+        sentences must provide the flat int32 arrays `indexes` and `communities` holding the vocabulary indexes of
+        the nodes and their community labels together with the walk `offsets` (see CombineIndexedSentences), and
+        they are trained by the pre-batched pipeline of _train_community_indexed.
+
+        The indexed pipeline can be checkpointed and resumed: checkpoint_callback(job_no) is called each time the
+        first job_no jobs have been completed, every checkpoint_jobs jobs (after each epoch by default), and the
+        training continues from the weights community_weights = (syn0_community, syn1neg) at the job start_job. The
+        given weights initialize the first rows, so the number of communities and the vocabulary may have grown since
+        they were trained. With a single worker, a resumed training reproduces an uninterrupted one exactly. With
+        several workers, the draws of the random generator and the lock-free updates interleave nondeterministically,
+        so it only continues from the same state.
+
+        If processes is greater than one, the indexed walks are trained by that many worker processes instead of the
+        worker threads, updating the weights in shared memory without locks. The job latencies, the per-epoch and the
+        per-worker throughputs of the indexed pipeline are recorded into metrics (see utils.metrics) if it is given.
+        """
 
         total_examples = self.corpus_count
         epochs = self.iter
         self.reset_community_weights(number_of_communities, comm_embedding_size)
-        self.negative=10
+        if community_weights is not None:
+            syn0_community, syn1neg = community_weights
+            self.wv.syn0_community[:len(syn0_community)] = syn0_community
+            self.syn1neg[:len(syn1neg)] = syn1neg
+        self.negative = negative
+        if indexed:
+            self.sample_ints = self.get_sample_ints()
 
         if (self.model_trimmed_post_training):
             raise RuntimeError("Parameters for training were discarded using model_trimmed_post_training method")
@@ -75,6 +122,16 @@ class Word2VecWrapper(Word2Vec):
         start_alpha = start_alpha or self.alpha
         end_alpha = end_alpha or self.min_alpha
 
+        if indexed:
+            return self._train_community_indexed(sentences, epochs, start_alpha, end_alpha, report_delay,
+                                                 start_job=start_job, checkpoint_jobs=checkpoint_jobs,
+                                                 checkpoint_callback=checkpoint_callback, processes=processes,
+                                                 metrics=metrics)
+        if start_job > 0 or checkpoint_callback is not None:
+            raise ValueError("The community training can be checkpointed only over indexed walks!")
+        if processes is not None and processes > 1:
+            raise ValueError("The community training can be run by multiple processes only over indexed walks!")
+
         job_tally = 0
 
         if epochs > 1:
@@ -86,6 +143,8 @@ class Word2VecWrapper(Word2Vec):
             """Train the model, lifting lists of sentences from the job_queue."""
             work = matutils.zeros_aligned(self.layer1_size, dtype=REAL)  # per-thread private work memory
             neu1 = matutils.zeros_aligned(self.layer1_size, dtype=REAL)
+            # per-thread token buffers, sized for the jobs of batch_words words
+            buffers = BatchBuffers(self.batch_words, hs=self.hs)
             jobs_processed = 0
             while True:
                 job = job_queue.get()
@@ -93,9 +152,11 @@ class Word2VecWrapper(Word2Vec):
                     progress_queue.put(None)
                     break  # no more jobs => quit this worker
                 sentences, alpha = job
-                tally, raw_tally = self._do_train_community_job(sentences, alpha, (work, neu1))
+                overflows = buffers.overflows
+                tally, raw_tally = self._do_train_community_job(sentences, alpha, (work, neu1, buffers))
                 #tally, raw_tally = self._do_train_job(sentences, alpha, (work, neu1))
-                progress_queue.put((len(sentences), tally, raw_tally))  # report back progress
+                # report back progress
+                progress_queue.put((len(sentences), tally, raw_tally, buffers.overflows - overflows))
                 jobs_processed += 1
             logger.debug("worker exiting, processed %i jobs", jobs_processed)
 
@@ -175,7 +236,7 @@ class Word2VecWrapper(Word2Vec):
             thread.daemon = True  # make interrupting the process with ctrl+c easier
             thread.start()
 
-        example_count, trained_word_count, raw_word_count = 0, 0, word_count
+        example_count, trained_word_count, raw_word_count, overflow_count = 0, 0, word_count, 0
         start, next_report = default_timer() - 0.00001, 1.0
 
         while unfinished_worker_count > 0:
@@ -184,13 +245,14 @@ class Word2VecWrapper(Word2Vec):
                 unfinished_worker_count -= 1
                 logger.info("worker thread finished; awaiting finish of %i more threads", unfinished_worker_count)
                 continue
-            examples, trained_words, raw_words = report
+            examples, trained_words, raw_words, overflows = report
             job_tally += 1
 
             # update progress stats
             example_count += examples
             trained_word_count += trained_words  # only words in vocab & sampled
             raw_word_count += raw_words
+            overflow_count += overflows
 
             # log progress once every report_delay seconds
             elapsed = default_timer() - start
@@ -214,6 +276,7 @@ class Word2VecWrapper(Word2Vec):
         logger.info(
             "training on %i raw words (%i effective words) took %.1fs, %.0f effective words/s",
             raw_word_count, trained_word_count, elapsed, trained_word_count / elapsed)
+        self._report_buffer_overflows(overflow_count, metrics)
         if job_tally < 10 * self.workers:
             logger.warning(
                 "under 10 jobs per worker: consider setting a smaller `batch_words' for smoother alpha decay"
@@ -234,21 +297,274 @@ class Word2VecWrapper(Word2Vec):
         self.clear_sims()
         return trained_word_count
 
+    def _train_community_indexed(self, sentences, epochs, start_alpha, end_alpha, report_delay=1.0, start_job=0,
+                                 checkpoint_jobs=None, checkpoint_callback=None, processes=None, metrics=None):
+        """
+        Train the community embeddings over walks stored in flat arrays. The job boundaries and the learning rates
+        of all epochs are computed once by a JobSchedule, and each worker thread pulls the next job number and trains
+        on the corresponding walk range of the shared arrays, so there is no producer thread feeding the workers.
+        The jobs from start_job on are run in segments of checkpoint_jobs jobs, and checkpoint_callback is called
+        with the end of each segment once all of its jobs have been completed.
+
+        With processes > 1, the workers are forked processes instead of threads, so that the Python code between the
+        jobs does not serialize them on the GIL. syn0_community and syn1neg are moved into shared memory for the
+        training and updated Hogwild-style by all processes, the walk arrays are shared copy-on-write, and the next
+        job number is a shared counter.
+        """
+        if not self.sg:
+            raise ValueError("It has not been implemented for CBOW!")
+
+        schedule = JobSchedule(sentences.offsets, self.batch_words, epochs, start_alpha, end_alpha)
+        total_examples = len(sentences) * epochs
+        checkpoint_jobs = checkpoint_jobs or schedule.jobs_per_epoch
+
+        if start_alpha > self.min_alpha_yet_reached:
+            logger.warning("Effective 'alpha' higher than previous training cycles")
+        self.min_alpha_yet_reached = start_alpha
+
+        def train_job(job_no, work, buffers, worker_no, wait_time):
+            # The report of a job: the walks, the effective and the raw words, the times spent waiting for the job
+            # and in the compiled training function, and whether the job has overflowed the token buffers
+            walk_start, walk_end, alpha = schedule.job(job_no)
+            overflows = buffers.overflows
+            job_time = default_timer()
+            tally = train_batch_sg_community_indexed(self, sentences.indexes, sentences.communities,
+                                                     sentences.offsets, walk_start, walk_end, alpha, work,
+                                                     self.compute_loss, buffers)
+            return (walk_end - walk_start, tally, schedule.number_of_words(walk_start, walk_end), worker_no, job_no,
+                    wait_time, default_timer() - job_time, buffers.overflows - overflows)
+
+        def worker_loop(worker_no, job_numbers, job_lock, progress_queue):
+            """Train the model on the walk ranges of the scheduled jobs."""
+            work = matutils.zeros_aligned(self.layer1_size, dtype=REAL)  # per-thread private work memory
+            buffers = BatchBuffers(self.batch_words)  # per-thread token buffers
+            jobs_processed = 0
+            while True:
+                wait_time = default_timer()
+                with job_lock:
+                    job_no = next(job_numbers, None)
+                if job_no is None:
+                    progress_queue.put(None)
+                    break  # no more jobs => quit this worker
+                progress_queue.put(train_job(job_no, work, buffers, worker_no, default_timer() - wait_time))
+                jobs_processed += 1
+            logger.debug("worker exiting, processed %i jobs", jobs_processed)
+
+        def process_loop(worker_no, next_job, segment_end, seed, progress_queue):
+            """Train the model on the walk ranges of the jobs taken from the shared job counter."""
+            try:
+                # The processes are forked with the same generator, so each one is reseeded
+                self.random = np.random.RandomState(seed)
+                work = matutils.zeros_aligned(self.layer1_size, dtype=REAL)  # per-process private work memory
+                buffers = BatchBuffers(self.batch_words)  # per-process token buffers
+                while True:
+                    wait_time = default_timer()
+                    with next_job.get_lock():
+                        job_no = next_job.value
+                        next_job.value += 1
+                    if job_no >= segment_end:
+                        break
+                    progress_queue.put(train_job(job_no, work, buffers, worker_no, default_timer() - wait_time))
+            finally:
+                progress_queue.put(None)
+
+        use_processes = processes is not None and processes > 1
+        if use_processes:
+            context = multiprocessing.get_context('fork')
+            self.wv.syn0_community = shared_array(self.wv.syn0_community)
+            self.syn1neg = shared_array(self.syn1neg)
+
+        example_count, trained_word_count, raw_word_count, overflow_count = 0, 0, 0, 0
+        start, next_report = default_timer() - 0.00001, 1.0
+        # The effective words and the training time of each worker, and the words, the examples and the remaining
+        # jobs of each epoch
+        worker_words, worker_times = {}, {}
+        epoch_words, epoch_examples, epoch_start_times = {}, {}, {}
+        epoch_jobs = {epoch: min((epoch + 1) * schedule.jobs_per_epoch, len(schedule)) -
+                     max(epoch * schedule.jobs_per_epoch, start_job)
+                     for epoch in xrange(start_job // schedule.jobs_per_epoch, epochs)} if len(schedule) else {}
+
+        try:
+            for segment_start in xrange(start_job, len(schedule), checkpoint_jobs):
+                segment_end = min(segment_start + checkpoint_jobs, len(schedule))
+
+                if use_processes:
+                    next_job = context.Value('q', segment_start)
+                    progress_queue = context.Queue()
+                    seeds = self.random.randint(0, 2 ** 31 - 1, size=processes)
+                    workers = [context.Process(target=process_loop, name="community-process-{}".format(i),
+                                               args=(i, next_job, segment_end, seed, progress_queue))
+                               for i, seed in enumerate(seeds)]
+                else:
+                    job_numbers = iter(xrange(segment_start, segment_end))
+                    job_lock = threading.Lock()
+                    progress_queue = Queue()
+                    # The named threads can be told apart in the dumps of py-spy
+                    workers = [threading.Thread(target=worker_loop, name="community-worker-{}".format(i),
+                                                args=(i, job_numbers, job_lock, progress_queue))
+                               for i in xrange(self.workers)]
+                unfinished_worker_count = len(workers)
+                for worker in workers:
+                    worker.daemon = True  # make interrupting the process with ctrl+c easier
+                    worker.start()
+
+                next_poll = default_timer() + PROCESS_POLL_SECONDS
+                while unfinished_worker_count > 0:
+                    if use_processes:
+                        # A process killed by a signal, e.g. by the OOM killer, never reports that it finished
+                        if default_timer() >= next_poll:
+                            next_poll = default_timer() + PROCESS_POLL_SECONDS
+                            if any(worker.exitcode not in (None, 0) for worker in workers):
+                                for worker in workers:
+                                    worker.terminate()
+                                    worker.join()
+                                raise ValueError("A community training process has died!")
+                        try:
+                            report = progress_queue.get(timeout=PROCESS_POLL_SECONDS)
+                        except Empty:
+                            continue
+                    else:
+                        report = progress_queue.get()
+                    if report is None:  # a worker reporting that it finished
+                        unfinished_worker_count -= 1
+                        logger.debug("worker finished; awaiting finish of %i more workers", unfinished_worker_count)
+                        continue
+                    examples, trained_words, raw_words, worker_no, job_no, wait_time, job_time, overflows = report
+
+                    # update progress stats
+                    example_count += examples
+                    trained_word_count += trained_words  # only words in vocab & sampled
+                    raw_word_count += raw_words
+                    overflow_count += overflows
+
+                    if metrics is not None:
+                        metrics.observe('community.job_seconds', job_time)
+                        metrics.observe('community.job_wait_seconds', wait_time)
+                        metrics.observe('community.progress_queue_depth', utils.qsize(progress_queue),
+                                        bounds=COUNT_BOUNDS)
+                        worker_words[worker_no] = worker_words.get(worker_no, 0) + trained_words
+                        worker_times[worker_no] = worker_times.get(worker_no, 0.0) + job_time
+                        epoch = job_no // schedule.jobs_per_epoch
+                        epoch_start_times.setdefault(epoch, default_timer() - job_time)
+                        epoch_words[epoch] = epoch_words.get(epoch, 0) + trained_words
+                        epoch_examples[epoch] = epoch_examples.get(epoch, 0) + examples
+                        epoch_jobs[epoch] -= 1
+                        if epoch_jobs[epoch] == 0:
+                            # The jobs of an epoch are completed out of order, so its time spans its first and last job
+                            epoch_time = default_timer() - epoch_start_times[epoch]
+                            metrics.increment('community.epochs')
+                            metrics.emit('epoch', stage='community_embeddings', epoch=epoch,
+                                         examples=epoch_examples[epoch], effective_words=epoch_words[epoch],
+                                         seconds=epoch_time, words_per_sec=epoch_words[epoch] / max(epoch_time, 1e-9))
+
+                    # log progress once every report_delay seconds
+                    elapsed = default_timer() - start
+                    if elapsed >= next_report:
+                        logger.info(
+                            "PROGRESS: at %.2f%% examples, %.0f words/s, out_qsize %i",
+                            100.0 * example_count / total_examples, trained_word_count / elapsed,
+                            utils.qsize(progress_queue))
+                        next_report = elapsed + report_delay
+
+                if use_processes:
+                    for worker in workers:
+                        worker.join()
+                    if any(worker.exitcode != 0 for worker in workers):
+                        raise ValueError("A community training process has failed!")
+
+                if checkpoint_callback is not None:
+                    checkpoint_callback(segment_end)
+        finally:
+            if use_processes:
+                # Move the weights back into private memory
+                self.wv.syn0_community = np.array(self.wv.syn0_community)
+                self.syn1neg = np.array(self.syn1neg)
+
+        # all done; report the final stats
+        elapsed = default_timer() - start
+        logger.info(
+            "training on %i raw words (%i effective words) took %.1fs, %.0f effective words/s",
+            raw_word_count, trained_word_count, elapsed, trained_word_count / elapsed)
+        self._report_buffer_overflows(overflow_count, metrics)
+        if metrics is not None:
+            metrics.increment('community.examples', example_count)
+            metrics.increment('community.effective_words', trained_word_count)
+            metrics.increment('community.raw_words', raw_word_count)
+            # The time of the workers outside the compiled function is spent in Python, waiting for the jobs,
+            # reporting them and in the checkpoints
+            for worker_no in sorted(worker_words):
+                metrics.emit('worker', stage='community_embeddings', worker=worker_no,
+                             effective_words=worker_words[worker_no], kernel_seconds=worker_times[worker_no],
+                             outside_kernel_seconds=max(elapsed - worker_times[worker_no], 0.0),
+                             words_per_sec=worker_words[worker_no] / max(elapsed, 1e-9))
+            metrics.emit('training', stage='community_embeddings', examples=example_count,
+                         effective_words=trained_word_count, raw_words=raw_word_count, seconds=elapsed,
+                         words_per_sec=trained_word_count / elapsed, buffer_overflows=overflow_count,
+                         processes=use_processes,
+                         workers=processes if use_processes else self.workers)
+        if len(schedule) < 10 * (processes if use_processes else self.workers):
+            logger.warning(
+                "under 10 jobs per worker: consider setting a smaller `batch_words' for smoother alpha decay"
+            )
+
+        self.train_count += 1  # number of times train() has been called
+        self.total_train_time += elapsed
+        self.clear_sims()
+        return trained_word_count
+
     def _do_train_community_job(self, sentences, alpha, inits):
         """
         Train a single batch of sentences. Return 2-tuple `(effective word count after
         ignoring unknown words and sentence length trimming, total word count)`.
         """
-        work, neu1 = inits
+        work, neu1, buffers = inits
         tally = 0
         if self.sg:
-            tally += train_batch_sg_community(self, sentences, alpha, work, self.compute_loss)
+            tally += train_batch_sg_community(self, sentences, alpha, work, self.compute_loss, buffers)
         else:
             raise ValueError("It has not been implemented for CBOW!")
             #tally += train_batch_cbow_topic(self, sentences, alpha, work, neu1, self.compute_loss)
         return tally, self._raw_word_count(sentences)
 
+    def _report_buffer_overflows(self, overflow_count, metrics=None):
+        """
+        Keep the number of jobs of the last training longer than batch_words, for which the token buffers of the
+        workers have been grown, in buffer_overflows.
+        """
+        self.buffer_overflows = overflow_count
+        if overflow_count > 0:
+            logger.info("%i jobs were longer than batch_words=%i, the token buffers have been grown for them",
+                        overflow_count, self.batch_words)
+        if metrics is not None:
+            metrics.increment('community.buffer_overflows', overflow_count)
+
+    def get_sample_ints(self):
+        """Return the downsampling thresholds of the words as an array indexed by the vocabulary indexes."""
+        sample_ints = zeros(len(self.wv.vocab), dtype=uint32)
+        for word in itervalues(self.wv.vocab):
+            sample_ints[word.index] = word.sample_int
+        return sample_ints
+
+    def get_token2index(self):
+        """Return the dictionary mapping the words to their vocabulary indexes."""
+        return {word: vocab.index for word, vocab in iteritems(self.wv.vocab)}
+
+    def use_node_weights(self):
+        """
+        Switch the output weights, the layer sizes and the number of negative samples back to the ones of the node
+        embeddings after the community training, so that the node embeddings can be trained further. The output
+        weights of the community embeddings are kept in syn1neg_community.
+        """
+        if getattr(self, 'syn1neg_node', None) is not None:
+            self.syn1neg_community = self.syn1neg
+            self.syn1neg, self.syn1neg_node = self.syn1neg_node, None
+            self.negative = self.negative_node
+        self.layer1_size = self.vector_size = self.wv.syn0.shape[1]
+
     def reset_community_weights(self, number_of_communities, comm_embedding_size):
+        # Keep the output weights of the node embeddings, which are replaced by the ones of the community embeddings
+        if getattr(self, 'syn1neg_node', None) is None:
+            self.syn1neg_node, self.negative_node = self.syn1neg, self.negative
         self.layer1_size = comm_embedding_size
         self.vector_size = comm_embedding_size
         """Reset all projection weights to an initial (untrained) state, but keep the existing vocabulary."""
@@ -245,6 +245,109 @@ cdef unsigned long long fast_sentence_sg_neg_community(
 
     return next_random
 
+DEF MAX_BATCHED_NEGATIVE = 64
+
+# The largest vector size trained by the batched negative sampling kernel, the BLAS kernel is used above it
+cdef int batched_negative_max_size = 128
+
+cdef inline REAL_t small_dot(const int size, const REAL_t *x, const REAL_t *y) nogil:
+    # Dot product with four independent accumulators, so that the loop is unrolled and vectorized by the compiler
+    cdef int k
+    cdef int end = size - size % 4
+    cdef REAL_t s0 = 0.0, s1 = 0.0, s2 = 0.0, s3 = 0.0
+    for k in range(0, end, 4):
+        s0 += x[k] * y[k]
+        s1 += x[k + 1] * y[k + 1]
+        s2 += x[k + 2] * y[k + 2]
+        s3 += x[k + 3] * y[k + 3]
+    for k in range(end, size):
+        s0 += x[k] * y[k]
+    return (s0 + s1) + (s2 + s3)
+
+cdef inline void small_axpy(const int size, const REAL_t a, const REAL_t *x, REAL_t *y) nogil:
+    cdef int k
+    for k in range(size):
+        y[k] += a * x[k]
+
+cdef unsigned long long fast_sentence_sg_neg_community_batched(
+    const int negative, np.uint32_t *cum_table, unsigned long long cum_table_len,
+    REAL_t *syn0_community, REAL_t *syn1neg, const int size, const np.uint32_t word_index,
+    const np.uint32_t word2_index, const REAL_t alpha, REAL_t *work,
+    unsigned long long next_random, REAL_t *word_locks_community,
+    const int _compute_loss, REAL_t *_running_training_loss_param) nogil:
+    """
+    Same update as fast_sentence_sg_neg_community for small vectors, without a BLAS call per target. The positive
+    and the negative targets are drawn first, their scores are computed against the gathered rows of syn1neg at once
+    and the gradients are applied afterwards: work accumulates the gradient-weighted rows and each row is updated by
+    the community vector. The random draws are the same, so the result only differs when a negative target is drawn
+    twice, whose second score is then computed before the first update.
+    """
+
+    cdef long long row1 = word2_index * size
+    cdef unsigned long long modulo = 281474976710655ULL
+    cdef REAL_t f, label, f_dot, log_e_f_dot
+    cdef np.uint32_t target_index
+    cdef np.uint32_t targets[MAX_BATCHED_NEGATIVE + 1]
+    cdef REAL_t gradients[MAX_BATCHED_NEGATIVE + 1]
+    cdef int d, number_of_targets = 0
+    cdef REAL_t *community = &syn0_community[row1]
+
+    # The positive target and the drawn negative ones
+    for d in range(negative+1):
+        if d == 0:
+            target_index = word_index
+        else:
+            target_index = bisect_left(cum_table, (next_random >> 16) % cum_table[cum_table_len-1], 0, cum_table_len)
+            next_random = (next_random * <unsigned long long>25214903917ULL + 11) & modulo
+            if target_index == word_index:
+                continue
+        targets[number_of_targets] = target_index
+        number_of_targets += 1
+
+    # The scores and the gradients of all targets
+    for d in range(number_of_targets):
+        label = ONEF if d == 0 else <REAL_t>0.0
+        gradients[d] = <REAL_t>0.0
+        f_dot = small_dot(size, community, &syn1neg[<long long>targets[d] * size])
+        if f_dot <= -MAX_EXP or f_dot >= MAX_EXP:
+            continue
+        f = EXP_TABLE[<int>((f_dot + MAX_EXP) * (EXP_TABLE_SIZE / MAX_EXP / 2))]
+
+        if _compute_loss == 1:
+            f_dot = (f_dot if d == 0  else -f_dot)
+            if f_dot <= -MAX_EXP or f_dot >= MAX_EXP:
+                continue
+            log_e_f_dot = LOG_TABLE[<int>((f_dot + MAX_EXP) * (EXP_TABLE_SIZE / MAX_EXP / 2))]
+            _running_training_loss_param[0] = _running_training_loss_param[0] - log_e_f_dot
+
+        gradients[d] = (label - f) * alpha
+
+    # work = gathered rows^T . gradients, then the rows are updated
+    memset(work, 0, size * cython.sizeof(REAL_t))
+    for d in range(number_of_targets):
+        if gradients[d] != 0.0:
+            small_axpy(size, gradients[d], &syn1neg[<long long>targets[d] * size], work)
+    for d in range(number_of_targets):
+        if gradients[d] != 0.0:
+            small_axpy(size, gradients[d], community, &syn1neg[<long long>targets[d] * size])
+
+    small_axpy(size, word_locks_community[word2_index], work, community)
+
+    return next_random
+
+cdef inline int use_batched_negative(const int negative, const int size):
+    return negative <= MAX_BATCHED_NEGATIVE and size <= batched_negative_max_size
+
+def set_batched_negative_max_size(max_size):
+    """
+    Set the largest vector size trained by the batched negative sampling kernel of the community embeddings, 0 for
+    always using the BLAS kernel. Return the previous value.
+    """
+    global batched_negative_max_size
+    previous = batched_negative_max_size
+    batched_negative_max_size = max_size
+    return previous
+
 cdef void fast_sentence_cbow_hs(
     const np.uint32_t *word_point, const np.uint8_t *word_code, int codelens[MAX_SENTENCE_LEN],
     REAL_t *neu1, REAL_t *syn0, REAL_t *syn1, const int size,
@@ -371,6 +474,49 @@ cdef unsigned long long fast_sentence_cbow_neg(
     return next_random
 
 
+class BatchBuffers(object):
+    """
+    Reusable arrays of a worker holding the tokens of its jobs for the sg community batch functions, instead of C
+    arrays of MAX_SENTENCE_LEN words on the stack. They are grown whenever a job has more words than them, and
+    overflows counts these jobs, whose words beyond MAX_SENTENCE_LEN used to be dropped. The pointers of the
+    hierarchical softmax codes and points are only allocated if hs is True.
+    """
+
+    def __init__(self, capacity=MAX_SENTENCE_LEN, hs=False):
+        self.hs = hs
+        self.overflows = 0
+        self.capacity = 0
+        self._allocate(max(int(capacity), 1))
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.indexes = np.empty(capacity, dtype=np.uint32)
+        self.indexes_community = np.empty(capacity, dtype=np.uint32)
+        self.reduced_windows = np.empty(capacity, dtype=np.uint32)
+        # A non-empty sentence has at least one word, so there are at most capacity sentences
+        self.sentence_idx = np.empty(capacity + 1, dtype=np.int32)
+        if self.hs:
+            self.codelens = np.empty(capacity, dtype=np.int32)
+            self.points = np.empty(capacity, dtype=np.uintp)
+            self.codes = np.empty(capacity, dtype=np.uintp)
+
+    def reserve(self, number_of_words):
+        """Make the buffers large enough for a job of the given number of words, counting it as an overflow."""
+        if number_of_words > self.capacity:
+            self.overflows += 1
+            self._allocate(max(number_of_words, 2 * self.capacity))
+
+
+def job_buffers(buffers, number_of_words, hs=False):
+    """Return the buffers given by the caller, grown for the job if needed, or new ones for this job only."""
+    if buffers is None:
+        return BatchBuffers(number_of_words, hs)
+    if hs and not buffers.hs:
+        raise ValueError("The buffers have been allocated without the arrays of the hierarchical softmax!")
+    buffers.reserve(number_of_words)
+    return buffers
+
+
 def train_batch_sg(model, sentences, alpha, _work, compute_loss):
     cdef int hs = model.hs
     cdef int negative = model.negative
@@ -477,7 +623,7 @@ def train_batch_sg(model, sentences, alpha, _work, compute_loss):
     model.running_training_loss = _running_training_loss
     return effective_words
 
-def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
+def train_batch_sg_community(model, sentences, alpha, _work, compute_loss, buffers=None):
     cdef int hs = model.hs
     cdef int negative = model.negative
     cdef int sample = (model.sample != 0)
@@ -490,12 +636,13 @@ def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
     cdef REAL_t *work
     cdef REAL_t _alpha = alpha
     cdef int size = model.layer1_size
+    cdef int batched = use_batched_negative(negative, size)
 
-    cdef int codelens[MAX_SENTENCE_LEN]
-    cdef np.uint32_t indexes[MAX_SENTENCE_LEN]
-    cdef np.uint32_t indexes_community[MAX_SENTENCE_LEN]
-    cdef np.uint32_t reduced_windows[MAX_SENTENCE_LEN]
-    cdef int sentence_idx[MAX_SENTENCE_LEN + 1]
+    cdef int *codelens
+    cdef np.uint32_t *indexes
+    cdef np.uint32_t *indexes_community
+    cdef np.uint32_t *reduced_windows
+    cdef int *sentence_idx
     cdef int window = model.window
 
     cdef int i, j, k
@@ -504,8 +651,8 @@ def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
 
     # For hierarchical softmax
     cdef REAL_t *syn1
-    cdef np.uint32_t *points[MAX_SENTENCE_LEN]
-    cdef np.uint8_t *codes[MAX_SENTENCE_LEN]
+    cdef np.uint32_t **points
+    cdef np.uint8_t **codes
 
     # For negative sampling
     cdef REAL_t *syn1neg
@@ -527,6 +674,17 @@ def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
     # convert Python structures to primitive types, so we can release the GIL
     work = <REAL_t *>np.PyArray_DATA(_work)
 
+    # the reusable buffers of the worker, grown to the number of words of the job
+    buffers = job_buffers(buffers, sum(len(sent) for sent in sentences), hs)
+    indexes = <np.uint32_t *>np.PyArray_DATA(buffers.indexes)
+    indexes_community = <np.uint32_t *>np.PyArray_DATA(buffers.indexes_community)
+    reduced_windows = <np.uint32_t *>np.PyArray_DATA(buffers.reduced_windows)
+    sentence_idx = <int *>np.PyArray_DATA(buffers.sentence_idx)
+    if hs:
+        codelens = <int *>np.PyArray_DATA(buffers.codelens)
+        points = <np.uint32_t **>np.PyArray_DATA(buffers.points)
+        codes = <np.uint8_t **>np.PyArray_DATA(buffers.codes)
+
     # prepare C structures so we can go "full C" and release the Python GIL
     vlookup = model.wv.vocab
     sentence_idx[0] = 0  # indices of the first sentence always start at 0
@@ -546,8 +704,6 @@ def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
                 codes[effective_words] = <np.uint8_t *>np.PyArray_DATA(word.code)
                 points[effective_words] = <np.uint32_t *>np.PyArray_DATA(word.point)
             effective_words += 1
-            if effective_words == MAX_SENTENCE_LEN:
-                break  # TODO: log warning, tally overflow?
 
         # keep track of which words go into which sentence, so we don't train
         # across sentence boundaries.
@@ -555,9 +711,6 @@ def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
         effective_sentences += 1
         sentence_idx[effective_sentences] = effective_words
 
-        if effective_words == MAX_SENTENCE_LEN:
-            break  # TODO: log warning, tally overflow?
-
     # precompute "reduced window" offsets in a single randint() call
     for i, item in enumerate(model.random.randint(0, window, effective_words)):
         reduced_windows[i] = item
@@ -579,12 +732,128 @@ def train_batch_sg_community(model, sentences, alpha, _work, compute_loss):
                         continue
                     if hs:
                         fast_sentence_sg_hs_community(points[i], codes[i], codelens[i], syn0_community, syn1, size, indexes_community[j], _alpha, work, word_locks_community, _compute_loss, &_running_training_loss)
-                    if negative:
+                    if negative and batched:
+                        next_random = fast_sentence_sg_neg_community_batched(negative, cum_table, cum_table_len, syn0_community, syn1neg, size, indexes[i], indexes_community[j], _alpha, work, next_random, word_locks_community, _compute_loss, &_running_training_loss)
+                    elif negative:
                         next_random = fast_sentence_sg_neg_community(negative, cum_table, cum_table_len, syn0_community, syn1neg, size, indexes[i], indexes_community[j], _alpha, work, next_random, word_locks_community, _compute_loss, &_running_training_loss)
 
     model.running_training_loss = _running_training_loss
     return effective_words
 
+def train_batch_sg_community_indexed(model, indexes, communities, offsets, walk_start, walk_end, alpha, _work, compute_loss, buffers=None):
+    """
+    Integer-native variant of train_batch_sg_community. The walks are given as flat int32 arrays of the vocabulary
+    indexes of the nodes and of their community labels, the i-th walk lying in [offsets[i], offsets[i+1]). The walks
+    in [walk_start, walk_end) are trained, so the job is only an index range over the shared arrays and the tokens
+    are read without any vocabulary lookup or Python object. Negative indexes mark tokens out of the vocabulary.
+    Only negative sampling is supported.
+    """
+    cdef int hs = model.hs
+    cdef int negative = model.negative
+    cdef int sample = (model.sample != 0)
+
+    cdef int _compute_loss = (1 if compute_loss == True else 0)
+    cdef REAL_t _running_training_loss = model.running_training_loss
+
+    cdef REAL_t *syn0_community = <REAL_t *>(np.PyArray_DATA(model.wv.syn0_community))
+    cdef REAL_t *word_locks_community = <REAL_t *>(np.PyArray_DATA(model.syn0_lockf))
+    cdef np.uint32_t *sample_ints = <np.uint32_t *>(np.PyArray_DATA(model.sample_ints))
+    cdef REAL_t *work
+    cdef REAL_t _alpha = alpha
+    cdef int size = model.layer1_size
+    cdef int batched = use_batched_negative(negative, size)
+
+    cdef np.uint32_t *indexes_node
+    cdef np.uint32_t *indexes_community
+    cdef np.uint32_t *reduced_windows
+    cdef int *sentence_idx
+    cdef int window = model.window
+
+    cdef int i, j, k
+    cdef int effective_words = 0, effective_sentences = 0
+    cdef int sent_idx, idx_start, idx_end
+    cdef const np.int32_t [:] _indexes = indexes
+    cdef const np.int32_t [:] _communities = communities
+    cdef const np.int64_t [:] _offsets = offsets
+    cdef long long w, t, _walk_start = walk_start, _walk_end = walk_end
+    cdef np.int32_t word_index
+
+    # For negative sampling
+    cdef REAL_t *syn1neg
+    cdef np.uint32_t *cum_table
+    cdef unsigned long long cum_table_len
+    # for sampling (negative and frequent-word downsampling)
+    cdef unsigned long long next_random
+
+    if hs:
+        raise ValueError("The indexed community training has not been implemented for hierarchical softmax!")
+
+    if negative:
+        syn1neg = <REAL_t *>(np.PyArray_DATA(model.syn1neg))
+        cum_table = <np.uint32_t *>(np.PyArray_DATA(model.cum_table))
+        cum_table_len = len(model.cum_table)
+    if negative or sample:
+        next_random = (2**24) * model.random.randint(0, 2**24) + model.random.randint(0, 2**24)
+
+    # convert Python structures to primitive types, so we can release the GIL
+    work = <REAL_t *>np.PyArray_DATA(_work)
+
+    # the reusable buffers of the worker, grown to the number of tokens of the job
+    buffers = job_buffers(buffers, offsets[walk_end] - offsets[walk_start])
+    indexes_node = <np.uint32_t *>np.PyArray_DATA(buffers.indexes)
+    indexes_community = <np.uint32_t *>np.PyArray_DATA(buffers.indexes_community)
+    reduced_windows = <np.uint32_t *>np.PyArray_DATA(buffers.reduced_windows)
+    sentence_idx = <int *>np.PyArray_DATA(buffers.sentence_idx)
+
+    # copy the tokens of the job into the C structures, no Python object is involved
+    with nogil:
+        sentence_idx[0] = 0  # indices of the first sentence always start at 0
+        for w in range(_walk_start, _walk_end):
+            if _offsets[w + 1] == _offsets[w]:
+                continue  # ignore empty sentences; leave effective_sentences unchanged
+            for t in range(_offsets[w], _offsets[w + 1]):
+                word_index = _indexes[t]
+                if word_index < 0:
+                    continue  # leaving `effective_words` unchanged = shortening the sentence = expanding the window
+                if sample and sample_ints[word_index] < random_int32(&next_random):
+                    continue
+                indexes_community[effective_words] = <np.uint32_t>_communities[t]
+                indexes_node[effective_words] = <np.uint32_t>word_index
+                effective_words += 1
+
+            # keep track of which words go into which sentence, so we don't train
+            # across sentence boundaries.
+            # indices of sentence number X are between <sentence_idx[X], sentence_idx[X])
+            effective_sentences += 1
+            sentence_idx[effective_sentences] = effective_words
+
+    # precompute "reduced window" offsets in a single randint() call
+    for i, item in enumerate(model.random.randint(0, window, effective_words)):
+        reduced_windows[i] = item
+
+    # release GIL & train on all sentences
+    with nogil:
+        for sent_idx in range(effective_sentences):
+            idx_start = sentence_idx[sent_idx]
+            idx_end = sentence_idx[sent_idx + 1]
+            for i in range(idx_start, idx_end):
+                j = i - window + reduced_windows[i]
+                if j < idx_start:
+                    j = idx_start
+                k = i + window + 1 - reduced_windows[i]
+                if k > idx_end:
+                    k = idx_end
+                for j in range(j, k):
+                    if j == i:
+                        continue
+                    if negative and batched:
+                        next_random = fast_sentence_sg_neg_community_batched(negative, cum_table, cum_table_len, syn0_community, syn1neg, size, indexes_node[i], indexes_community[j], _alpha, work, next_random, word_locks_community, _compute_loss, &_running_training_loss)
+                    elif negative:
+                        next_random = fast_sentence_sg_neg_community(negative, cum_table, cum_table_len, syn0_community, syn1neg, size, indexes_node[i], indexes_community[j], _alpha, work, next_random, word_locks_community, _compute_loss, &_running_training_loss)
+
+    model.running_training_loss = _running_training_loss
+    return effective_words
+
 def train_batch_cbow(model, sentences, alpha, _work, _neu1, compute_loss):
     cdef int hs = model.hs
     cdef int negative = model.negative
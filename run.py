@@ -1,7 +1,10 @@
 import networkx as nx
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from utils.tools import read_corpus_file
+from utils.corpus import load_corpus
+from utils.graph import load_csr_graph
+from tne.walks import generate_walks
 from tne.tne import TNE
+from utils.export import EXPORT_FORMATS
 from consts import *
 
 
@@ -21,37 +24,96 @@ def process(args):
     params['lda_alpha'] = 50 / float(params['number_of_comms']) if args.lda_alpha == 0 else args.lda_alpha  # Default is 50 / K
     params['lda_beta'] = args.lda_beta  # Default is 0.1
     params['lda_number_of_iters'] = args.lda_iter_num  # Default is 1000
+    params['lda_engine'] = args.lda_engine
+    # Parameters for the parallel Louvain method
+    params['louvain_resolution'] = args.resolution
+    params['louvain_seed'] = args.seed
     # Parameters for BayesianHMM
     params['bayesianhmm_number_of_steps'] = args.hmm_steps
+    params['hmm_chains'] = args.hmm_chains
+    params['hmm_tolerance'] = args.hmm_tolerance
+    if args.hmm_cores is not None:
+        params['hmm_cores'] = args.hmm_cores
     # Set the graph path, it might be required by some methods.
     params['graph_path'] = args.graph_path
 
     params['alpha'] = args.alpha
     params['min_alpha'] = args.min_alpha
     params['iter'] = args.iter
-
-    # Read the walks
-    walks = read_corpus_file(args.corpus)
+    params['sparse_phi'] = args.sparse_phi
+    params['community_cache'] = args.comm_cache
+    params['community_cache_size'] = int(args.comm_cache_size * (1 << 20))
+    params['checkpoint_path'] = args.checkpoint_path
+    params['concurrent_stages'] = args.concurrent_stages
+    if args.node_workers is not None:
+        params['node_workers'] = args.node_workers
+    if args.community_workers is not None:
+        params['community_workers'] = args.community_workers
+    if args.comm_processes is not None:
+        params['community_processes'] = args.comm_processes
+    params['metrics_path'] = args.metrics
+    params['profile_path'] = args.profile
+    params['graph_snapshot'] = not args.no_graph_snapshot
+
+    graph = None
+    if args.corpus is not None:
+        # Open the walks as a streaming corpus, so that they are not loaded into the memory at once
+        walks = load_corpus(args.corpus)
+    else:
+        # Generate the walks over the graph, which is then shared with the community detection methods
+        graph = load_csr_graph(args.graph_path, snapshot=params['graph_snapshot'])
+        walks = generate_walks(graph=graph, number_of_walks=args.num_walks, walk_length=args.walk_length, p=args.p,
+                               q=args.q, workers=args.workers)
+        if args.walks_path is not None:
+            walks.save(args.walks_path)
     # Call the main class
-    tne = TNE(walks=walks, params=params, suffix=args.suffix)
-    # Save the embedding file
-    tne.write_embeddings(embedding_file_path=args.emb, concatenate_method="average")
+    tne = TNE(walks=walks, params=params, suffix=args.suffix, graph=graph)
+    try:
+        tne.learn_embeddings(last_stage=args.last_stage)
+        if args.last_stage < 3:
+            return
+        # Save the embedding file
+        tne.write_embeddings(embedding_file_path=args.emb, concatenate_method="average", file_format=args.emb_format,
+                             float16=args.float16)
+    finally:
+        tne.metrics.close()
 
 
 def parse_arguments():
     parser = ArgumentParser(description="TNE: Topical Node Embeddings",
                             formatter_class=ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('--corpus', type=str, required=True, help='The path of corpus file.')
+    parser.add_argument('--corpus', type=str, required=False,
+                        help='The path of corpus file, either a text file or the prefix of a binary corpus. '
+                             'If it is not given, the walks are generated over the graph.')
 
     parser.add_argument('--emb', type=str, required=True, help='The path of embedding file.')
 
+    parser.add_argument('--emb_format', type=str, required=False, default='text', choices=EXPORT_FORMATS,
+                        help='The format of embedding file: word2vec text or binary format, or a numpy matrix '
+                             'with the node labels.')
+    parser.add_argument('--float16', action='store_true',
+                        help='Store the embeddings in float16, only for the numpy format.')
+
     parser.add_argument('--comm_method', type=str, required=True, choices=COMMMUNITY_DETECTION_METHODS,
                                          help='The community detection method.')
     parser.add_argument('--K', type=int, required=False, default=100,
                                          help='The number of latent communities.')
     parser.add_argument('--graph_path', type=str, required=False,
                                         help='The path for the graph in gml format.')
+    parser.add_argument('--num_walks', type=int, required=False, default=10,
+                        help='The number of walks starting from each node, if the walks are generated.')
+    parser.add_argument('--walk_length', type=int, required=False, default=10,
+                        help='The length of each walk, if the walks are generated.')
+    parser.add_argument('--p', type=float, required=False, default=1.0,
+                        help='The return parameter of node2vec walks, p=q=1 gives uniform random walks.')
+    parser.add_argument('--q', type=float, required=False, default=1.0,
+                        help='The in-out parameter of node2vec walks, p=q=1 gives uniform random walks.')
+    parser.add_argument('--no_graph_snapshot', action='store_true',
+                        help='Parse the graph file every time, instead of writing its CSR snapshot next to it and '
+                             'memory-mapping it in the next runs.')
+    parser.add_argument('--walks_path', type=str, required=False,
+                        help='The path prefix for saving the generated walks as a binary corpus.')
     parser.add_argument('--node_emb_size', type=int, required=False, default=96,
                                          help='The embedding size.')
     parser.add_argument('--comm_emb_size', type=int, required=False, default=32,
@@ -68,8 +130,50 @@ def parse_arguments():
                                          help='The value of the parameter beta of LDA.')
     parser.add_argument('--lda_iter_num', type=int, required=False, default=1000,
                                          help='The number of iterations for LDA algorithm, GibssLDA++.')
+    parser.add_argument('--lda_engine', type=str, required=False, default='native', choices=['native', 'gibbslda'],
+                        help='Run LDA with the in-process sampler or with the GibbsLDA++ executable.')
+    parser.add_argument('--resolution', type=float, required=False, default=1.0,
+                        help='The resolution of the fastlouvain method, higher values give smaller communities.')
+    parser.add_argument('--seed', type=int, required=False, default=1,
+                        help='The seed of the node orders of the fastlouvain method.')
     parser.add_argument('--hmm_steps', type=int, required=False, default=20,
-                        help='The number of steps for Bayesian HMM model.')
+                        help='The maximum number of steps of each chain of the Bayesian HMM model.')
+    parser.add_argument('--hmm_chains', type=int, required=False, default=1,
+                        help='The number of independent chains of the Bayesian HMM model, the chain of the highest '
+                             'likelihood is kept.')
+    parser.add_argument('--hmm_cores', type=int, required=False, default=None,
+                        help='The number of cores shared by the chains of the Bayesian HMM model, all workers by '
+                             'default.')
+    parser.add_argument('--hmm_tolerance', type=float, required=False, default=1e-3,
+                        help='A chain stops once its log-likelihood changes by less than this fraction over 5 steps, '
+                             '0 runs all steps.')
+    parser.add_argument('--sparse_phi', action='store_true',
+                        help='Store the community assignments (phi) as a sparse matrix.')
+    parser.add_argument('--comm_cache', action='store_true',
+                        help='Reuse the community detection results of the previous runs with the same walks, graph and parameters.')
+    parser.add_argument('--comm_cache_size', type=float, required=False, default=10240,
+                        help='The maximum size of the community cache in MB.')
+    parser.add_argument('--checkpoint_path', type=str, required=False, default=None,
+                        help='The folder storing the artifacts of each stage, the run is resumed from its last '
+                             'completed stage.')
+    parser.add_argument('--last_stage', type=int, required=False, default=3, choices=[1, 2, 3],
+                        help='The last stage to run: 1. node embeddings, 2. communities, 3. community embeddings.')
+    parser.add_argument('--concurrent_stages', action='store_true',
+                        help='Learn the node embeddings and detect the communities at the same time.')
+    parser.add_argument('--node_workers', type=int, required=False, default=None,
+                        help='The number of workers of the node embeddings with --concurrent_stages, '
+                             'the remaining workers by default.')
+    parser.add_argument('--community_workers', type=int, required=False, default=None,
+                        help='The number of workers of the community detection with --concurrent_stages, '
+                             'half of the workers by default.')
+    parser.add_argument('--metrics', type=str, required=False, default=None,
+                        help='The path of the file into which the metrics of the stages and of the training are '
+                             'written as JSON lines.')
+    parser.add_argument('--profile', type=str, required=False, default=None,
+                        help='The folder into which the cProfile statistics of each stage are written.')
+    parser.add_argument('--comm_processes', type=int, required=False, default=None,
+                        help='The number of processes training the community embeddings over shared weights, '
+                             'instead of the worker threads.')
     parser.add_argument('--suffix', type=str, required=False, default="",
                                          help='The suffix for file names.')
 
@@ -78,7 +182,11 @@ def parse_arguments():
     parser.add_argument('--iter', type=int, required=False, default=8, help='iter ')
 
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.corpus is None and args.graph_path is None:
+        parser.error("Either --corpus or --graph_path must be given.")
+
+    return args
 
 
 if __name__ == "__main__":
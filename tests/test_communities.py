@@ -0,0 +1,112 @@
+import numpy as np
+import scipy.sparse as sp
+from tne.communities import hard_membership, overlapping_membership, membership_to_phi, hard_community_walks, \
+    sticky_community_walks
+
+NUMBER_OF_NODES, K, NUMBER_OF_WALKS, WALK_LENGTH = 40, 5, 30, 12
+
+
+def _walks(rng):
+    # Walks of varying lengths over the node ids, as flat tokens with offsets
+    lengths = rng.randint(1, WALK_LENGTH + 1, size=NUMBER_OF_WALKS)
+    offsets = np.zeros(shape=(NUMBER_OF_WALKS + 1, ), dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    node_walks = rng.randint(NUMBER_OF_NODES, size=offsets[-1]).astype(np.int64)
+
+    return node_walks, offsets
+
+
+def _hard_labels(rng):
+    labels = rng.randint(K, size=NUMBER_OF_NODES)
+    labels[:K] = np.arange(K)
+
+    return labels
+
+
+def _overlapping_node_comms(rng):
+    # Every node belongs to one to three communities, as in the output of BigClam
+    node_comms = [sorted(rng.choice(K, size=rng.randint(1, 4), replace=False)) for _ in range(NUMBER_OF_NODES)]
+    node_comms[0] = list(range(K))
+
+    return node_comms
+
+
+def _loop_phi(node_comms):
+    # The per-node loop building phi
+    phi = np.zeros(shape=(K, NUMBER_OF_NODES), dtype=np.float64)
+    for node in range(NUMBER_OF_NODES):
+        for k in node_comms[node]:
+            phi[k, node] = 1.0
+
+    return (phi.T / np.sum(phi, 1)).T
+
+
+def test_membership_to_phi_hard():
+    labels = _hard_labels(np.random.RandomState(0))
+    expected = _loop_phi([[k] for k in labels])
+
+    assert np.allclose(membership_to_phi(hard_membership(labels, K)), expected)
+    phi = membership_to_phi(hard_membership(labels, K), sparse=True)
+    assert sp.isspmatrix_csc(phi) and phi.dtype == np.float32
+    assert np.allclose(phi.toarray(), expected, atol=1e-6)
+
+
+def test_membership_to_phi_overlapping():
+    node_comms = _overlapping_node_comms(np.random.RandomState(1))
+    expected = _loop_phi(node_comms)
+
+    assert np.allclose(membership_to_phi(overlapping_membership(node_comms, K)), expected)
+    assert np.allclose(membership_to_phi(overlapping_membership(node_comms, K), sparse=True).toarray(), expected,
+                       atol=1e-6)
+
+
+def test_hard_community_walks():
+    rng = np.random.RandomState(2)
+    labels = _hard_labels(rng)
+    node_walks, offsets = _walks(rng)
+
+    # The per-token loop
+    expected = [labels[node] for start, end in zip(offsets[:-1], offsets[1:]) for node in node_walks[start:end]]
+
+    community_walks = hard_community_walks(node_walks, labels)
+    assert community_walks.dtype == np.int32
+    assert np.array_equal(community_walks, expected)
+
+
+def test_sticky_community_walks_hard():
+    rng = np.random.RandomState(3)
+    labels = _hard_labels(rng)
+    node_walks, offsets = _walks(rng)
+
+    community_walks = sticky_community_walks(node_walks, offsets, hard_membership(labels, K),
+                                             rng=np.random.RandomState(4))
+    assert np.array_equal(community_walks, hard_community_walks(node_walks, labels))
+
+
+def test_sticky_community_walks_overlapping():
+    rng = np.random.RandomState(5)
+    node_comms = _overlapping_node_comms(rng)
+    node_walks, offsets = _walks(rng)
+    membership = overlapping_membership(node_comms, K)
+
+    community_walks = sticky_community_walks(node_walks, offsets, membership, rng=np.random.RandomState(6))
+    assert np.array_equal(community_walks,
+                          sticky_community_walks(node_walks, offsets, membership, rng=np.random.RandomState(6)))
+
+    # The choices of the per-token loop: a community of the node, and the previous one whenever the node belongs to it
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        for pos in range(start, end):
+            assert community_walks[pos] in node_comms[node_walks[pos]]
+            if pos > start and community_walks[pos - 1] in node_comms[node_walks[pos]]:
+                assert community_walks[pos] == community_walks[pos - 1]
+
+
+def test_sticky_community_walks_overlapping_draws():
+    # The labels which are not kept are drawn uniformly among the communities of the node, as by np.random.choice
+    node_walks, offsets = np.zeros(shape=(20000, ), dtype=np.int64), np.arange(20001, dtype=np.int64)
+    community_walks = sticky_community_walks(node_walks, offsets, overlapping_membership([[0, 2, 3]], K),
+                                             rng=np.random.RandomState(7))
+
+    counts = np.bincount(community_walks, minlength=K)
+    assert counts[1] == 0 and counts[4] == 0
+    assert np.allclose(counts[[0, 2, 3]] / float(len(community_walks)), 1.0 / 3, atol=0.02)
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+import subprocess
+import numpy as np
+import scipy.sparse as sp
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from scipy.sparse.csgraph import connected_components
+from consts import BIGCLAM_PATH
+
+# BigClam runs its serial optimizer on the graphs smaller than these sizes, so one thread is enough for them
+_PARALLEL_MIN_NODES = 300
+_PARALLEL_MIN_EDGES = 1000
+
+
+def _read_bigclam_output(file_path):
+
+    communities = []
+    if not os.path.exists(file_path):
+        return communities
+
+    with open(file_path, 'r') as f:
+        for line in f:
+            tokens = line.split()
+            if tokens:
+                communities.append(np.asarray(tokens, dtype=np.int64))
+
+    return communities
+
+
+class _ThreadBudget(object):
+    """A budget of threads shared by the concurrent runs, each run waits until its threads are available."""
+
+    def __init__(self, threads):
+        self.available = threads
+        self.condition = threading.Condition()
+
+    def acquire(self, threads):
+        with self.condition:
+            while self.available < threads:
+                self.condition.wait()
+            self.available -= threads
+
+    def release(self, threads):
+        with self.condition:
+            self.available += threads
+            self.condition.notify_all()
+
+
+def _run_bigclam(job):
+    # Run the executable over the edges of a component, the node indices of the graph are used as node ids
+    component_no, edges, temp_folder, threads = job
+    initial_time = time.time()
+
+    edgelist_path = os.path.join(temp_folder, "gcc{}.edgelist".format(component_no))
+    output_path = os.path.join(temp_folder, "gcc{}.bigclam".format(component_no))
+    log_path = os.path.join(temp_folder, "gcc{}.log".format(component_no))
+
+    np.savetxt(edgelist_path, edges, fmt='%d')
+    with open(log_path, 'w') as log:
+        cmd = [BIGCLAM_PATH, "-o:{}".format(output_path), "-i:{}".format(edgelist_path), "-nt:{}".format(threads),
+               "-c:-1"]
+        subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+    return component_no, _read_bigclam_output(output_path), time.time() - initial_time
+
+
+def bigclam_communities(graph, temp_folder, workers=None, small_component_size=5, metrics=None):
+    """
+    Run BigClam over the connected components of a CSRGraph and return the list of detected communities, each one
+    being an array of node indices. The components having at most small_component_size nodes form a single
+    community without running the executable. The other components are dispatched concurrently, the largest ones
+    first, and the budget of workers threads (the number of cores by default) is split among the concurrent runs: a
+    run starts once its threads are free. The communities are ordered by the components, so the output does not
+    depend on the completion order of the runs. The wall time of each run is recorded into metrics (see
+    utils.metrics) if it is given.
+    """
+
+    workers = workers if workers else cpu_count()
+    number_of_nodes = graph.number_of_nodes()
+
+    adjacency = sp.csr_matrix((graph.weights, graph.indices, graph.indptr), shape=(number_of_nodes, number_of_nodes))
+    number_of_components, labels = connected_components(adjacency, directed=False)
+    sizes = np.bincount(labels, minlength=number_of_components)
+
+    # The nodes and the undirected edges, each one once, grouped by the component
+    node_order = np.argsort(labels, kind='stable')
+    node_bounds = np.zeros(shape=(number_of_components + 1, ), dtype=np.int64)
+    np.cumsum(sizes, out=node_bounds[1:])
+
+    source = np.repeat(np.arange(number_of_nodes, dtype=np.int64), graph.degrees())
+    mask = source < graph.indices
+    edges = np.column_stack((source[mask], graph.indices[mask]))
+    edges = edges[np.argsort(labels[edges[:, 0]], kind='stable')]
+    edge_bounds = np.zeros(shape=(number_of_components + 1, ), dtype=np.int64)
+    np.cumsum(np.bincount(labels[edges[:, 0]], minlength=number_of_components), out=edge_bounds[1:])
+    number_of_edges = np.diff(edge_bounds)
+
+    component_communities = [None] * number_of_components
+    jobs = []
+    for c in range(number_of_components):
+        if sizes[c] <= small_component_size or number_of_edges[c] == 0:
+            component_communities[c] = [node_order[node_bounds[c]:node_bounds[c + 1]]]
+        else:
+            jobs.append(c)
+    # Start with the largest components, so that none of them runs alone at the end
+    jobs.sort(key=lambda c: -number_of_edges[c])
+
+    parallel = set(c for c in jobs if sizes[c] >= _PARALLEL_MIN_NODES and number_of_edges[c] >= _PARALLEL_MIN_EDGES)
+    threads = max(workers // max(min(len(parallel), workers), 1), 1)
+
+    if jobs:
+        if not os.path.exists(temp_folder):
+            os.makedirs(temp_folder)
+        # The runs are external processes, so the threads of the pool only wait for them
+        # The serial and the parallel runs share the budget of workers threads, so that at most workers threads are
+        # busy at once
+        budget = _ThreadBudget(workers)
+
+        def run(job):
+            budget.acquire(job[3])
+            try:
+                return _run_bigclam(job)
+            finally:
+                budget.release(job[3])
+
+        pool = ThreadPool(processes=min(workers, len(jobs)))
+        try:
+            arguments = [(c, edges[edge_bounds[c]:edge_bounds[c + 1]], temp_folder, threads if c in parallel else 1)
+                         for c in jobs]
+            for c, communities, seconds in pool.imap_unordered(run, arguments):
+                component_communities[c] = communities
+                if metrics is not None:
+                    metrics.observe('bigclam.run_seconds', seconds)
+                    metrics.emit('bigclam_run', component=c, nodes=sizes[c], edges=number_of_edges[c],
+                                 threads=threads if c in parallel else 1, communities=len(communities),
+                                 seconds=seconds)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [community for communities in component_communities for community in communities]
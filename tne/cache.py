@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from utils.corpus import IndexedWalks
+
+_CACHE_VERSION = "1"
+# The parameters which do not change the results of any stage, shared with the checkpoints (see tne.checkpoint)
+RUN_PARAMS = ['num_of_workers', 'checkpoint_path', 'checkpoint_jobs', 'community_cache', 'community_cache_size',
+              'community_processes', 'metrics_path', 'profile_path', 'graph_snapshot', 'concurrent_stages',
+              'node_workers', 'community_workers', 'hmm_cores']
+# The parameters which do not change the detected communities
+_TRAINING_PARAMS = RUN_PARAMS + ['node_embedding_size', 'comm_embedding_size', 'window_size', 'alpha',
+                                 'min_alpha', 'iter', 'integer_tokens', 'graph_path']
+_META_FILE = "meta.json"
+_BLOCK_SIZE = 1 << 20
+
+
+def _update_with_file(hasher, file_path):
+
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+            hasher.update(block)
+
+
+def community_cache_key(walks, params, vocabulary=None):
+    """
+    Return the hex digest identifying the community detection results of the walks, the graph file given by
+    params['graph_path'] and the detection parameters. walks is an IndexedWalks over the indexes of the words in the
+    vocabulary list or an iterable of walk lists.
+    """
+
+    hasher = hashlib.sha1(_CACHE_VERSION.encode('utf8'))
+
+    if vocabulary is not None:
+        hasher.update(u"\n".join(str(word) for word in vocabulary).encode('utf8'))
+    hasher.update(b"\0")
+    if isinstance(walks, IndexedWalks):
+        hasher.update(np.ascontiguousarray(walks.indexes, dtype=np.int32).tobytes())
+        hasher.update(np.ascontiguousarray(walks.offsets, dtype=np.int64).tobytes())
+    else:
+        for walk in walks:
+            hasher.update((u" ".join(str(w) for w in walk) + u"\n").encode('utf8'))
+    hasher.update(b"\0")
+
+    graph_path = params.get('graph_path', None)
+    if graph_path is not None and os.path.exists(graph_path):
+        _update_with_file(hasher, graph_path)
+    hasher.update(b"\0")
+
+    method_params = {key: value for key, value in params.items() if key not in _TRAINING_PARAMS}
+    hasher.update(json.dumps(method_params, sort_keys=True, default=str).encode('utf8'))
+
+    return hasher.hexdigest()
+
+
+def save_communities(folder_path, K, phi, id2node, community_walks):
+    """
+    Write the community detection results into the folder: phi (.npy, or .npz if it is sparse), id2node as arrays of
+    node ids and labels and the community walks as flat int32 labels with int64 walk offsets.
+    """
+
+    if isinstance(community_walks, IndexedWalks):
+        indexes, offsets = community_walks.indexes, community_walks.offsets
+    else:
+        lengths = np.fromiter((len(walk) for walk in community_walks), dtype=np.int64, count=len(community_walks))
+        offsets = np.zeros(shape=(len(lengths) + 1, ), dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        indexes = np.fromiter((int(label) for walk in community_walks for label in walk), dtype=np.int32,
+                              count=offsets[-1])
+
+    if os.path.exists(folder_path):
+        shutil.rmtree(folder_path)
+    os.makedirs(folder_path)
+
+    if sp.issparse(phi):
+        sp.save_npz(os.path.join(folder_path, "phi.npz"), sp.csc_matrix(phi), compressed=False)
+    else:
+        np.save(os.path.join(folder_path, "phi.npy"), phi)
+    node_ids = sorted(id2node.keys())
+    np.save(os.path.join(folder_path, "node_ids.npy"), np.asarray(node_ids, dtype=np.int64))
+    np.save(os.path.join(folder_path, "nodes.npy"), np.asarray([str(id2node[nodeId]) for nodeId in node_ids]))
+    np.save(os.path.join(folder_path, "community_walks.npy"), np.asarray(indexes, dtype=np.int32))
+    np.save(os.path.join(folder_path, "community_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    # The meta file is written last, it marks the folder as complete
+    with open(os.path.join(folder_path, _META_FILE), 'w') as f:
+        json.dump({'K': int(K), 'sparse_phi': sp.issparse(phi), 'created': time.time()}, f)
+
+
+def load_communities(folder_path):
+    """Read the results written by save_communities as (K, phi, id2node, community_walks)."""
+
+    with open(os.path.join(folder_path, _META_FILE), 'r') as f:
+        meta = json.load(f)
+
+    if meta['sparse_phi']:
+        phi = sp.csc_matrix(sp.load_npz(os.path.join(folder_path, "phi.npz")))
+    else:
+        phi = np.load(os.path.join(folder_path, "phi.npy"))
+    node_ids = np.load(os.path.join(folder_path, "node_ids.npy"))
+    nodes = np.load(os.path.join(folder_path, "nodes.npy"))
+    id2node = {int(nodeId): str(node) for nodeId, node in zip(node_ids, nodes)}
+    community_walks = IndexedWalks(indexes=np.load(os.path.join(folder_path, "community_walks.npy")),
+                                   offsets=np.load(os.path.join(folder_path, "community_offsets.npy")))
+
+    return meta['K'], phi, id2node, community_walks
+
+
+class CommunityCache(object):
+    """
+    Persistent cache of the community detection results, phi, id2node and the community walks, stored in binary
+    .npy files in one folder per key. The least recently used entries are removed once the total size of the cache
+    exceeds max_size bytes.
+    """
+
+    def __init__(self, folder_path, max_size=10 * (1 << 30)):
+
+        self.folder_path = folder_path
+        self.max_size = max_size
+
+        if not os.path.exists(self.folder_path):
+            os.makedirs(self.folder_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder_path, key)
+
+    def contains(self, key):
+        return os.path.exists(os.path.join(self._entry_path(key), _META_FILE))
+
+    def load(self, key):
+        """Return (K, phi, id2node, community_walks) stored for the key, or None if the key is not in the cache."""
+
+        if not self.contains(key):
+            return None
+
+        entry_path = self._entry_path(key)
+        K, phi, id2node, community_walks = load_communities(entry_path)
+
+        # Mark the entry as recently used
+        os.utime(os.path.join(entry_path, _META_FILE), None)
+
+        return K, phi, id2node, community_walks
+
+    def store(self, key, K, phi, id2node, community_walks):
+        """Store the results for the key, and evict the least recently used entries if the cache is too large."""
+
+        # Write into a temporary folder first, so that a partially written entry is never loaded
+        entry_path = self._entry_path(key)
+        temp_path = "{}.{}.tmp".format(entry_path, os.getpid())
+        save_communities(temp_path, K, phi, id2node, community_walks)
+
+        self.invalidate(key)
+        os.rename(temp_path, entry_path)
+
+        self.evict(keep=key)
+
+    def invalidate(self, key=None):
+        """Remove the entry of the key from the cache, or all entries if key is None."""
+
+        keys = self.keys() if key is None else [key]
+        for k in keys:
+            if os.path.exists(self._entry_path(k)):
+                shutil.rmtree(self._entry_path(k))
+
+    def keys(self):
+        return [name for name in os.listdir(self.folder_path)
+                if not name.endswith(".tmp") and os.path.exists(os.path.join(self.folder_path, name, _META_FILE))]
+
+    def entry_size(self, key):
+        entry_path = self._entry_path(key)
+        return sum(os.path.getsize(os.path.join(entry_path, name)) for name in os.listdir(entry_path))
+
+    def size(self):
+        return sum(self.entry_size(key) for key in self.keys())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the size of the cache is at most max_size bytes."""
+
+        entries = [(os.path.getmtime(os.path.join(self._entry_path(key), _META_FILE)), key) for key in self.keys()]
+        sizes = {key: self.entry_size(key) for _, key in entries}
+        total_size = sum(sizes.values())
+        for _, key in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self.invalidate(key)
+            total_size -= sizes[key]
@@ -0,0 +1,127 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from ext.gensim_wrapper.models.word2vec import Word2VecWrapper
+from tne.cache import save_communities, load_communities, RUN_PARAMS
+
+
+class Checkpoint(object):
+    """
+    Artifacts of the stages of TNE stored in a folder, so that an interrupted run can be resumed and the stages can
+    be run as separate jobs: the node model of stage 1, the community detection results of stage 2, the community
+    weights after every checkpointed job of stage 3 and the final model. A state file keeps the completed artifacts
+    and the number of completed community training jobs.
+    """
+
+    NODE_MODEL, COMMUNITIES, MODEL = "node_model", "communities", "model"
+
+    def __init__(self, folder_path, params):
+
+        self.folder_path = folder_path
+        self.params = {key: value for key, value in params.items() if key not in RUN_PARAMS}
+        # The stages 1 and 2 update the state file concurrently with --concurrent_stages
+        self._state_lock = threading.Lock()
+
+        if not os.path.exists(self.folder_path):
+            os.makedirs(self.folder_path)
+
+        state = self._read_state()
+        if state is not None and json.dumps(state['params'], sort_keys=True, default=str) != \
+                json.dumps(self.params, sort_keys=True, default=str):
+            raise ValueError("The checkpoint {} has been created with different parameters!".format(folder_path))
+
+    def _path(self, name):
+        return os.path.join(self.folder_path, name)
+
+    def _read_state(self):
+
+        if not os.path.exists(self._path("state.json")):
+            return None
+
+        with open(self._path("state.json"), 'r') as f:
+            return json.load(f)
+
+    def _write_state(self, completed, job_no):
+
+        # Each writer has its own temporary file, the state file is replaced atomically
+        temp_path = self._path("state.json.{}.{}.tmp".format(os.getpid(), threading.get_ident()))
+        with open(temp_path, 'w') as f:
+            json.dump({'completed': sorted(completed), 'job_no': job_no, 'params': self.params}, f, default=str)
+        os.replace(temp_path, self._path("state.json"))
+
+    def _update_state(self, add=(), remove=(), job_no=None):
+
+        with self._state_lock:
+            state = self._read_state() or {'completed': [], 'job_no': 0}
+            completed = (set(state['completed']) | set(add)) - set(remove)
+            self._write_state(completed, state['job_no'] if job_no is None else job_no)
+
+    def has(self, artifact):
+        """Return True if the artifact (NODE_MODEL, COMMUNITIES or MODEL) has been completed."""
+        state = self._read_state()
+        return state is not None and artifact in state['completed']
+
+    def job_no(self):
+        """Return the number of completed community training jobs."""
+        state = self._read_state()
+        return state['job_no'] if state is not None else 0
+
+    def reset(self):
+        """Discard all artifacts, the later stages are not valid anymore once a stage has been replaced."""
+        with self._state_lock:
+            self._write_state(completed=[], job_no=0)
+
+    def save_node_model(self, model):
+        model.save(self._path("node_model"))
+        self._update_state(add=[self.NODE_MODEL])
+
+    def load_node_model(self):
+        """Return the final model if stage 3 has been completed, otherwise the model of stage 1."""
+        if self.has(self.MODEL):
+            return Word2VecWrapper.load(self._path("model"))
+        return Word2VecWrapper.load(self._path("node_model"))
+
+    def save_communities(self, K, phi, id2node, community_walks):
+        save_communities(self._path("communities.tmp"), K, phi, id2node, community_walks)
+        if os.path.exists(self._path("communities")):
+            shutil.rmtree(self._path("communities"))
+        os.rename(self._path("communities.tmp"), self._path("communities"))
+        # The community embeddings of the previous communities are not valid anymore
+        self._update_state(add=[self.COMMUNITIES], remove=[self.MODEL], job_no=0)
+
+    def load_communities(self):
+        """Return (K, phi, id2node, community_walks) of stage 2."""
+        return load_communities(self._path("communities"))
+
+    def save_community_weights(self, job_no, syn0_community, syn1neg, random_state=None):
+        arrays = {'syn0_community': syn0_community, 'syn1neg': syn1neg}
+        if random_state is not None:
+            # The state of the numpy generator drawing the seeds of the training jobs
+            arrays.update({'random_keys': random_state[1], 'random_pos': random_state[2],
+                           'random_gauss': np.asarray(random_state[3:5], dtype=np.float64)})
+        np.savez(self._path("community_weights.tmp.npz"), **arrays)
+        os.rename(self._path("community_weights.tmp.npz"), self._path("community_weights.npz"))
+        self._update_state(job_no=job_no)
+
+    def load_community_weights(self):
+        """
+        Return the weights (syn0_community, syn1neg), the number of completed jobs and the random state of the last
+        checkpointed job, (None, 0, None) if there is no checkpointed job.
+        """
+        job_no = self.job_no()
+        if job_no == 0 or not os.path.exists(self._path("community_weights.npz")):
+            return None, 0, None
+
+        weights = np.load(self._path("community_weights.npz"))
+        random_state = None
+        if 'random_keys' in weights:
+            random_state = ('MT19937', weights['random_keys'], int(weights['random_pos']),
+                            int(weights['random_gauss'][0]), float(weights['random_gauss'][1]))
+
+        return (weights['syn0_community'], weights['syn1neg']), job_no, random_state
+
+    def save_model(self, model):
+        model.save(self._path("model"))
+        self._update_state(add=[self.MODEL])
@@ -0,0 +1,283 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def hard_membership(labels, K):
+    """
+    Return the sparse N x K membership matrix of a hard partition, where labels[i] is the community of node i.
+    """
+
+    labels = np.asarray(labels, dtype=np.int64)
+    number_of_nodes = len(labels)
+
+    return sp.csr_matrix((np.ones(shape=(number_of_nodes, ), dtype=np.float64), (np.arange(number_of_nodes), labels)),
+                         shape=(number_of_nodes, K))
+
+
+def pairs_membership(nodes, communities, number_of_nodes, K):
+    """
+    Return the sparse N x K membership matrix in which node nodes[i] belongs to community communities[i], repeated
+    pairs are counted once.
+    """
+
+    membership = sp.csr_matrix((np.ones(shape=(len(nodes), ), dtype=np.float64),
+                                (np.asarray(nodes, dtype=np.int64), np.asarray(communities, dtype=np.int64))),
+                               shape=(number_of_nodes, K))
+    membership.sum_duplicates()
+    membership.data[:] = 1.0
+
+    return membership
+
+
+def overlapping_membership(node_comms, K):
+    """
+    Return the sparse N x K membership matrix of an overlapping assignment, where node_comms[i] is the list of
+    communities of node i.
+    """
+
+    lengths = np.fromiter((len(comms) for comms in node_comms), dtype=np.int64, count=len(node_comms))
+    communities = np.fromiter((k for comms in node_comms for k in comms), dtype=np.int64, count=np.sum(lengths))
+
+    return pairs_membership(np.repeat(np.arange(len(node_comms), dtype=np.int64), lengths), communities,
+                            len(node_comms), K)
+
+
+def membership_to_phi(membership, sparse=False):
+    """
+    Convert an N x K membership matrix into the K x N phi matrix, each community row being normalized to sum up to
+    one. If sparse is True, phi is kept as a float32 CSC matrix, so its memory scales with the number of memberships
+    instead of K x N.
+    """
+
+    if not sparse:
+        phi = membership.T.toarray()
+        return (phi.T / np.sum(phi, 1)).T
+
+    phi = sp.csr_matrix(membership.T, dtype=np.float32)
+    row_sums = np.asarray(phi.sum(axis=1)).ravel()
+    phi = sp.diags(np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)).dot(phi)
+
+    return sp.csc_matrix(phi, dtype=np.float32)
+
+
+def format_phi(phi, sparse=False):
+    """Convert a K x N phi matrix into the dense or the sparse (float32 CSC) representation."""
+
+    if sparse:
+        return sp.csc_matrix(phi, dtype=np.float32)
+
+    return phi.toarray() if sp.issparse(phi) else np.asarray(phi)
+
+
+def phi_argmax(phi):
+    """Return the community having the highest value in phi for each node."""
+
+    if sp.issparse(phi):
+        return np.asarray(phi.argmax(axis=0)).ravel()
+
+    return np.argmax(phi, axis=0)
+
+
+def phi_argmin(phi):
+    """Return the community having the lowest value in phi for each node, implicit zeros of sparse phi included."""
+
+    if sp.issparse(phi):
+        return np.asarray(phi.argmin(axis=0)).ravel()
+
+    return np.argmin(phi, axis=0)
+
+
+def normalize_phi_columns(phi):
+    """Normalize the column of each node in phi to sum up to one."""
+
+    if sp.issparse(phi):
+        column_sums = np.asarray(phi.sum(axis=0)).ravel()
+        return sp.csc_matrix(phi.dot(sp.diags(1.0 / column_sums)), dtype=phi.dtype)
+
+    return phi / np.sum(phi, 0)
+
+
+def hard_community_walks(node_walks, labels):
+    """
+    Label every token of the walks with the community of its node. node_walks is the flat array of node ids of all
+    tokens, so the community walks are obtained by a single fancy indexing operation.
+    """
+
+    if np.any(node_walks < 0):
+        raise ValueError("The walks contain nodes which do not exist in the graph!")
+
+    return np.asarray(labels, dtype=np.int32)[node_walks]
+
+
+def sticky_community_walks(node_walks, offsets, membership, rng=np.random):
+    """
+    Label every token of the walks with one of the communities of its node. The first token of a walk gets a random
+    community of its node, and each following token keeps the community of the previous token if its node belongs
+    to it, otherwise a random community of its node is chosen. All walks are processed together position by
+    position, so the number of interpreter iterations is the walk length. The output is deterministic for hard
+    partitions.
+    """
+
+    if np.any(node_walks < 0):
+        raise ValueError("The walks contain nodes which do not exist in the graph!")
+
+    membership = sp.csr_matrix(membership)
+    membership.sort_indices()
+    indptr, indices = membership.indptr, membership.indices
+    degrees = np.diff(indptr)
+
+    community_walks = np.zeros(shape=(len(node_walks), ), dtype=np.int32)
+    lengths = np.diff(offsets)
+    for position in range(int(np.max(lengths)) if len(lengths) else 0):
+        active = np.nonzero(lengths > position)[0]
+        pos = offsets[active] + position
+        nodes = node_walks[pos]
+
+        draws = indices[indptr[nodes] + (rng.random_sample(len(nodes)) * degrees[nodes]).astype(np.int64)]
+        if position > 0:
+            previous = community_walks[pos - 1]
+            # Keep the previous label for the nodes belonging to the previous community
+            keep = np.asarray(membership[nodes, previous]).ravel() > 0
+            draws = np.where(keep, previous, draws)
+        community_walks[pos] = draws
+
+    return community_walks
+
+
+def walk_adjacency(node_walks, offsets, number_of_nodes):
+    """
+    Return the symmetric N x N sparse matrix counting the consecutive occurrences of the node pairs in the walks,
+    which are the edges traversed by the walks. Tokens marked by -1 and self-loops are skipped.
+    """
+
+    last = np.zeros(shape=(max(len(node_walks) - 1, 0), ), dtype=np.bool_)
+    ends = offsets[1:-1] - 1
+    last[ends[(ends >= 0) & (ends < len(last))]] = True
+    source, target = node_walks[:-1][~last], node_walks[1:][~last]
+    mask = (source >= 0) & (target >= 0) & (source != target)
+    source, target = source[mask], target[mask]
+
+    adjacency = sp.csr_matrix((np.ones(shape=(2 * len(source), ), dtype=np.float64),
+                               (np.concatenate((source, target)), np.concatenate((target, source)))),
+                              shape=(number_of_nodes, number_of_nodes))
+    adjacency.sum_duplicates()
+
+    return adjacency
+
+
+def is_hard_phi(phi):
+    """Return True if every node belongs to exactly one community in phi."""
+
+    if sp.issparse(phi):
+        return np.all(np.diff(sp.csc_matrix(phi).indptr) == 1)
+
+    return np.all(np.count_nonzero(phi, axis=0) == 1)
+
+
+def _extend_dense_phi(phi, K, number_of_nodes):
+    # Return phi as the top-left view of a zero-initialized buffer of at least K x number_of_nodes entries. The buffer
+    # grows geometrically, so the columns of the next updates are appended without copying phi
+    base = phi.base
+    if isinstance(base, np.ndarray) and base.ndim == 2 and base.flags['C_CONTIGUOUS'] and \
+            phi.strides == base.strides and phi.ctypes.data == base.ctypes.data and \
+            base.shape[0] >= K and base.shape[1] >= number_of_nodes:
+        return base[:K, :number_of_nodes]
+
+    buffer = np.zeros(shape=(max(K, phi.shape[0] + phi.shape[0] // 8 + 1),
+                             max(number_of_nodes, phi.shape[1] + phi.shape[1] // 2)), dtype=phi.dtype)
+    buffer[:phi.shape[0], :phi.shape[1]] = phi
+
+    return buffer[:K, :number_of_nodes]
+
+
+def assign_new_nodes(phi, adjacency, number_of_new_nodes, sweeps=3, hard=None):
+    """
+    Extend the K x N phi matrix with the columns of new nodes, the last number_of_new_nodes rows of the adjacency
+    matrix over the old and the new nodes. The existing columns are kept. If phi is a hard partition, each new node
+    is moved to the community with the highest modularity gain among the communities of its neighbours, as in the
+    local moves of Louvain, and the nodes without any assigned neighbour form new singleton communities. Otherwise
+    the column of a new node is folded in as the average of the columns of its neighbours, and it is uniform if it
+    has no neighbours. The new nodes are updated together for the given number of sweeps, so the moves also
+    propagate between new nodes. Only the columns of the old neighbours of the new nodes are gathered, and a dense
+    phi grows into the spare capacity of its buffer. hard tells whether phi is a hard partition, it is checked over
+    phi if it is not given. Return the extended phi and the new number of communities.
+    """
+
+    K, number_of_old_nodes = phi.shape
+    hard = is_hard_phi(phi) if hard is None else hard
+    adjacency = sp.csr_matrix(adjacency)
+    new_rows = adjacency[number_of_old_nodes:]
+    old_to_new = new_rows[:, :number_of_old_nodes].tocsc()
+    new_to_new = new_rows[:, number_of_old_nodes:]
+
+    # The column-normalized phi of the old neighbours, the nodes without any membership are skipped
+    neighbours = np.nonzero(np.diff(old_to_new.indptr))[0]
+    columns = sp.csr_matrix(phi[:, neighbours])
+    column_sums = np.asarray(columns.sum(axis=0)).ravel()
+    inverse_sums = np.divide(1.0, column_sums, out=np.zeros_like(column_sums, dtype=np.float64), where=column_sums > 0)
+    node_distributions = sp.diags(inverse_sums).dot(columns.T).tocsr()
+    base_scores = np.asarray(old_to_new[:, neighbours].dot(node_distributions).todense())
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    total_weight = max(np.sum(degrees), 1.0)
+    # The totals of the communities over all old nodes, a single product with phi
+    all_column_sums = np.asarray(phi.sum(axis=0)).ravel()
+    old_totals = np.asarray(phi.dot(np.divide(degrees[:number_of_old_nodes], all_column_sums,
+                                              out=np.zeros_like(all_column_sums, dtype=np.float64),
+                                              where=all_column_sums > 0))).ravel()
+
+    distributions = np.zeros(shape=(number_of_new_nodes, K), dtype=np.float64)
+    for _ in range(sweeps):
+        scores = base_scores + new_to_new.dot(distributions)
+        if hard:
+            # The modularity gain of joining each community, only the communities of the neighbours are candidates
+            totals = old_totals + distributions.T.dot(degrees[number_of_old_nodes:])
+            gains = scores - np.outer(degrees[number_of_old_nodes:], totals) / total_weight
+            gains[scores <= 0] = -np.inf
+            labels = np.argmax(gains, axis=1)
+            assigned = np.max(scores, axis=1) > 0
+            distributions = np.zeros_like(distributions)
+            distributions[np.nonzero(assigned)[0], labels[assigned]] = 1.0
+        else:
+            sums = np.sum(scores, axis=1, keepdims=True)
+            distributions = np.divide(scores, sums, out=np.zeros_like(scores), where=sums > 0)
+
+    unassigned = np.nonzero(np.sum(distributions, axis=1) == 0)[0]
+    if hard:
+        number_of_communities = K + len(unassigned)
+        distributions = np.hstack((distributions, np.zeros(shape=(number_of_new_nodes, len(unassigned)))))
+        distributions[unassigned, K + np.arange(len(unassigned))] = 1.0
+    else:
+        number_of_communities = K
+        distributions[unassigned, :] = 1.0 / K
+
+    # The new columns get the average scale of the existing ones
+    new_columns = distributions.T * (all_column_sums.sum() / max(number_of_old_nodes, 1))
+    if sp.issparse(phi):
+        phi = sp.vstack((phi, sp.csc_matrix((number_of_communities - K, number_of_old_nodes))))
+        phi = sp.hstack((phi, sp.csc_matrix(new_columns))).tocsc().astype(np.float32)
+    else:
+        phi = _extend_dense_phi(phi, number_of_communities, number_of_old_nodes + number_of_new_nodes)
+        phi[:, number_of_old_nodes:] = new_columns
+
+    return phi, number_of_communities
+
+
+def sample_community_walks(node_walks, phi, rng=np.random, chunk_size=100000):
+    """
+    Label every token of the walks with a community drawn from the normalized column of its node in phi. The labels
+    are deterministic for hard partitions. The tokens are processed in chunks of chunk_size.
+    """
+
+    if np.any(node_walks < 0):
+        raise ValueError("The walks contain nodes which do not exist in the graph!")
+
+    K = phi.shape[0]
+    community_walks = np.zeros(shape=(len(node_walks), ), dtype=np.int32)
+    for start in range(0, len(node_walks), chunk_size):
+        columns = phi[:, node_walks[start:start + chunk_size]]
+        columns = columns.toarray() if sp.issparse(columns) else np.asarray(columns)
+        cdf = np.cumsum(columns, axis=0)
+        draws = rng.random_sample(columns.shape[1]) * cdf[-1]
+        community_walks[start:start + chunk_size] = np.minimum(np.sum(cdf <= draws, axis=0), K - 1)
+
+    return community_walks
@@ -0,0 +1,316 @@
+import time
+import random
+import traceback
+import multiprocessing
+from six.moves.queue import Empty
+from itertools import chain
+from collections import deque, defaultdict
+from multiprocessing import cpu_count
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import logsumexp
+import bayesian_hmm
+from tne.communities import format_phi
+
+DECODING_METHODS = ['viterbi', 'posterior']
+# The number of scores of the walks decoded together, a chunk takes about 8 bytes per score
+_DECODE_BUDGET = 1 << 22
+# The interval in seconds at which the chain processes are checked while no message arrives
+_POLL_SECONDS = 1.0
+
+
+def _mcmc_step(hmm, ncores):
+    # A single iteration of HDPHMM.mcmc, working down the hierarchy, without copying the parameters into a history
+    hmm.update_states()
+    hmm.resample_hyperparameters()
+    hmm.resample_beta_transition(ncores=ncores)
+    hmm.resample_beta_emission()
+    hmm.resample_p_initial()
+    hmm.resample_p_transition()
+    hmm.resample_p_emission()
+    hmm.resample_chains(ncores=ncores)
+
+
+def _converged(history, tolerance):
+    # The log-likelihoods of the last steps vary by less than a tolerance fraction of their mean
+    if not tolerance or len(history) < history.maxlen:
+        return False
+
+    return max(history) - min(history) <= tolerance * abs(np.mean(history))
+
+
+def _latent_labels(latent_sequences, states):
+    # The flat array of the state numbers of all tokens and the offsets of the walks
+    state2comm = {state: comm for comm, state in enumerate(states)}
+    offsets = np.zeros(shape=(len(latent_sequences) + 1, ), dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, latent_sequences), dtype=np.int64, count=len(latent_sequences)), out=offsets[1:])
+    labels = np.fromiter(map(state2comm.__getitem__, chain.from_iterable(latent_sequences)), dtype=np.int32,
+                         count=offsets[-1])
+
+    return labels, offsets
+
+
+def _run_chain(sequences, chain_no, seed, number_of_steps, ncores, tolerance, window, sticky, report):
+    # Sample a chain, report the log-likelihood of each step and the last sample, which is the only one kept
+    initial_time = time.time()
+    np.random.seed(seed)
+    random.seed(seed)
+
+    # initialise object with overestimate of true number of latent states
+    hmm = bayesian_hmm.HDPHMM(sequences, sticky=sticky)
+    hmm.initialise()
+
+    history = deque(maxlen=window)
+    converged = False
+    for step in range(number_of_steps):
+        step_time = time.time()
+        _mcmc_step(hmm, ncores)
+        # The library returns the negative log-likelihood of the walks given the latent states
+        loglikelihood = -float(hmm.calculate_chain_loglikelihood())
+        history.append(loglikelihood)
+        report(('step', chain_no, step, loglikelihood, hmm.k, time.time() - step_time))
+        if _converged(history, tolerance):
+            converged = True
+            break
+
+    # The new state None of the Dirichlet process is not a community
+    states = [state for state in hmm.p_initial if state is not None]
+    labels, offsets = _latent_labels([hmm_chain.latent_sequence for hmm_chain in hmm.chains], states)
+    report(('chain', {'chain': chain_no, 'steps': step + 1, 'loglikelihood': history[-1],
+                      'converged': converged, 'seconds': time.time() - initial_time, 'states': states,
+                      'parameters': {'p_initial': hmm.p_initial, 'p_emission': hmm.p_emission,
+                                     'p_transition': hmm.p_transition},
+                      'labels': labels, 'offsets': offsets}))
+
+
+def hdphmm_chains(walks, number_of_steps, chains=1, cores=None, tolerance=1e-3, window=5, seed=1, sticky=False,
+                  metrics=None):
+    """
+    Sample chains independent HDPHMMs (see bayesian_hmm) over the walks and return the last sample of the chain of the
+    highest log-likelihood, as a dict with its 'states', its 'parameters' (the 'p_initial', 'p_emission' and
+    'p_transition' dictionaries), the state numbers of the tokens as the flat 'labels' array with the 'offsets' of
+    the walks, its 'loglikelihood' and its number of 'steps'. A chain stops after number_of_steps steps, or earlier
+    once the log-likelihoods of its last window steps vary by less than a tolerance fraction (a zero tolerance
+    disables the early stopping). Each step keeps only the current sample. The chains are run by forked processes
+    sharing the budget of cores (the number of cores by default), and the cores of a chain resample its latent states
+    in parallel. The chain no i is seeded with seed + i. The time of each step and a summary of each chain are
+    recorded into metrics (see utils.metrics) if it is given.
+    """
+
+    if number_of_steps < 1 or chains < 1:
+        raise ValueError("The number of steps and the number of chains must be positive!")
+
+    cores = cores if cores else cpu_count()
+    # The library requires the whole corpus as a list of walk lists, which is shared with the forked processes
+    sequences = [list(walk) for walk in walks]
+    processes = min(chains, cores)
+    ncores = max(cores // processes, 1)
+
+    best = [None]
+
+    def handle(message):
+        if message[0] == 'step':
+            if metrics is not None:
+                metrics.observe('hmm.step_seconds', message[-1])
+            return
+        result = message[1]
+        print("--> The HMM chain {} has {} after {} steps with the log-likelihood {:.2f}.".format(
+            result['chain'], "converged" if result['converged'] else "stopped", result['steps'],
+            result['loglikelihood']))
+        if metrics is not None:
+            metrics.emit('hmm_chain', chain=result['chain'], steps=result['steps'], converged=result['converged'],
+                         loglikelihood=result['loglikelihood'], seconds=result['seconds'],
+                         states=len(result['states']))
+        # Only the best chain is kept, the ties go to the smallest chain number
+        if best[0] is None or (result['loglikelihood'], -result['chain']) > (best[0]['loglikelihood'],
+                                                                             -best[0]['chain']):
+            best[0] = result
+
+    if processes == 1:
+        for chain_no in range(chains):
+            _run_chain(sequences, chain_no, seed + chain_no, number_of_steps, ncores, tolerance, window, sticky,
+                       handle)
+        return best[0]
+
+    def process_loop(next_chain, progress_queue):
+        """Sample the chains whose numbers are taken from the shared counter."""
+        try:
+            while True:
+                with next_chain.get_lock():
+                    chain_no = next_chain.value
+                    next_chain.value += 1
+                if chain_no >= chains:
+                    break
+                _run_chain(sequences, chain_no, seed + chain_no, number_of_steps, ncores, tolerance, window, sticky,
+                           progress_queue.put)
+        except Exception:
+            progress_queue.put(('error', traceback.format_exc()))
+        finally:
+            progress_queue.put(None)
+
+    context = multiprocessing.get_context('fork')
+    next_chain = context.Value('q', 0)
+    progress_queue = context.Queue()
+    # The library resamples the latent states in a pool of processes, so the workers cannot be daemonic
+    workers = [context.Process(target=process_loop, name="hmm-process-{}".format(i), args=(next_chain, progress_queue))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        unfinished_worker_count, error = len(workers), None
+        next_poll = time.time() + _POLL_SECONDS
+        while unfinished_worker_count > 0:
+            # A process killed by a signal, e.g. by the OOM killer, never reports that it finished
+            if time.time() >= next_poll:
+                next_poll = time.time() + _POLL_SECONDS
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    raise ValueError("An HMM chain process has died!")
+            try:
+                message = progress_queue.get(timeout=_POLL_SECONDS)
+            except Empty:
+                continue
+            if message is None:
+                unfinished_worker_count -= 1
+            elif message[0] == 'error':
+                error = message[1]
+            else:
+                handle(message)
+    finally:
+        for worker in workers:
+            if unfinished_worker_count > 0:
+                worker.terminate()
+            worker.join()
+
+    if error is not None:
+        raise ValueError("An error occurred while sampling the HMM chains!\n{}".format(error))
+
+    return best[0]
+
+
+def emission_matrix(p_emission, states, id2node, sparse=False):
+    """
+    Return the K x N phi matrix of the emission probabilities of the states over the nodes of id2node, dense or
+    sparse (see tne.communities.format_phi), each state row being normalized to sum up to one. The entries of all
+    emission dictionaries are gathered in a single pass, the emissions which are not nodes of id2node are dropped.
+    """
+
+    node2id = defaultdict(lambda: -1, ((node, nodeId) for nodeId, node in id2node.items()))
+    rows = [p_emission[state] for state in states]
+    lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+    columns = np.fromiter(map(node2id.__getitem__, chain.from_iterable(rows)), dtype=np.int64, count=lengths.sum())
+    values = np.fromiter(chain.from_iterable(row.values() for row in rows), dtype=np.float64, count=lengths.sum())
+    comms = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+
+    mask = columns >= 0
+    emission = sp.csr_matrix((values[mask], (comms[mask], columns[mask])), shape=(len(rows), len(id2node)))
+    row_sums = np.asarray(emission.sum(axis=1)).ravel()
+    emission = sp.diags(np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)).dot(emission)
+
+    return format_phi(emission, sparse=sparse)
+
+
+def state_probabilities(parameters, states):
+    """
+    Return the initial probabilities and the K x K transition matrix of the states from the 'p_initial' and the
+    'p_transition' dictionaries, renormalized without the new state None.
+    """
+
+    initial = np.fromiter(map(parameters['p_initial'].__getitem__, states), dtype=np.float64, count=len(states))
+    transition = np.asarray([np.fromiter(map(parameters['p_transition'][state].__getitem__, states),
+                                         dtype=np.float64, count=len(states)) for state in states])
+    transition = transition.reshape((len(states), len(states)))
+    row_sums = np.sum(transition, axis=1, keepdims=True)
+
+    return initial / max(np.sum(initial), 1e-300), np.divide(transition, row_sums, out=np.zeros_like(transition),
+                                                             where=row_sums > 0)
+
+
+def _log(probabilities):
+    # The zero probabilities get a finite log, so that the impossible paths do not produce nans
+    return np.log(np.maximum(probabilities, np.finfo(np.float64).tiny))
+
+
+def _log_emissions(emission, nodes):
+    # The log-probabilities of the nodes under each state, as a len(nodes) x K matrix
+    columns = emission[:, nodes]
+    columns = columns.toarray() if sp.issparse(columns) else np.asarray(columns)
+
+    return _log(columns.T)
+
+
+def _viterbi(emission, nodes, starts, alive, log_initial, log_transition, labels):
+    # The most likely state sequences of the walks starting at starts, alive[t] of them having more than t tokens
+    T, n, K = len(alive), len(starts), len(log_initial)
+    delta = log_initial + _log_emissions(emission, nodes[starts])
+    back = np.empty(shape=(T, n, K), dtype=np.int32)
+    for t in range(1, T):
+        m = alive[t]
+        scores = delta[:m, :, None] + log_transition
+        back[t, :m] = np.argmax(scores, axis=1)
+        delta[:m] = np.take_along_axis(scores, back[t, :m, None, :].astype(np.int64), axis=1)[:, 0, :]
+        delta[:m] += _log_emissions(emission, nodes[starts[:m] + t])
+
+    # The last state of each walk is kept until the backtracking reaches its last token
+    state = np.argmax(delta, axis=1)
+    for t in range(T - 1, -1, -1):
+        m = alive[t]
+        labels[starts[:m] + t] = state[:m]
+        if t > 0:
+            state[:m] = back[t, np.arange(m), state[:m]]
+
+
+def _posterior(emission, nodes, starts, alive, log_initial, log_transition, labels):
+    # The states of the highest posterior marginals of the tokens, computed by the forward-backward algorithm
+    T, n, K = len(alive), len(starts), len(log_initial)
+    log_alpha = np.empty(shape=(T, n, K), dtype=np.float64)
+    log_alpha[0] = log_initial + _log_emissions(emission, nodes[starts])
+    for t in range(1, T):
+        m = alive[t]
+        log_alpha[t, :m] = logsumexp(log_alpha[t - 1, :m, :, None] + log_transition, axis=1)
+        log_alpha[t, :m] += _log_emissions(emission, nodes[starts[:m] + t])
+
+    # The backward messages of the walks are zero at their last tokens
+    log_beta = np.zeros(shape=(n, K), dtype=np.float64)
+    for t in range(T - 1, -1, -1):
+        m = alive[t]
+        labels[starts[:m] + t] = np.argmax(log_alpha[t, :m] + log_beta[:m], axis=1)
+        if t > 0:
+            log_beta[:m] = logsumexp(log_transition + (_log_emissions(emission, nodes[starts[:m] + t]) +
+                                                       log_beta[:m])[:, None, :], axis=2)
+
+
+def decode_walks(node_walks, offsets, initial, transition, emission, method='viterbi'):
+    """
+    Label every token of the walks with a state of the HMM of the given initial probabilities, K x K transition
+    matrix and K x N emission matrix (dense or sparse, e.g. phi), so that the walks which were not seen by the
+    sampler can be labelled. node_walks is the flat array of node ids of all tokens and offsets[i] the start of the
+    walk i. The 'viterbi' method gives the most likely state sequence of each walk and the 'posterior' method the
+    state of the highest posterior marginal of each token. The walks are sorted by length and decoded in chunks, a
+    time step of all walks of a chunk at once.
+    """
+
+    if method not in DECODING_METHODS:
+        raise ValueError("Invalid decoding method: {}".format(method))
+    if np.any(node_walks < 0):
+        raise ValueError("The walks contain nodes which do not exist in the graph!")
+
+    K = len(initial)
+    decode = _viterbi if method == 'viterbi' else _posterior
+    log_initial, log_transition = _log(initial), _log(transition)
+    labels = np.zeros(shape=(len(node_walks), ), dtype=np.int32)
+
+    # The walks running at each time step are a prefix of the walks sorted by decreasing length
+    lengths = np.diff(offsets)
+    order = np.argsort(-lengths, kind='stable')
+    order = order[lengths[order] > 0]
+    if len(order) == 0:
+        return labels
+    chunk_size = max(_DECODE_BUDGET // (K * max(K, lengths[order[0]])), 1)
+    for start in range(0, len(order), chunk_size):
+        walks = order[start:start + chunk_size]
+        chunk_lengths = lengths[walks]
+        alive = np.searchsorted(-chunk_lengths, -np.arange(chunk_lengths[0]), side='left')
+        decode(emission, node_walks, offsets[walks], alive, log_initial, log_transition, labels)
+
+    return labels
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    import pyximport
+
+    from numpy import get_include
+    tne_dir = os.path.dirname(__file__) or os.getcwd()
+
+    pyximport.install(setup_args={"include_dirs": [tne_dir, get_include()]})
+    from tne.lda_inner import initialize_topics, build_word_proposals, sample_topics
+except ImportError:
+    raise ValueError("An error occurred while loading the optimized version!")
+
+
+class GibbsLDA(object):
+    """
+    Collapsed Gibbs sampler for LDA running in-process on the flat integer arrays of the walks. Each token is
+    resampled with the Metropolis-Hastings word and document proposals of LightLDA, so the cost per token does not
+    depend on the number of topics, and the documents are split into shards of equal number of tokens sampled by
+    concurrent threads sharing the global counts. The word-topic counts are kept in a hash row per word sized by the
+    number of its tokens, so their memory is bounded by the number of tokens instead of V x K, and only the rows and
+    the proposal tables of the words whose tokens changed their topics are rebuilt between the iterations. The time
+    of each iteration is recorded into metrics (see utils.metrics) if it is given.
+    """
+
+    def __init__(self, K, alpha, beta, number_of_iters, workers=1, mh_steps=2, seed=1, metrics=None):
+
+        self.K = K
+        self.alpha = alpha
+        self.beta = beta
+        self.number_of_iters = number_of_iters
+        self.workers = max(int(workers), 1)
+        self.mh_steps = mh_steps
+        self.seed = seed
+        self.metrics = metrics
+
+        self.V = None
+        self.offsets = None
+        self.z = None  # The topic assignment of each token
+        self.n_k = None  # The topic counts
+        # The word-topic counts, the row of the word w lies in [row_offsets[w], row_offsets[w+1]) of the keys and the
+        # counts. A row of K slots is indexed by the topics (row_masks[w] = -1), otherwise it is a hash row of a
+        # power of two slots, the keys being the topics and -1 for the empty slots
+        self.keys, self.counts = None, None
+        self.row_offsets, self.row_masks = None, None
+
+    def fit(self, tokens, offsets, V):
+        """Sample the topic assignments of the tokens, tokens being the word ids in [0, V) of the documents."""
+
+        tokens = np.ascontiguousarray(tokens, dtype=np.int32)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.V = V
+
+        word_freqs = np.bincount(tokens[tokens >= 0], minlength=V).astype(np.int64)
+        # A row holds the topics of the word at the beginning of an iteration and those its tokens move to
+        capacities = 2 * np.minimum(2 * word_freqs, self.K)
+        capacities = np.left_shift(1, np.ceil(np.log2(np.maximum(capacities, 1))).astype(np.int64))
+        direct = capacities >= self.K
+        capacities[direct] = self.K
+        self.row_masks = np.where(direct, -1, capacities - 1).astype(np.int32)
+        self.row_offsets = np.zeros(shape=(V + 1, ), dtype=np.int64)
+        np.cumsum(capacities, out=self.row_offsets[1:])
+        self.keys = np.full(shape=(self.row_offsets[-1], ), fill_value=-1, dtype=np.int32)
+        self.counts = np.zeros(shape=(self.row_offsets[-1], ), dtype=np.int32)
+
+        self.z = np.empty(shape=(len(tokens), ), dtype=np.int32)
+        self.n_k = np.zeros(shape=(self.K, ), dtype=np.int64)
+        initialize_topics(tokens, self.z, self.keys, self.counts, self.row_offsets, self.row_masks, self.n_k, self.K,
+                          self.seed)
+
+        # The proposal table of a word has a position for each of its nonzero topics
+        word_offsets = np.zeros(shape=(V + 1, ), dtype=np.int64)
+        np.cumsum(np.minimum(word_freqs, self.K), out=word_offsets[1:])
+        word_sizes = np.zeros(shape=(V, ), dtype=np.int32)
+        topics = np.empty(shape=(word_offsets[-1], ), dtype=np.int32)
+        counts = np.empty(shape=(word_offsets[-1], ), dtype=np.int32)
+        accept = np.empty(shape=(word_offsets[-1], ), dtype=np.float32)
+        alias = np.empty(shape=(word_offsets[-1], ), dtype=np.int32)
+        # The words whose tokens have changed their topics
+        dirty = np.ones(shape=(V, ), dtype=np.uint8)
+
+        # Split the documents into shards having approximately the same number of tokens
+        shard_bounds = np.searchsorted(self.offsets, np.linspace(0, len(tokens), self.workers + 1), side='left')
+        shard_bounds[0], shard_bounds[-1] = 0, len(self.offsets) - 1
+
+        for iter_no in range(self.number_of_iters):
+            iter_time = time.time()
+            # The proposal tables of the changed words are rebuilt from the counts at the beginning of the iteration
+            rebuilt_words = build_word_proposals(dirty, self.keys, self.counts, self.row_offsets, self.row_masks,
+                                                 word_offsets, word_sizes, topics, counts, accept, alias, self.K)
+
+            threads = []
+            for shard_no in range(self.workers):
+                args = (tokens, self.offsets, self.z, self.keys, self.counts, self.row_offsets, self.row_masks,
+                        self.n_k, dirty, word_freqs, word_offsets, word_sizes, topics, counts, accept, alias,
+                        shard_bounds[shard_no], shard_bounds[shard_no + 1], self.alpha, self.beta, self.mh_steps,
+                        self.seed + (iter_no + 1) * self.workers + shard_no)
+                threads.append(threading.Thread(target=sample_topics, name="lda-worker-{}".format(shard_no), args=args))
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            if self.metrics is not None:
+                iter_time = time.time() - iter_time
+                self.metrics.observe('lda.iteration_seconds', iter_time)
+                self.metrics.emit('lda_iteration', iteration=iter_no, seconds=iter_time,
+                                  tokens_per_sec=len(tokens) / max(iter_time, 1e-9), rebuilt_words=rebuilt_words)
+
+        return self
+
+    def word_topic_counts(self):
+        """Return the V x K word-topic counts as a sparse CSR matrix."""
+
+        words = np.repeat(np.arange(self.V, dtype=np.int64), np.diff(self.row_offsets))
+        slots = np.arange(self.row_offsets[-1], dtype=np.int64) - self.row_offsets[words]
+        direct = self.row_masks[words] < 0
+        topics = np.where(direct, slots, self.keys)
+        valid = (self.counts > 0) & (direct | (self.keys >= 0))
+
+        return sp.csr_matrix((self.counts[valid], (words[valid], topics[valid])), shape=(self.V, self.K))
+
+    def get_phi(self):
+        """Return the K x V topic-word distributions."""
+
+        n_kw = self.word_topic_counts().T.tocsr()
+        phi = np.full(shape=(self.K, self.V), fill_value=self.beta, dtype=np.float64)
+        rows = np.repeat(np.arange(self.K), np.diff(n_kw.indptr))
+        phi[rows, n_kw.indices] += n_kw.data
+
+        return phi / (self.n_k[:, None] + self.V * self.beta)
+
+    def get_theta(self):
+        """Return the D x K document-topic distributions."""
+
+        lengths = np.diff(self.offsets)
+        doc_ids = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        valid = self.z >= 0
+        n_dk = np.bincount(doc_ids[valid] * self.K + self.z[valid], minlength=len(lengths) * self.K)
+
+        return (n_dk.reshape(len(lengths), self.K) + self.alpha) / (lengths[:, None] + self.K * self.alpha)
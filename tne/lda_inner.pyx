@@ -0,0 +1,335 @@
+#!/usr/bin/env cython
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: cdivision=True
+# coding: utf-8
+#
+# Collapsed Gibbs sampling for LDA with the Metropolis-Hastings proposals of LightLDA: the word proposal
+# q_w(k) ~ n_wk + beta is drawn in O(1) from sparse alias tables, and the document proposal q_d(k) ~ n_dk + alpha is
+# drawn from the topics of the other tokens of the document. The word-topic counts are kept in a hash row per word,
+# holding at most min(K, 2 * freq) topics, whose slots are indexed directly by the topics once the row would have K
+# slots. The counts are shared by the sampling threads and updated with atomic operations, and a new topic claims an
+# empty slot of a row by a compare-and-swap.
+
+import numpy as np
+cimport numpy as np
+
+from libc.stdlib cimport malloc, calloc, free
+
+ctypedef np.int32_t INT_t
+ctypedef np.int64_t LONG_t
+
+cdef extern from *:
+    """
+    static inline int atomic_add_int(int *ptr, int value) { return __sync_fetch_and_add(ptr, value); }
+    static inline long long atomic_add_long(long long *ptr, long long value) { return __sync_fetch_and_add(ptr, value); }
+    static inline int atomic_cas_int(int *ptr, int old, int value) {
+        return __sync_val_compare_and_swap(ptr, old, value);
+    }
+    """
+    int atomic_add_int(int *ptr, int value) nogil
+    long long atomic_add_long(long long *ptr, long long value) nogil
+    int atomic_cas_int(int *ptr, int old, int value) nogil
+
+# the key of an empty slot of a hash row
+DEF EMPTY = -1
+
+
+# xorshift64* generator, the state must be nonzero
+cdef inline unsigned long long random_uint64(unsigned long long *state) nogil:
+    cdef unsigned long long x = state[0]
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    state[0] = x
+    return x * 2685821657736338717ULL
+
+cdef inline double random_uniform(unsigned long long *state) nogil:
+    return (random_uint64(state) >> 11) * (1.0 / 9007199254740992.0)
+
+cdef inline int random_int(unsigned long long *state, int n) nogil:
+    return <int>(random_uniform(state) * n)
+
+cdef inline double nonnegative(double value) nogil:
+    return value if value > 0 else 0.0
+
+# the count of topic k in the sorted sparse row of a word, 0 if the topic does not exist in the row
+cdef inline int sparse_count(const INT_t *topics, const INT_t *counts, long long n, int k) nogil:
+    cdef long long lo = 0, hi = n, mid
+    while hi > lo:
+        mid = (lo + hi) >> 1
+        if topics[mid] < k:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < n and topics[lo] == k:
+        return counts[lo]
+    return 0
+
+
+# the slot of topic k in a row, for a hash row the slot holding k or the empty slot ending its probe sequence
+cdef inline long long row_slot(const INT_t *keys, int mask, int k) nogil:
+    cdef long long slot
+    if mask < 0:
+        return k
+    slot = (<unsigned int>k * 2654435761U) & mask
+    while keys[slot] != k and keys[slot] != EMPTY:
+        slot = (slot + 1) & mask
+    return slot
+
+# the count of topic k in a row, 0 if the topic does not exist in the row
+cdef inline int row_count(const INT_t *keys, const INT_t *counts, int mask, int k) nogil:
+    cdef long long slot = row_slot(keys, mask, k)
+    if mask < 0 or keys[slot] == k:
+        return counts[slot]
+    return 0
+
+# add value to the count of topic k in a row, a missing topic is inserted into an empty slot, return the slot
+cdef inline long long row_add(INT_t *keys, INT_t *counts, int mask, int k, int value) nogil:
+    cdef long long slot
+    cdef int key
+    if mask < 0:
+        atomic_add_int(<int *>&counts[k], value)
+        return k
+    slot = (<unsigned int>k * 2654435761U) & mask
+    while True:
+        key = keys[slot]
+        if key == EMPTY:
+            key = atomic_cas_int(<int *>&keys[slot], EMPTY, k)
+            if key == EMPTY:
+                break
+        if key == k:
+            break
+        slot = (slot + 1) & mask
+    atomic_add_int(<int *>&counts[slot], value)
+    return slot
+
+# sort the packed (topic, count) pairs by topic in place (heapsort)
+cdef int sort_pairs(long long *pairs, long long n) nogil:
+    cdef long long start, end, root, child, tmp
+    start = n // 2
+    end = n
+    while end > 1:
+        if start > 0:
+            start -= 1
+        else:
+            end -= 1
+            tmp = pairs[end]
+            pairs[end] = pairs[0]
+            pairs[0] = tmp
+        root = start
+        while 2 * root + 1 < end:
+            child = 2 * root + 1
+            if child + 1 < end and pairs[child] < pairs[child + 1]:
+                child += 1
+            if pairs[root] >= pairs[child]:
+                break
+            tmp = pairs[root]
+            pairs[root] = pairs[child]
+            pairs[child] = tmp
+            root = child
+    return 0
+
+
+def initialize_topics(const INT_t[:] tokens, INT_t[:] z, INT_t[:] keys, INT_t[:] counts, const LONG_t[:] row_offsets,
+                      const INT_t[:] row_masks, LONG_t[:] n_k, int K, unsigned long long seed):
+    """Assign a uniformly random topic to each token and fill the word-topic rows and the topic counts."""
+    cdef long long i, number_of_tokens = tokens.shape[0]
+    cdef unsigned long long state = 2 * seed + 1
+    cdef int w
+
+    with nogil:
+        for i in range(number_of_tokens):
+            w = tokens[i]
+            if w < 0:
+                z[i] = -1
+                continue
+            z[i] = random_int(&state, K)
+            row_add(&keys[row_offsets[w]], &counts[row_offsets[w]], row_masks[w], z[i], 1)
+            n_k[z[i]] += 1
+
+
+def build_word_proposals(np.uint8_t[:] dirty, INT_t[:] keys, INT_t[:] counts, const LONG_t[:] row_offsets,
+                         const INT_t[:] row_masks, const LONG_t[:] word_offsets, INT_t[:] word_sizes, INT_t[:] topics,
+                         INT_t[:] proposal_counts, float[:] accept, INT_t[:] alias, int K):
+    """
+    Rebuild the alias tables (Vose's method) of the nonzero topic counts of the words marked as dirty, and clear
+    their marks. The table of the word w is stored in the positions [word_offsets[w], word_offsets[w] +
+    word_sizes[w]) with the topics sorted in increasing order, and the alias entries are relative to the beginning of
+    the table. The hash rows of these words are compacted, so that their topics of zero count free their slots.
+    Return the number of rebuilt words.
+    """
+    cdef int V = dirty.shape[0]
+    cdef int w, k, i, n, s, l, mask, number_of_small, number_of_large, number_of_rebuilt = 0
+    cdef long long pos, base, slot, capacity, total
+    cdef int *small = <int *>malloc(K * sizeof(int))
+    cdef int *large = <int *>malloc(K * sizeof(int))
+    cdef double *scaled = <double *>malloc(K * sizeof(double))
+    cdef long long *pairs = <long long *>malloc(K * sizeof(long long))
+
+    with nogil:
+        for w in range(V):
+            if not dirty[w]:
+                continue
+            dirty[w] = 0
+            number_of_rebuilt += 1
+            pos, base, mask = word_offsets[w], row_offsets[w], row_masks[w]
+            capacity = row_offsets[w + 1] - base
+
+            # the nonzero counts of the row in the increasing order of the topics
+            n, total = 0, 0
+            if mask < 0:
+                for k in range(K):
+                    if counts[base + k] > 0:
+                        topics[pos + n] = k
+                        proposal_counts[pos + n] = counts[base + k]
+                        total += counts[base + k]
+                        n += 1
+            else:
+                for slot in range(capacity):
+                    if keys[base + slot] != EMPTY and counts[base + slot] > 0:
+                        pairs[n] = ((<long long>keys[base + slot]) << 32) | counts[base + slot]
+                        total += counts[base + slot]
+                        n += 1
+                    keys[base + slot] = EMPTY
+                    counts[base + slot] = 0
+                sort_pairs(pairs, n)
+                for i in range(n):
+                    topics[pos + i] = <int>(pairs[i] >> 32)
+                    proposal_counts[pos + i] = <int>(pairs[i] & 0x7FFFFFFF)
+                    row_add(&keys[base], &counts[base], mask, topics[pos + i], proposal_counts[pos + i])
+            word_sizes[w] = n
+
+            number_of_small, number_of_large = 0, 0
+            for i in range(n):
+                scaled[i] = proposal_counts[pos + i] * n / <double>total
+                alias[pos + i] = i
+                if scaled[i] < 1.0:
+                    small[number_of_small] = i
+                    number_of_small += 1
+                else:
+                    large[number_of_large] = i
+                    number_of_large += 1
+
+            while number_of_small > 0 and number_of_large > 0:
+                number_of_small -= 1
+                s = small[number_of_small]
+                number_of_large -= 1
+                l = large[number_of_large]
+                accept[pos + s] = <float>scaled[s]
+                alias[pos + s] = l
+                scaled[l] = scaled[l] + scaled[s] - 1.0
+                if scaled[l] < 1.0:
+                    small[number_of_small] = l
+                    number_of_small += 1
+                else:
+                    large[number_of_large] = l
+                    number_of_large += 1
+
+            # the remaining entries are equal to 1 up to numerical errors
+            while number_of_large > 0:
+                number_of_large -= 1
+                accept[pos + large[number_of_large]] = 1.0
+            while number_of_small > 0:
+                number_of_small -= 1
+                accept[pos + small[number_of_small]] = 1.0
+
+    free(small)
+    free(large)
+    free(scaled)
+    free(pairs)
+
+    return number_of_rebuilt
+
+
+def sample_topics(const INT_t[:] tokens, const LONG_t[:] offsets, INT_t[:] z, INT_t[:] keys, INT_t[:] counts,
+                  const LONG_t[:] row_offsets, const INT_t[:] row_masks, LONG_t[:] n_k, np.uint8_t[:] dirty,
+                  const LONG_t[:] word_freqs, const LONG_t[:] word_offsets, const INT_t[:] word_sizes,
+                  const INT_t[:] topics, const INT_t[:] proposal_counts, const float[:] accept, const INT_t[:] alias,
+                  long long doc_start, long long doc_end, double alpha, double beta, int mh_steps,
+                  unsigned long long seed):
+    """
+    Resample the topics of the tokens of the documents in [doc_start, doc_end). Each token is updated by mh_steps
+    cycles of a word proposal and a document proposal, and the words whose tokens change their topic are marked as
+    dirty. The GIL is released, so that several threads can sample disjoint document ranges concurrently.
+    """
+    cdef int V = dirty.shape[0], K = n_k.shape[0]
+    cdef double V_beta = V * beta, K_alpha = K * alpha
+    cdef unsigned long long state = 2 * seed + 1
+    cdef int *n_dk = <int *>calloc(K, sizeof(int))
+    cdef long long d, i, j, start, end, length, pos, n
+    cdef int w, s, t, step, mask
+    cdef INT_t *row_keys
+    cdef INT_t *row_counts
+    cdef double freq, ratio
+
+    with nogil:
+        for d in range(doc_start, doc_end):
+            start, end = offsets[d], offsets[d + 1]
+            length = end - start
+            for i in range(start, end):
+                if z[i] >= 0:
+                    n_dk[z[i]] += 1
+
+            for i in range(start, end):
+                w = tokens[i]
+                if w < 0:
+                    continue
+                pos = word_offsets[w]
+                n = word_sizes[w]
+                freq = <double>word_freqs[w]
+                row_keys, row_counts, mask = &keys[row_offsets[w]], &counts[row_offsets[w]], row_masks[w]
+
+                # remove the token from the counts
+                s = z[i]
+                n_dk[s] -= 1
+                row_add(row_keys, row_counts, mask, s, -1)
+                atomic_add_long(<long long *>&n_k[s], -1)
+
+                for step in range(mh_steps):
+                    # word proposal, a mixture of the sparse counts of the word and the uniform smoothing mass
+                    if random_uniform(&state) * (freq + K * beta) < freq:
+                        j = random_int(&state, n)
+                        t = topics[pos + j] if random_uniform(&state) < accept[pos + j] else topics[pos + alias[pos + j]]
+                    else:
+                        t = random_int(&state, K)
+                    if t != s:
+                        ratio = (n_dk[t] + alpha) * (nonnegative(row_count(row_keys, row_counts, mask, t)) + beta)
+                        ratio *= (nonnegative(n_k[s]) + V_beta)
+                        ratio *= sparse_count(&topics[pos], &proposal_counts[pos], n, s) + beta
+                        ratio /= (n_dk[s] + alpha) * (nonnegative(row_count(row_keys, row_counts, mask, s)) + beta)
+                        ratio /= (nonnegative(n_k[t]) + V_beta)
+                        ratio /= sparse_count(&topics[pos], &proposal_counts[pos], n, t) + beta
+                        if random_uniform(&state) < ratio:
+                            s = t
+
+                    # document proposal, the topic of another token of the document or a uniform topic
+                    t = -1
+                    if length > 1 and random_uniform(&state) * (length - 1 + K_alpha) < length - 1:
+                        j = start + random_int(&state, <int>(length - 1))
+                        if j >= i:
+                            j += 1
+                        t = z[j]
+                    if t < 0:
+                        t = random_int(&state, K)
+                    if t != s:
+                        ratio = (nonnegative(row_count(row_keys, row_counts, mask, t)) + beta)
+                        ratio *= (nonnegative(n_k[s]) + V_beta)
+                        ratio /= (nonnegative(row_count(row_keys, row_counts, mask, s)) + beta)
+                        ratio /= (nonnegative(n_k[t]) + V_beta)
+                        if random_uniform(&state) < ratio:
+                            s = t
+
+                # add the token back with its new topic
+                if s != z[i]:
+                    dirty[w] = 1
+                z[i] = s
+                n_dk[s] += 1
+                row_add(row_keys, row_counts, mask, s, 1)
+                atomic_add_long(<long long *>&n_k[s], 1)
+
+            for i in range(start, end):
+                if z[i] >= 0:
+                    n_dk[z[i]] = 0
+
+    free(n_dk)
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+import numpy as np
+import scipy.sparse as sp
+from multiprocessing import cpu_count
+
+try:
+    import pyximport
+
+    from numpy import get_include
+    tne_dir = os.path.dirname(__file__) or os.getcwd()
+
+    pyximport.install(setup_args={"include_dirs": [tne_dir, get_include()]})
+    from tne.louvain_inner import move_nodes
+except ImportError:
+    raise ValueError("An error occurred while loading the optimized version!")
+
+
+def _strengths(indptr, weights):
+    # The weighted degree of each node, the sum of the weights of its row
+    cumulative = np.zeros(shape=(len(weights) + 1, ), dtype=np.float64)
+    np.cumsum(weights, dtype=np.float64, out=cumulative[1:])
+
+    return cumulative[indptr[1:]] - cumulative[indptr[:-1]]
+
+
+def _symmetric_csr(graph):
+    # The arrays of the undirected CSR adjacency, the directed graphs are symmetrized
+    indptr = np.ascontiguousarray(graph.indptr, dtype=np.int64)
+    indices = np.ascontiguousarray(graph.indices, dtype=np.int32)
+    weights = np.ascontiguousarray(graph.weights, dtype=np.float32)
+    if graph.directed:
+        number_of_nodes = len(indptr) - 1
+        adjacency = sp.csr_matrix((weights, indices, indptr), shape=(number_of_nodes, number_of_nodes))
+        adjacency = (adjacency + adjacency.T).tocsr()
+        adjacency.sort_indices()
+        indptr, indices = adjacency.indptr.astype(np.int64), adjacency.indices.astype(np.int32)
+        weights = adjacency.data.astype(np.float32)
+
+    return indptr, indices, weights
+
+
+def _aggregate(indptr, indices, weights, labels, number_of_comms):
+    # The graph of the communities, whose edge weights are the sums of the weights between them and whose self-loops
+    # are the sums of the weights inside them
+    source = np.repeat(labels, np.diff(indptr)).astype(np.int64)
+    keys = source * number_of_comms + labels[indices]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    aggregated_weights = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys)).astype(np.float32)
+
+    aggregated_indptr = np.zeros(shape=(number_of_comms + 1, ), dtype=np.int64)
+    np.cumsum(np.bincount(keys // number_of_comms, minlength=number_of_comms), out=aggregated_indptr[1:])
+
+    return aggregated_indptr, (keys % number_of_comms).astype(np.int32), aggregated_weights
+
+
+def modularity(indptr, indices, weights, labels, resolution=1.0):
+    """Return the modularity of the partition, labels[i] being the community of the node i of the CSR adjacency."""
+
+    labels = np.asarray(labels, dtype=np.int64)
+    strengths = _strengths(indptr, weights)
+    total_weight = strengths.sum()
+    if total_weight == 0:
+        return 0.0
+
+    source = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    inside = labels[source] == labels[indices]
+    totals = np.bincount(labels, weights=strengths)
+
+    return float(weights[inside].sum(dtype=np.float64) / total_weight -
+                 resolution * np.sum((totals / total_weight) ** 2))
+
+
+def louvain_communities(graph, resolution=1.0, seed=1, workers=None, initial_labels=None, max_levels=32,
+                        max_sweeps=32, tolerance=1e-3, metrics=None):
+    """
+    Detect the communities of a CSRGraph by the Louvain method and return the community of each node index as an
+    int32 array of labels in [0, K). At each level, the local-move phase visits the nodes in a random order drawn
+    from seed, split into workers shards moved by concurrent threads without the GIL (the number of cores by
+    default), until less than a tolerance fraction of the nodes move in a sweep. The communities are then aggregated
+    into the nodes of the next level, until no node moves. Higher resolutions give smaller communities. The search
+    can start from initial_labels instead of the singleton communities. With several workers, the result also depends
+    on the interleaving of the threads. The time and the modularity of each level are recorded into metrics (see
+    utils.metrics) if it is given.
+    """
+
+    workers = workers if workers else cpu_count()
+    rng = np.random.RandomState(seed)
+
+    indptr, indices, weights = _symmetric_csr(graph)
+    number_of_nodes = len(indptr) - 1
+    labels = np.arange(number_of_nodes, dtype=np.int32)
+    if initial_labels is not None:
+        if len(initial_labels) != number_of_nodes:
+            raise ValueError("The number of initial labels must be equal to the number of nodes!")
+        labels = np.unique(np.asarray(initial_labels), return_inverse=True)[1].ravel().astype(np.int32)
+
+    for level in range(max_levels):
+        level_time = time.time()
+        n = len(indptr) - 1
+        strengths = _strengths(indptr, weights)
+        total_weight = strengths.sum()
+        if total_weight == 0:
+            break
+
+        # The first level starts from the initial labels, the next ones from the singleton communities
+        communities = labels.copy() if level == 0 else np.arange(n, dtype=np.int32)
+        totals = np.bincount(communities, weights=strengths, minlength=n)
+        sizes = np.bincount(communities, minlength=n).astype(np.int32)
+
+        moved = np.zeros(shape=(workers, ), dtype=np.int64)
+        shard_bounds = np.linspace(0, n, workers + 1).astype(np.int64)
+        number_of_sweeps, total_moves = 0, 0
+        for sweep in range(max_sweeps):
+            order = rng.permutation(n).astype(np.int32)
+            threads = []
+            for shard_no in range(workers):
+                args = (indptr, indices, weights, strengths, communities, totals, sizes, order,
+                        shard_bounds[shard_no], shard_bounds[shard_no + 1], resolution, total_weight, moved, shard_no)
+                threads.append(threading.Thread(target=move_nodes, name="louvain-worker-{}".format(shard_no),
+                                                args=args))
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+            number_of_sweeps += 1
+            total_moves += moved.sum()
+            if moved.sum() <= tolerance * n:
+                break
+
+        comms, communities = np.unique(communities, return_inverse=True)
+        communities = communities.ravel().astype(np.int32)
+        labels = communities if level == 0 else communities[labels]
+
+        if metrics is not None:
+            level_time = time.time() - level_time
+            metrics.observe('louvain.level_seconds', level_time)
+            metrics.emit('louvain_level', level=level, nodes=n, edges=len(indices), communities=len(comms),
+                         sweeps=number_of_sweeps, moves=total_moves, seconds=level_time,
+                         modularity=modularity(indptr, indices, weights, communities, resolution))
+
+        if len(comms) == n:
+            break
+        indptr, indices, weights = _aggregate(indptr, indices, weights, communities, len(comms))
+
+    return labels
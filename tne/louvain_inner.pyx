@@ -0,0 +1,125 @@
+#!/usr/bin/env cython
+# cython: boundscheck=False
+# cython: wraparound=False
+# cython: cdivision=True
+# coding: utf-8
+#
+# Local-move phase of the parallel Louvain method over a CSR adjacency. The nodes of a shard are visited in the given
+# order and each one is moved to the neighbouring community of the largest modularity gain. The shards are run by
+# concurrent threads without the GIL, sharing the community labels and the community totals, which are updated with
+# atomic operations. A singleton node only joins another singleton community of a smaller label, so that two nodes
+# do not swap their communities forever.
+
+import numpy as np
+cimport numpy as np
+
+from libc.stdlib cimport malloc, free
+
+ctypedef np.int32_t INT_t
+ctypedef np.int64_t LONG_t
+
+cdef extern from *:
+    """
+    static inline int atomic_add_int(int *ptr, int value) { return __sync_fetch_and_add(ptr, value); }
+    static inline void atomic_add_double(double *ptr, double value) {
+        union { double d; unsigned long long u; } old_value, new_value;
+        do {
+            old_value.u = __atomic_load_n((unsigned long long *)ptr, __ATOMIC_RELAXED);
+            new_value.d = old_value.d + value;
+        } while (!__sync_bool_compare_and_swap((unsigned long long *)ptr, old_value.u, new_value.u));
+    }
+    """
+    int atomic_add_int(INT_t *ptr, int value) nogil
+    void atomic_add_double(double *ptr, double value) nogil
+
+
+def move_nodes(const LONG_t[:] indptr, const INT_t[:] indices, const float[:] weights, const double[:] strengths,
+               INT_t[:] communities, double[:] totals, INT_t[:] sizes, const INT_t[:] order, long long start,
+               long long end, double resolution, double total_weight, LONG_t[:] moved, int shard_no):
+    """
+    Move the nodes order[start:end] between the communities and store their number of moves into moved[shard_no].
+    strengths are the weighted degrees of the nodes, totals and sizes the sums of the strengths and the numbers of
+    nodes of the communities, and total_weight the sum of all strengths. The weights of a node to its neighbouring
+    communities are gathered into an open addressing hash table.
+    """
+    cdef long long p, e, max_degree = 0
+    cdef long long capacity = 1
+    cdef int i, j, c, a, best, slot, number_of_used, u
+    cdef double k_i, w_ia, gain, best_gain, scale
+    cdef long long number_of_moves = 0
+    cdef INT_t *keys
+    cdef double *values
+    cdef int *used
+
+    with nogil:
+        for p in range(start, end):
+            i = order[p]
+            if indptr[i + 1] - indptr[i] > max_degree:
+                max_degree = indptr[i + 1] - indptr[i]
+        while capacity < 2 * (max_degree + 1):
+            capacity *= 2
+        keys = <INT_t *>malloc(capacity * sizeof(INT_t))
+        values = <double *>malloc(capacity * sizeof(double))
+        used = <int *>malloc(capacity * sizeof(int))
+
+        for slot in range(capacity):
+            keys[slot] = -1
+
+        for p in range(start, end):
+            i = order[p]
+            k_i = strengths[i]
+            if k_i <= 0:
+                continue
+            a = communities[i]
+
+            # The weights of the node to its neighbouring communities, except the self-loops
+            number_of_used = 0
+            for e in range(indptr[i], indptr[i + 1]):
+                j = indices[e]
+                if j == i:
+                    continue
+                c = communities[j]
+                slot = (<unsigned int>c * 2654435761U) & (capacity - 1)
+                while keys[slot] != -1 and keys[slot] != c:
+                    slot = (slot + 1) & (capacity - 1)
+                if keys[slot] == -1:
+                    keys[slot] = c
+                    values[slot] = 0.0
+                    used[number_of_used] = slot
+                    number_of_used += 1
+                values[slot] += weights[e]
+
+            # The gain of each community relative to the removal of the node from its own one
+            scale = resolution * k_i / total_weight
+            w_ia = 0.0
+            for u in range(number_of_used):
+                if keys[used[u]] == a:
+                    w_ia = values[used[u]]
+            best = a
+            best_gain = w_ia - scale * (totals[a] - k_i)
+            for u in range(number_of_used):
+                c = keys[used[u]]
+                if c == a:
+                    continue
+                if sizes[a] == 1 and sizes[c] == 1 and c > a:
+                    continue
+                gain = values[used[u]] - scale * totals[c]
+                if gain > best_gain + 1e-12 or (gain > best_gain - 1e-12 and best != a and c < best):
+                    best = c
+                    best_gain = gain
+
+            if best != a:
+                atomic_add_double(&totals[a], -k_i)
+                atomic_add_double(&totals[best], k_i)
+                atomic_add_int(&sizes[a], -1)
+                atomic_add_int(&sizes[best], 1)
+                communities[i] = best
+                number_of_moves += 1
+
+            for u in range(number_of_used):
+                keys[used[u]] = -1
+
+        free(keys)
+        free(values)
+        free(used)
+    moved[shard_no] = number_of_moves
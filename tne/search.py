@@ -0,0 +1,283 @@
+import numpy as np
+
+SEARCH_INDEXES = ['exact', 'ivf']
+
+
+def normalize_rows(vectors):
+    """Return the float32 copy of the vectors scaled to unit norm, so that the dot products are cosine similarities."""
+
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    vectors /= norms[:, None]
+
+    return vectors
+
+
+def _merge_top_k(best_ids, best_scores, ids, scores, k):
+    # Keep the k highest scores among the current best ones and the scores of the candidates ids
+    all_scores = np.concatenate((best_scores, scores), axis=1)
+    all_ids = np.concatenate((best_ids, np.broadcast_to(ids, scores.shape)), axis=1)
+    if all_scores.shape[1] > k:
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_scores = np.take_along_axis(all_scores, top, axis=1)
+        all_ids = np.take_along_axis(all_ids, top, axis=1)
+
+    return all_ids, all_scores
+
+
+def _sort_top_k(best_ids, best_scores):
+
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best_ids, best_scores = np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+    best_ids[np.isneginf(best_scores)] = -1
+
+    return best_ids, best_scores
+
+
+class _SearchIndex(object):
+    """
+    Base class of the indexes over the rows of an embedding matrix. The rows are normalized, so the scores are the
+    cosine similarities. If the communities of the rows are given, the dominant ones by phi_argmax, the search can be
+    restricted to the rows in the same community as the query.
+    """
+
+    def __init__(self, labels, vectors, communities=None):
+
+        self.labels = np.asarray(labels).astype(str)
+        self.vectors = normalize_rows(vectors)
+        self.communities = None if communities is None else np.asarray(communities, dtype=np.int64)
+        self._label2row = None
+
+        if len(self.labels) != self.vectors.shape[0]:
+            raise ValueError("The numbers of labels and vectors must be equal!")
+        if self.communities is not None and len(self.communities) != self.vectors.shape[0]:
+            raise ValueError("The numbers of communities and vectors must be equal!")
+
+    def search(self, queries, k=10, communities=None):
+        """
+        Return the row indices and the scores of the k nearest rows of each query vector, as two Q x k arrays sorted
+        by decreasing scores. If the communities of the queries are given, only the rows of the same community are
+        candidates. Missing neighbours are marked by -1.
+        """
+        raise NotImplementedError
+
+    def most_similar(self, labels, k=10, same_community=False):
+        """
+        Return the list of the k most similar (label, score) pairs of each given label, excluding the label itself.
+        If same_community is True, the neighbours are searched among the nodes of the same dominant community.
+        """
+
+        if self._label2row is None:
+            self._label2row = {label: row for row, label in enumerate(self.labels)}
+        unknown = [label for label in labels if str(label) not in self._label2row]
+        if unknown:
+            raise ValueError("The labels {} are not in the index!".format(unknown[:10]))
+        rows = np.asarray([self._label2row[str(label)] for label in labels], dtype=np.int64)
+
+        communities = None
+        if same_community:
+            if self.communities is None:
+                raise ValueError("The index has been built without the communities of the nodes!")
+            communities = self.communities[rows]
+        ids, scores = self.search(self.vectors[rows], k + 1, communities=communities)
+
+        neighbours = []
+        for row, row_ids, row_scores in zip(rows, ids, scores):
+            pairs = [(str(self.labels[i]), float(s)) for i, s in zip(row_ids, row_scores) if i >= 0 and i != row]
+            neighbours.append(pairs[:k])
+
+        return neighbours
+
+    def _check_queries(self, queries, communities):
+
+        queries = normalize_rows(np.atleast_2d(queries))
+        if queries.shape[1] != self.vectors.shape[1]:
+            raise ValueError("The queries must have the same size as the indexed vectors!")
+        if communities is not None:
+            if self.communities is None:
+                raise ValueError("The index has been built without the communities of the nodes!")
+            communities = np.asarray(communities, dtype=np.int64)
+            if len(communities) != len(queries):
+                raise ValueError("The numbers of queries and communities must be equal!")
+
+        return queries, communities
+
+
+class ExactIndex(_SearchIndex):
+    """
+    Exact top-k search. The scores of a block of queries are computed against blocks of rows by float32 matrix
+    products, and the k best ones are merged block by block, so the memory is bounded by query_block_size x
+    block_size scores. The rows are also grouped by community, so a restricted search only scans the rows of the
+    query's community.
+    """
+
+    def __init__(self, labels, vectors, communities=None, block_size=65536, query_block_size=1024):
+
+        super(ExactIndex, self).__init__(labels, vectors, communities)
+        self.block_size = block_size
+        self.query_block_size = query_block_size
+
+        if self.communities is not None:
+            self._community_rows = np.argsort(self.communities, kind='stable')
+            self._community_ids, starts = np.unique(self.communities[self._community_rows], return_index=True)
+            self._community_bounds = np.append(starts, len(self.communities))
+
+    def _search_rows(self, queries, rows, k):
+        # The top k among the given rows, rows being None for all rows
+        number_of_rows = self.vectors.shape[0] if rows is None else len(rows)
+        best_ids = np.full(shape=(len(queries), 0), fill_value=-1, dtype=np.int64)
+        best_scores = np.full(shape=(len(queries), 0), fill_value=-np.inf, dtype=np.float32)
+        for start in range(0, number_of_rows, self.block_size):
+            if rows is None:
+                ids = np.arange(start, min(start + self.block_size, number_of_rows), dtype=np.int64)
+                block = self.vectors[start:start + self.block_size]
+            else:
+                ids = rows[start:start + self.block_size]
+                block = self.vectors[ids]
+            best_ids, best_scores = _merge_top_k(best_ids, best_scores, ids, queries.dot(block.T), k)
+
+        # Pad the queries having less than k candidates
+        if best_ids.shape[1] < k:
+            padding = k - best_ids.shape[1]
+            best_ids = np.hstack((best_ids, np.full(shape=(len(queries), padding), fill_value=-1, dtype=np.int64)))
+            best_scores = np.hstack((best_scores, np.full(shape=(len(queries), padding), fill_value=-np.inf,
+                                                          dtype=np.float32)))
+
+        return _sort_top_k(best_ids, best_scores)
+
+    def search(self, queries, k=10, communities=None):
+
+        queries, communities = self._check_queries(queries, communities)
+        ids = np.empty(shape=(len(queries), k), dtype=np.int64)
+        scores = np.empty(shape=(len(queries), k), dtype=np.float32)
+
+        if communities is None:
+            for start in range(0, len(queries), self.query_block_size):
+                end = start + self.query_block_size
+                ids[start:end], scores[start:end] = self._search_rows(queries[start:end], None, k)
+            return ids, scores
+
+        # Group the queries by their communities, each group is searched among the rows of its community
+        positions = np.searchsorted(self._community_ids, communities)
+        positions[positions == len(self._community_ids)] = 0
+        found = self._community_ids[positions] == communities
+        ids[~found], scores[~found] = -1, -np.inf
+        order = np.argsort(positions, kind='stable')
+        order = order[found[order]]
+        group_bounds = np.flatnonzero(np.diff(positions[order])) + 1
+        for group in np.split(order, group_bounds):
+            if len(group) == 0:
+                continue
+            position = positions[group[0]]
+            rows = self._community_rows[self._community_bounds[position]:self._community_bounds[position + 1]]
+            for start in range(0, len(group), self.query_block_size):
+                block = group[start:start + self.query_block_size]
+                ids[block], scores[block] = self._search_rows(queries[block], rows, k)
+
+        return ids, scores
+
+
+class IVFIndex(_SearchIndex):
+    """
+    Approximate top-k search over an inverted file: the rows are clustered by spherical k-means into
+    number_of_lists lists, and a query only scans the rows of the number_of_probes lists whose centroids are the
+    closest to it. The queries probing the same list are scored together by a single matrix product.
+    """
+
+    def __init__(self, labels, vectors, communities=None, number_of_lists=None, number_of_probes=8,
+                 number_of_iters=10, training_size=None, seed=1):
+
+        super(IVFIndex, self).__init__(labels, vectors, communities)
+        number_of_rows = self.vectors.shape[0]
+        self.number_of_lists = number_of_lists if number_of_lists else max(int(4 * np.sqrt(number_of_rows)), 1)
+        self.number_of_lists = min(self.number_of_lists, number_of_rows)
+        self.number_of_probes = number_of_probes
+        self.number_of_iters = number_of_iters
+        # The centroids are trained on a sample of the rows
+        self.training_size = training_size if training_size else 256 * self.number_of_lists
+        self.seed = seed
+
+        self.centroids = self._train_centroids()
+        assignments = self._assign(self.vectors)
+        self._list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        self._list_bounds = np.zeros(shape=(self.number_of_lists + 1, ), dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=self.number_of_lists), out=self._list_bounds[1:])
+
+    def _assign(self, vectors, block_size=65536):
+
+        assignments = np.empty(shape=(len(vectors), ), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            assignments[start:start + block_size] = np.argmax(vectors[start:start + block_size].dot(self.centroids.T),
+                                                              axis=1)
+
+        return assignments
+
+    def _train_centroids(self):
+
+        rng = np.random.RandomState(self.seed)
+        number_of_rows = self.vectors.shape[0]
+        sample = self.vectors
+        if number_of_rows > self.training_size:
+            sample = self.vectors[np.sort(rng.choice(number_of_rows, self.training_size, replace=False))]
+
+        self.centroids = sample[rng.choice(len(sample), self.number_of_lists, replace=False)].copy()
+        for _ in range(self.number_of_iters):
+            assignments = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, sample)
+            # The empty lists are restarted from random rows
+            empty = np.flatnonzero(np.bincount(assignments, minlength=self.number_of_lists) == 0)
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            self.centroids = normalize_rows(sums)
+
+        return self.centroids
+
+    def search(self, queries, k=10, communities=None):
+
+        queries, communities = self._check_queries(queries, communities)
+        number_of_probes = min(self.number_of_probes, self.number_of_lists)
+
+        coarse_scores = queries.dot(self.centroids.T)
+        if number_of_probes < self.number_of_lists:
+            probes = np.argpartition(-coarse_scores, number_of_probes - 1, axis=1)[:, :number_of_probes]
+        else:
+            probes = np.tile(np.arange(self.number_of_lists), (len(queries), 1))
+
+        best_ids = np.full(shape=(len(queries), k), fill_value=-1, dtype=np.int64)
+        best_scores = np.full(shape=(len(queries), k), fill_value=-np.inf, dtype=np.float32)
+
+        # The (query, list) pairs grouped by list
+        pair_queries = np.repeat(np.arange(len(queries), dtype=np.int64), number_of_probes)
+        pair_lists = probes.ravel()
+        order = np.argsort(pair_lists, kind='stable')
+        pair_queries, pair_lists = pair_queries[order], pair_lists[order]
+        group_bounds = np.flatnonzero(np.diff(pair_lists)) + 1
+        for group in np.split(np.arange(len(pair_lists)), group_bounds):
+            if len(group) == 0:
+                continue
+            list_no = pair_lists[group[0]]
+            rows = self._list_rows[self._list_bounds[list_no]:self._list_bounds[list_no + 1]]
+            if len(rows) == 0:
+                continue
+            query_ids = pair_queries[group]
+            scores = queries[query_ids].dot(self.vectors[rows].T)
+            if communities is not None:
+                scores[communities[query_ids][:, None] != self.communities[rows][None, :]] = -np.inf
+            best_ids[query_ids], best_scores[query_ids] = _merge_top_k(best_ids[query_ids], best_scores[query_ids],
+                                                                       rows, scores, k)
+
+        return _sort_top_k(best_ids, best_scores)
+
+
+def recall_at_k(exact_ids, approximate_ids):
+    """Return the average fraction of the exact neighbours of the queries returned by the approximate search."""
+
+    hits = 0
+    total = 0
+    for exact, approximate in zip(exact_ids, approximate_ids):
+        exact = exact[exact >= 0]
+        hits += len(np.intersect1d(exact, approximate))
+        total += len(exact)
+
+    return hits / float(max(total, 1))
@@ -1,38 +1,63 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
 from ext.gensim_wrapper.models.word2vec import Word2VecWrapper
 from six import iteritems
 from gensim.corpora.dictionary import Dictionary
 #from gensim.models.ldamodel import LdaModel
 #from gensim.models import HdpModel
 import community as louvain
-import bayesian_hmm
 from consts import *
+from utils.corpus import load_corpus, index_walks, IndexedWalks
+from tne.communities import *
+from tne.lda import GibbsLDA
+from tne.bigclam import bigclam_communities
+from tne.louvain import louvain_communities
+from tne.hmm import hdphmm_chains, emission_matrix, state_probabilities, decode_walks
+from tne.cache import CommunityCache, community_cache_key
+from tne.checkpoint import Checkpoint
+from tne.search import SEARCH_INDEXES, ExactIndex, IVFIndex
+from utils.graph import load_csr_graph, csr_to_networkx
+from utils.export import save_embeddings
+from utils.metrics import Metrics
 #from hmmlearn import hmm
 
 
 #_lda_path = os.path.join(os.path.dirname(__file__), "../ext/gibbslda/lda")
 _temp_folder_path = os.path.join(BASE_FOLDER, "temp")
+# The detection methods forking processes, which is not safe while the training threads of the node embeddings run
+_FORKING_METHODS = ['bayesianhmm', 'bayesianhdphmm']
 
 class TNE:
 
     K = None  # The number of latent communities
-    walks = None  # The list of walk lists
+    walks = None  # The list of walk lists or a restartable corpus iterable
     community_walks = None
+    indexed_walks = None  # The walks mapped to the vocabulary indexes of the model
     suffix_for_files = ""
-    model = None
-    phi = None
+    _model = None  # The Word2VecWrapper model of the node embeddings, and of the community embeddings after stage 3
+    _phi = None
     theta = None
-    id2node = None
+    _id2node = None
+    _nodes_fitted = False
+    _communities_fitted = False
     params = None
+    _graph = None  # The CSRGraph of params['graph_path'], loaded once and shared by the detection methods
+    _hmm_probabilities = None  # The initial and the transition probabilities of the states of the HMM methods
+    _hard_phi = None  # Whether phi is a hard partition, computed once for the updates
 
-    def __init__(self, walks=None, params=None, suffix=""):
+    def __init__(self, walks=None, params=None, suffix="", graph=None):
 
-        if isinstance(walks, list):
+        if walks is not None:
             self.walks = walks
 
+        # The graph already loaded by the caller, e.g. to generate the walks
+        if graph is not None:
+            self._graph = graph
+
         if isinstance(params, dict):
             self.params = params
 
@@ -67,21 +92,46 @@ class TNE:
         self.alpha = params['alpha']
         self.min_alpha=params['min_alpha']
         self.iter=params['iter']
+        # Use the integer arrays of vocabulary indexes instead of string tokens in the community training
+        self.integer_tokens = params.get('integer_tokens', True)
+        # Keep phi as a sparse float32 matrix, whose memory scales with the number of nonzero memberships
+        self.sparse_phi = params.get('sparse_phi', False)
 
         # Create a folder for temporary files
         self.temp_folder_path = os.path.join(_temp_folder_path, suffix)
         self._create_temp_folder(self.temp_folder_path)
 
-        # Learn Embeddings
-        self.learn_embeddings()
+        # Reuse the community detection results of the previous runs with the same walks, graph and parameters
+        self.community_cache = None
+        if params.get('community_cache', False):
+            self.community_cache = CommunityCache(os.path.join(_temp_folder_path, "community_cache"),
+                                                  max_size=params.get('community_cache_size', 10 * (1 << 30)))
+
+        # Store the artifacts of each stage, so that the training can be resumed from the last completed stage
+        self.checkpoint = None
+        if params.get('checkpoint_path', None) is not None:
+            self.checkpoint = Checkpoint(params['checkpoint_path'], params)
+
+        # Overlap the node embedding training and the community detection, with separate budgets of workers
+        self.concurrent_stages = params.get('concurrent_stages', False)
+        self.community_workers = params.get('community_workers', max(self.workers // 2, 1))
+        self.node_workers = params.get('node_workers', max(self.workers - self.community_workers, 1))
+        # Train the community embeddings by worker processes sharing the weights instead of threads, if more than one
+        self.community_processes = params.get('community_processes', None)
+        # The number of workers of the detection methods, None for their own defaults
+        self._detection_workers = None
+        # The running time of each stage in seconds
+        self.stage_times = {}
+        # The counters, the histograms and the events of the run, written as JSON lines into metrics_path, and the
+        # cProfile statistics of each stage written into profile_path if it is given
+        self.metrics = Metrics(file_path=params.get('metrics_path', None),
+                               profile_folder=params.get('profile_path', None))
+
+        # The stages are run by learn_embeddings, or lazily once their outputs are requested
 
     def read_corpus_file(self, corpus_path):
 
-        self.walks = []
-        with open(corpus_path, 'r') as f:
-            for line in f.readlines():
-                walk = [str(w) for w in line.strip().split()]
-                self.walks.append(walk)
+        self.walks = load_corpus(corpus_path)
 
         print("--> 0. The corpus file has been read, which contains {} walks".format(len(self.walks)))
 
@@ -90,71 +140,429 @@ class TNE:
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
 
-    def learn_embeddings(self):
+    @property
+    def model(self):
+        """The Word2VecWrapper model, the node embeddings are learned on first access."""
+        if not self._nodes_fitted:
+            self.fit_nodes()
+        return self._model
+
+    @property
+    def phi(self):
+        """The K x N community assignments of the nodes, the communities are detected on first access."""
+        if self._phi is None:
+            self.detect_communities()
+        return self._phi
+
+    @property
+    def id2node(self):
+        if self._id2node is None:
+            self.detect_communities()
+        return self._id2node
+
+    def learn_embeddings(self, last_stage=3):
+        """
+        Run the stages up to last_stage: 1. node embeddings, 2. community detection and 3. community embeddings. If a
+        checkpoint is given, the completed stages are loaded from it, the community training continues from its last
+        checkpointed job and the artifacts of each stage are stored in it. If concurrent_stages is set, the first two
+        stages run at the same time with node_workers and community_workers workers, except for the HMM methods.
+        """
+
+        concurrent = self.concurrent_stages and last_stage >= 2
+        if concurrent and self.comm_detection_method in _FORKING_METHODS:
+            print("--> The stages are run one after the other, since the {} method forks processes.".format(
+                self.comm_detection_method))
+            concurrent = False
+        if concurrent:
+            self._fit_nodes_and_detect_communities()
+        else:
+            self.fit_nodes()
+            if last_stage >= 2:
+                self.detect_communities()
+        if last_stage >= 3:
+            self.fit_communities()
+
+        return self
+
+    def _build_vocabulary(self):
+        """
+        Create the model and build its vocabulary, which is all the community detection needs, without training the
+        node embeddings. The model is loaded instead if the checkpoint contains it.
+        """
+
+        if self._model is not None:
+            return
+
+        if self.checkpoint is not None and self.checkpoint.has(Checkpoint.NODE_MODEL):
+            self._model = self.checkpoint.load_node_model()
+            self._nodes_fitted = True
+        else:
+            self._model = Word2VecWrapper(size=self.node_embedding_size,
+                                          window=self.window_size,
+                                          sg=self.sg, hs=self.hs,
+                                          workers=self.workers,
+                                          min_count=0,
+                                          alpha=self.alpha,
+                                          min_alpha=self.min_alpha,
+                                          iter=self.iter,
+                                          )
+            self._model.build_vocab(self.walks)
+        self._model.workers = self.workers
+        if self.integer_tokens:
+            # Map the walks once to the vocabulary indexes, so the later stages work on integer arrays
+            self.indexed_walks = index_walks(self.walks, self._model.get_token2index())
+
+    def _train_nodes(self, workers):
+
+        self._model.workers = workers
+        self._model.train(self.walks, total_examples=self._model.corpus_count, epochs=self._model.iter,
+                          start_alpha=self._model.alpha, end_alpha=self._model.min_alpha)
+        self._model.workers = self.workers
+        self._nodes_fitted = True
+
+    def fit_nodes(self, model=None):
+        """
+        Stage 1: learn the node embeddings. A model of a previous run, a Word2VecWrapper or the path of a saved one,
+        can be given instead, in which case the node embedding pass is skipped.
+        """
+
+        if model is None and self._nodes_fitted:
+            return self
+
+        with self.metrics.stage('nodes') as stage:
+            if model is not None:
+                self._model = Word2VecWrapper.load(model) if isinstance(model, str) else model
+                self._model.workers = self.workers
+                if self.integer_tokens:
+                    self.indexed_walks = index_walks(self.walks, self._model.get_token2index())
+                self._nodes_fitted = True
+                # The later stages depend on the vocabulary of the node model
+                self._phi, self._id2node, self._communities_fitted = None, None, False
+                if self.checkpoint is not None:
+                    self.checkpoint.reset()
+                    self.checkpoint.save_node_model(self._model)
+            else:
+                self._build_vocabulary()
+                if not self._nodes_fitted:
+                    self._train_nodes(self.workers)
+                    if self.checkpoint is not None:
+                        self.checkpoint.save_node_model(self._model)
+        self.stage_times['nodes'] = stage.seconds
+        print("--> 1. Node embeddings have been learned in {} secs.".format(self.stage_times['nodes']))
+
+        return self
+
+    def detect_communities(self, partition=None):
+        """
+        Stage 2: detect the communities with the method given by the parameters. A precomputed hard partition, a
+        dictionary mapping the node labels to their communities, can be given instead of running the method. Only
+        the vocabulary of the node model is needed, the node embeddings are not trained by this stage.
+        """
+
+        if partition is None and self._phi is not None:
+            return self
+
+        with self.metrics.stage('communities') as stage:
+            self._build_vocabulary()
+            # The properties of the previous phi
+            self._hard_phi, self._hmm_probabilities = None, None
+            if partition is not None:
+                self._phi, theta, self._id2node = self._partition(partition)
+                self._communities_fitted = False
+                if self.checkpoint is not None:
+                    self.checkpoint.save_communities(self.K, self._phi, self._id2node, self.community_walks)
+            elif self.checkpoint is not None and self.checkpoint.has(Checkpoint.COMMUNITIES):
+                self.K, self._phi, self._id2node, self.community_walks = self.checkpoint.load_communities()
+            else:
+                self._phi, theta, self._id2node = self.extract_community_labels()
+                if self.checkpoint is not None:
+                    self.checkpoint.save_communities(self.K, self._phi, self._id2node, self.community_walks)
+        self.stage_times['communities'] = stage.seconds
+        print("--> 2. The community labels have been learned in {} secs.".format(self.stage_times['communities']))
+
+        return self
+
+    def _fit_nodes_and_detect_communities(self):
+        """
+        Run the node embedding training and the community detection at the same time in two threads, with
+        node_workers and community_workers workers respectively. The training of the node embeddings releases the GIL
+        in its compiled loops, and so do lda and fastlouvain, while bigclam waits for external processes, so the
+        stages overlap for these methods. The louvain method runs in Python and holds the GIL, so it gains little.
+        """
 
-        # Learn node embeddings
         initial_time = time.time()
-        self.model = Word2VecWrapper(sentences=self.walks,
-                                     size=self.node_embedding_size,
-                                     window=self.window_size,
-                                     sg=self.sg, hs=self.hs,
-                                     workers=self.workers,
-                                     min_count=0,
-                                     alpha=self.alpha,
-                                     min_alpha=self.min_alpha,
-                                     iter=self.iter,
-                                     )
-        print("--> 1. Node embeddings have been learned in {} secs.".format(time.time() - initial_time))
-
-        # Learn community labels
+        self._build_vocabulary()
+
+        def fit_nodes():
+            with self.metrics.stage('nodes') as stage:
+                if not self._nodes_fitted:
+                    self._train_nodes(self.node_workers)
+                    if self.checkpoint is not None:
+                        self.checkpoint.save_node_model(self._model)
+            self.stage_times['nodes'] = stage.seconds
+            print("--> 1. Node embeddings have been learned in {} secs.".format(self.stage_times['nodes']))
+
+        self._detection_workers = self.community_workers
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(fit_nodes), executor.submit(self.detect_communities)]
+                for future in futures:
+                    future.result()
+        finally:
+            self._detection_workers = None
+
+        print("--> 1-2. The node embeddings and the community labels have been learned concurrently in {} secs "
+              "({} and {} workers).".format(time.time() - initial_time, self.node_workers, self.community_workers))
+
+    def fit_communities(self):
+        """Stage 3: learn the community embeddings over the walks labelled by the detected communities."""
+
+        if self._communities_fitted:
+            return self
+        self.fit_nodes()
+        self.detect_communities()
+
+        # The model loaded from a checkpoint whose last stage is completed already contains the community embeddings
+        if self.checkpoint is not None and self.checkpoint.has(Checkpoint.MODEL):
+            self._communities_fitted = True
+            return self
+
+        with self.metrics.stage('community_embeddings') as stage:
+            # Construct the tuples (word, community) with each node in the corpus and its corresponding community
+            # assignment
+            if self.integer_tokens:
+                combined_walks = CombineIndexedSentences(indexed_walks=self.indexed_walks,
+                                                         community_walks=self._community_walks_to_array())
+                community_weights, start_job, checkpoint_callback = None, 0, None
+                if self.checkpoint is not None:
+                    community_weights, start_job, random_state = self.checkpoint.load_community_weights()
+                    if random_state is not None:
+                        self.model.random.set_state(random_state)
+                    checkpoint_callback = lambda job_no: self.checkpoint.save_community_weights(
+                        job_no, self.model.wv.syn0_community, self.model.syn1neg, self.model.random.get_state())
+                self.model.train_community(self.K, combined_walks, self.comm_embedding_size, indexed=True,
+                                           community_weights=community_weights, start_job=start_job,
+                                           checkpoint_jobs=self.params.get('checkpoint_jobs', None),
+                                           checkpoint_callback=checkpoint_callback, processes=self.community_processes,
+                                           metrics=self.metrics)
+            else:
+                combined_walks = CombineSentences(node_walks=self.walks, community_walks=self.community_walks)
+                self.model.train_community(self.K, combined_walks, self.comm_embedding_size)
+            if self.checkpoint is not None:
+                self.checkpoint.save_model(self.model)
+            self._communities_fitted = True
+        self.stage_times['community_embeddings'] = stage.seconds
+        print("--> 3. Community embeddings have been learned in {} secs.".format(
+            self.stage_times['community_embeddings']))
+
+        return self
+
+    def update(self, walks, graph_path=None):
+        """
+        Update the embeddings with the walks over the new and the changed parts of the graph, instead of training
+        from scratch. The vocabulary is extended with the new nodes, and the node and the community embeddings
+        continue from their current weights over the new walks only. The new nodes are assigned to the communities
+        of their neighbours in the graph given by graph_path, or in the new walks if it is not given, as in the local
+        moves of Louvain for hard partitions and by folding in their neighbours' columns of phi otherwise. The
+        community walks are sampled from phi, or decoded over the states of the HMM methods (see tne.hmm.decode_walks
+        and the parameter 'hmm_decoding'). The detection method is not run again. The Python work and the changes of
+        phi depend on the new walks and the edges of the new nodes, while the graph and the existing columns of phi
+        are only read by vectorized passes, and a dense phi grows in place into spare capacity.
+        """
+
+        self.fit_communities()
         initial_time = time.time()
-        self.phi, theta, self.id2node = self.extract_community_labels()
-        print("--> 2. The community labels have been learned in {} secs.".format(time.time() - initial_time))
 
-        # Learn community embeddings
-        initial_time = time.time()
-        # Construct the tuples (word, community) with each node in the corpus and its corresponding community assignment
-        combined_walks = CombineSentences(node_walks=self.walks, community_walks=self.community_walks)
-        self.model.train_community(self.K, combined_walks, self.comm_embedding_size)
-        print("--> 3. Community embeddings have been learned in {} secs.".format(time.time() - initial_time))
+        # Continue the node embeddings with the output weights of the node embedding stage
+        self._model.use_node_weights()
+        number_of_old_words = len(self._model.wv.index2word)
+        self._model.build_vocab(walks, update=True)
+        self.walks = walks
+        self.indexed_walks = index_walks(walks, self._model.get_token2index()) if self.integer_tokens else None
+        self._model.train(walks, total_examples=self._model.corpus_count, epochs=self._model.iter,
+                          start_alpha=self._model.alpha, end_alpha=self._model.min_alpha)
+        print("--> 1. Node embeddings have been updated in {} secs.".format(time.time() - initial_time))
+
+        # The new nodes get the next ids, in the order of the vocabulary, which appends the new words
+        stage_time = time.time()
+        node2id = {node: nodeId for nodeId, node in self._id2node.items()}
+        number_of_old_nodes = len(node2id)
+        for word in self._model.wv.index2word[number_of_old_words:]:
+            if word not in node2id:
+                node2id[word] = len(node2id)
+                self._id2node[node2id[word]] = word
+        number_of_nodes = len(node2id)
+
+        node_walks = self._node_walks(node2id)
+        if graph_path is not None:
+            graph = load_csr_graph(graph_path, snapshot=self.params.get('graph_snapshot', True))
+            # The node labels of the graph are looked up in the sorted labels of the node ids
+            ids = np.fromiter(self._id2node.keys(), dtype=np.int64, count=number_of_nodes)
+            labels = np.asarray(list(self._id2node.values())).astype(str)
+            order = np.argsort(labels, kind='stable')
+            graph_labels = np.asarray(graph.id2node).astype(str)
+            positions = np.minimum(np.searchsorted(labels[order], graph_labels), number_of_nodes - 1)
+            graph_ids = np.where(labels[order][positions] == graph_labels, ids[order][positions], -1)
+            source = np.repeat(graph_ids, graph.degrees())
+            target = graph_ids[graph.indices]
+            mask = (source >= 0) & (target >= 0)
+            adjacency = sp.csr_matrix((graph.weights[mask], (source[mask], target[mask])),
+                                      shape=(number_of_nodes, number_of_nodes))
+        else:
+            adjacency = walk_adjacency(node_walks.indexes, node_walks.offsets, number_of_nodes)
+
+        if self._hard_phi is None:
+            self._hard_phi = is_hard_phi(self._phi)
+        self._phi, self.K = assign_new_nodes(self._phi, adjacency, number_of_nodes - number_of_old_nodes,
+                                             hard=self._hard_phi)
+        if self._hmm_probabilities is not None and len(self._hmm_probabilities[0]) == self.K:
+            # The states of the new walks are decoded with the extended phi as the emission matrix
+            community_walks = decode_walks(node_walks.indexes, node_walks.offsets, *self._hmm_probabilities,
+                                           emission=self._phi, method=self.params.get('hmm_decoding', 'viterbi'))
+        else:
+            community_walks = sample_community_walks(node_walks.indexes, self._phi)
+        print("--> 2. {} new nodes have been assigned to {} communities in {} secs.".format(
+            number_of_nodes - number_of_old_nodes, self.K, time.time() - stage_time))
+
+        # Continue the community embeddings, the new communities and the new words start from random weights
+        stage_time = time.time()
+        community_weights = (self._model.wv.syn0_community.copy(), self._model.syn1neg_community.copy())
+        if self.integer_tokens:
+            self.community_walks = IndexedWalks(indexes=community_walks, offsets=node_walks.offsets)
+            combined_walks = CombineIndexedSentences(indexed_walks=self.indexed_walks,
+                                                     community_walks=community_walks)
+            self._model.train_community(self.K, combined_walks, self.comm_embedding_size, indexed=True,
+                                        community_weights=community_weights, processes=self.community_processes,
+                                        metrics=self.metrics)
+        else:
+            offsets = node_walks.offsets
+            self.community_walks = [[str(label) for label in community_walks[offsets[i]:offsets[i + 1]]]
+                                    for i in range(len(offsets) - 1)]
+            combined_walks = CombineSentences(node_walks=self.walks, community_walks=self.community_walks)
+            self._model.train_community(self.K, combined_walks, self.comm_embedding_size,
+                                        community_weights=community_weights)
+        print("--> 3. Community embeddings have been updated in {} secs.".format(time.time() - stage_time))
+
+        self.stage_times['update'] = time.time() - initial_time
+        self.metrics.increment('update.seconds', self.stage_times['update'])
+        self.metrics.emit('update', new_nodes=number_of_nodes - number_of_old_nodes, communities=self.K,
+                          seconds=self.stage_times['update'])
+
+        return self
 
     def extract_community_labels(self):
 
+        if self.community_cache is not None:
+            walks = self.indexed_walks if self.indexed_walks is not None else self.walks
+            key = community_cache_key(walks, self.params, vocabulary=self._model.wv.index2word)
+            entry = self.community_cache.load(key)
+            if entry is not None:
+                print("--> The community labels have been loaded from the cache entry {}".format(key))
+                self.K, phi, id2node, self.community_walks = entry
+                return phi, None, id2node
+
         detect_communities_func = getattr(self, "_" + self.comm_detection_method)
         phi, theta, id2node = detect_communities_func(self.params)
+
+        if self.community_cache is not None:
+            self.community_cache.store(key, self.K, phi, id2node, self.community_walks)
+
         return phi, theta, id2node
 
-    def write_node_embeddings(self, file_path):
+    def _node_walks(self, node2id):
+        """
+        Return the walks as IndexedWalks over the node ids given by node2id, tokens not in node2id are marked by -1.
+        If the walks have already been mapped to the vocabulary indexes, only the vocabulary is looked up.
+        """
+
+        if self.indexed_walks is None:
+            return index_walks(self.walks, node2id)
+
+        index2id = np.asarray([node2id.get(word, -1) for word in self._model.wv.index2word], dtype=np.int32)
+        indexes = self.indexed_walks.indexes
+        return IndexedWalks(indexes=np.where(indexes >= 0, index2id[indexes], -1), offsets=self.indexed_walks.offsets)
+
+    def _community_walks_to_array(self):
+
+        if isinstance(self.community_walks, IndexedWalks):
+            return self.community_walks.indexes
+
+        # Flatten the community walks into an array aligned with the indexed walks
+        return np.fromiter((int(label) for community_walk in self.community_walks for label in community_walk),
+                           dtype=np.int32, count=self.indexed_walks.number_of_tokens())
+
+    def _sorted_vocabulary(self):
+
+        # store in sorted order: most frequent words at the top
+        words, indexes = [], []
+        for word, vocab in sorted(iteritems(self.model.wv.vocab), key=lambda item: -item[1].count):
+            words.append(word)
+            indexes.append(vocab.index)
+
+        return words, np.asarray(indexes, dtype=np.int64)
+
+    def write_node_embeddings(self, file_path, file_format="text", float16=False):
 
         # Write node embeddings
         print("--> Embeddings are being written to the file: {}".format(file_path))
-        self.model.wv.save_word2vec_format(fname=file_path)
+        if file_format == "text":
+            self.model.wv.save_word2vec_format(fname=file_path)
+        else:
+            words, indexes = self._sorted_vocabulary()
+            save_embeddings(file_path, words, self.model.wv.syn0[indexes], file_format=file_format, float16=float16)
 
     def get_node_embeddings(self):
+        """Return the node labels sorted by their frequencies and the matrix of their node embeddings."""
 
-        node_embeddings = {}
-        for word, vocab in sorted(iteritems(self.model.wv.vocab), key=lambda item: -item[1].count):
-            node_embeddings[word] = [value for value in self.model.wv.syn0[vocab.index]]
+        words, indexes = self._sorted_vocabulary()
+
+        return words, self.model.wv.syn0[indexes]
 
-        return node_embeddings
+    def write_community_embeddings(self, file_path, file_format="text", float16=False):
 
-    def write_community_embeddings(self, file_path):
+        self.fit_communities()
 
         # Write community embeddings
         print("--> Embeddings are being written to the file: {}".format(file_path))
-        self.model.wv.save_word2vec_community_format(file_path)
+        if file_format == "text":
+            self.model.wv.save_word2vec_community_format(file_path)
+        else:
+            save_embeddings(file_path, range(self.model.wv.syn0_community.shape[0]), self.model.wv.syn0_community,
+                            file_format=file_format, float16=float16)
 
     def get_community_embeddings(self):
+        """Return the K x comm_embedding_size matrix of community embeddings."""
 
-        community_embeddings = {}
-        for i in range(self.K):
-            row = self.model.wv.syn0_community[i]
-            community_embeddings[i] = [value for value in row]
+        self.fit_communities()
 
-        return community_embeddings
+        return np.array(self.model.wv.syn0_community)
 
     def _lda(self, params):
 
+        if params.get('lda_engine', 'native') == 'gibbslda':
+            return self._gibbslda(params)
+
+        # Sample directly on the walks mapped to the vocabulary indexes, so the word ids of LDA are the indexes
+        indexed_walks = self.indexed_walks
+        if indexed_walks is None:
+            indexed_walks = index_walks(self.walks, self._model.get_token2index())
+
+        initial_time = time.time()
+        lda = GibbsLDA(K=self.K, alpha=params['lda_alpha'], beta=params['lda_beta'],
+                       number_of_iters=params['lda_number_of_iters'], workers=self._detection_workers or self.workers,
+                       mh_steps=params.get('lda_mh_steps', 2), metrics=self.metrics)
+        lda.fit(tokens=indexed_walks.indexes, offsets=indexed_walks.offsets, V=len(self._model.wv.index2word))
+        print("-> The LDA algorithm run in {:.2f} secs".format(time.time() - initial_time))
+
+        id2node = {index: word for index, word in enumerate(self._model.wv.index2word)}
+        phi = format_phi(lda.get_phi(), sparse=self.sparse_phi)
+        theta = lda.get_theta()
+        self.community_walks = IndexedWalks(indexes=lda.z, offsets=indexed_walks.offsets)
+
+        return phi, theta, id2node
+
+    def _gibbslda(self, params):
+
         def __run_lda(lda_node_corpus_file, params):
 
             # Firstly write the walks into a file with a suitable format for the lda program
@@ -228,210 +636,162 @@ class TNE:
         # Set the tassign file path
         tassign_file_path = os.path.join(self.temp_folder_path, self.suffix_for_files, "model-final.tassign")
 
-        __run_lda(lda_node_corpus_file=lda_node_corpus_file, params=params)
+        with self.metrics.stage('gibbslda_subprocess'):
+            __run_lda(lda_node_corpus_file=lda_node_corpus_file, params=params)
         num_of_nodes, id2node = __read_wordmap_file(file_path=wordmap_file_path)
-        phi = __read_phi_file(file_path=phi_file_path, K=self.K, num_of_nodes=num_of_nodes)
+        phi = format_phi(__read_phi_file(file_path=phi_file_path, K=self.K, num_of_nodes=num_of_nodes),
+                         sparse=self.sparse_phi)
         self.community_walks = __read_tassing_file(file_path=tassign_file_path)
         theta = __read_theta_file(theta_file_path, K=self.K, num_of_walks=len(self.walks))
 
         return phi, theta, id2node
 
-    def _louvain(self, params):
+    def _load_graph(self, params):
+        """
+        Return the CSRGraph of the graph file given by params['graph_path']. It is loaded once, from its CSR snapshot
+        if there is one (see utils.graph.load_csr_graph), and shared by all methods.
+        """
 
         if 'graph_path' not in params:
             raise ValueError("For {} algorithm, the graph path is needed!".format(self.comm_detection_method))
+        if self._graph is None:
+            self._graph = load_csr_graph(params['graph_path'], snapshot=params.get('graph_snapshot', True))
 
-        graph = nx.read_gml(params['graph_path'])
+        return self._graph
+
+    def _louvain(self, params):
+
+        graph = self._load_graph(params)
 
-        partition = louvain.best_partition(graph)
+        # The networkx graph is built over the node indices from the CSR arrays, without parsing the file again
+        partition = louvain.best_partition(csr_to_networkx(graph))
         self.K = len(set(partition.values()))
 
         print("--> The {} algorithm was selected for detectin communities.".format(self.comm_detection_method))
         print("--> The number of communities detected is {}.".format(self.K))
 
-        phi = np.zeros(shape=(self.K, graph.number_of_nodes()), dtype=np.float)
-        for node in range(graph.number_of_nodes()):
-            phi[int(partition[str(node)]), node] = 1.0
-        phi = (phi.T / np.sum(phi, 1)).T
+        id2node = {nodeId: str(node) for nodeId, node in enumerate(graph.id2node)}
 
-        theta = None
-
-        id2node = {int(node): node for node in graph.nodes()}
+        labels = np.asarray([partition[nodeId] for nodeId in range(graph.number_of_nodes())], dtype=np.int32)
 
-        # Generate community walks
-        self.community_walks = []
-        for walk in self.walks:
-            community_walk = [str(partition[node]) for node in walk]
-            self.community_walks.append(community_walk)
+        return self._hard_partition(labels, id2node)
 
-        return phi, theta, id2node
+    def _fastlouvain(self, params):
+        """
+        The Louvain method over the CSR adjacency of the graph, whose local-move phases are run by parallel threads
+        (see tne.louvain). The resolution and the seed are given by the parameters 'louvain_resolution' and
+        'louvain_seed'.
+        """
 
-    def _bigclam(self, params):
+        graph = self._load_graph(params)
 
-        def __read_bigclam_output(file_path, k=0):
-            node2comm = {}
-            with open(file_path, 'r') as fin:
-                for line in fin.readlines():
-                    tokens = line.strip().split()
-                    for token in tokens:
-                        if token in node2comm:
-                            node2comm[token].append(k)
-                        else:
-                            node2comm[token] = [k]
-                    k += 1
+        labels = louvain_communities(graph, resolution=params.get('louvain_resolution', 1.0),
+                                     seed=params.get('louvain_seed', 1),
+                                     workers=params.get('louvain_workers', self._detection_workers),
+                                     metrics=self.metrics)
+        self.K = int(labels.max()) + 1 if len(labels) else 0
 
-            return node2comm, k
+        print("--> The {} algorithm was selected for detectin communities.".format(self.comm_detection_method))
+        print("--> The number of communities detected is {}.".format(self.K))
 
-        if 'graph_path' not in params:
-            raise ValueError("For {} algorithm, the graph path is needed!".format(self.comm_detection_method))
-        graph = nx.read_gml(params['graph_path'])
-        #graph.remove_edges_from(nx.selfloop_edges(graph))
+        id2node = {nodeId: str(node) for nodeId, node in enumerate(graph.id2node)}
 
-        temp_folder = os.path.join(self.temp_folder_path, self.suffix_for_files)
-        if not os.path.exists(temp_folder):
-            os.makedirs(temp_folder)
-        # Run BigClam algorithm over connected components
-        self.K = 0
-        node2comm = {}
-        for gccInx, gcc_nodes in enumerate(nx.connected_components(graph)):
-            # Get a connected component
-            gcc = graph.subgraph(gcc_nodes).copy()
-            # Set the edgelist and output files
-            gcc_edgelist = os.path.join(self.temp_folder_path, self.suffix_for_files, "gcc{}.edgelist".format(gccInx))
-            output_path = os.path.join(self.temp_folder_path, self.suffix_for_files, "gcc{}.bigclam".format(gccInx))
-            # Write the edges to the file
-            nx.write_edgelist(gcc, gcc_edgelist, data=False)
-            # Run the algorithm
-            cmd = "{} -o:{} -i:{} -nt:{} -c:-1".format(BIGCLAM_PATH, output_path, gcc_edgelist, str(4))
-            os.system(cmd)
-            # Read the algorithm output
-            gcc_node2comm, self.K = __read_bigclam_output(output_path, k=self.K)
-            node2comm.update(gcc_node2comm)
+        return self._hard_partition(labels, id2node)
 
-        # If there is a node which is not assigned to a community label, assign it to a label
-        for node in graph.nodes():
-            if node not in node2comm:
-                node2comm[node] = [self.K]
-                self.K += 1
+    def _hard_partition(self, labels, id2node):
+        """Return phi, theta and id2node of the partition in which node id i belongs to the community labels[i]."""
 
-        phi = np.zeros(shape=(self.K, graph.number_of_nodes()), dtype=np.float)
-        for node in range(graph.number_of_nodes()):
-            for k in node2comm[str(node)]:
-                phi[k, node] = 1.0
-        phi = (phi.T / np.sum(phi, 1)).T
+        node2id = {node: nodeId for nodeId, node in id2node.items()}
+        phi = membership_to_phi(hard_membership(labels, self.K), sparse=self.sparse_phi)
 
         theta = None
 
-        id2node = {int(node): node for node in graph.nodes()}
-
         # Generate community walks
-        self.community_walks = []
-        for walk in self.walks:
-            community_walk = [np.random.choice(a=node2comm[walk[0]], size=1)[0]]
-            for node in walk[1:]:
-                if community_walk[-1] in node2comm[node]:
-                    chosen_label = community_walk[-1]
-                else:
-                    chosen_label = np.random.choice(a=node2comm[node], size=1)[0]
-                community_walk.append(chosen_label)
-
-            self.community_walks.append(community_walk)
+        node_walks = self._node_walks(node2id)
+        self.community_walks = IndexedWalks(indexes=hard_community_walks(node_walks.indexes, labels),
+                                            offsets=node_walks.offsets)
 
         return phi, theta, id2node
 
-    def _bayesianhmm(self, params):
+    def _partition(self, partition):
+        """Return phi, theta and id2node of a precomputed partition mapping the node labels to their communities."""
 
-        if 'graph_path' not in params:
-            raise ValueError("For {} algorithm, the graph path is needed!".format(self.comm_detection_method))
-        graph = nx.read_gml(params['graph_path'])
+        id2node = {nodeId: str(node) for nodeId, node in enumerate(partition.keys())}
+        communities, labels = np.unique(np.asarray(list(partition.values())), return_inverse=True)
+        self.K = len(communities)
 
-        # initialise object with overestimate of true number of latent states
-        hmm = bayesian_hmm.HDPHMM(self.walks, sticky=False)
-        hmm.initialise()
+        return self._hard_partition(labels.astype(np.int32), id2node)
 
-        n = params['bayesianhmm_number_of_steps']
-        results = hmm.mcmc(n=n, burn_in=n - 1, save_every=1, ncores=3, verbose=False)
+    def _bigclam(self, params):
 
-        map_index = -1
-        parameters_map = results['parameters'][map_index]
-        commlabel2comm = {}
-        comm = 0
-        for commlabel in parameters_map['p_emission'].keys():
-            if commlabel != 'None':
-                commlabel2comm[commlabel] = comm
-                comm += 1
+        graph = self._load_graph(params)
 
-        self.K = len(commlabel2comm.keys())
+        # Run BigClam algorithm over connected components
+        communities = bigclam_communities(graph, temp_folder=os.path.join(self.temp_folder_path, self.suffix_for_files),
+                                          workers=params.get('bigclam_workers', self._detection_workers),
+                                          small_component_size=params.get('bigclam_small_component_size', 5),
+                                          metrics=self.metrics)
+        lengths = np.asarray([len(community) for community in communities], dtype=np.int64)
+        nodes = np.concatenate(communities) if communities else np.zeros(shape=(0, ), dtype=np.int64)
+        comms = np.repeat(np.arange(len(communities), dtype=np.int64), lengths)
 
-        parameters_map = results['parameters'][map_index]
-        emission_prob = parameters_map['p_emission']
+        # If there is a node which is not assigned to a community label, assign it to a label
+        unassigned = np.setdiff1d(np.arange(graph.number_of_nodes()), nodes)
+        nodes = np.concatenate((nodes, unassigned))
+        comms = np.concatenate((comms, len(communities) + np.arange(len(unassigned), dtype=np.int64)))
+        self.K = len(communities) + len(unassigned)
 
-        phi = np.zeros(shape=(self.K, graph.number_of_nodes()), dtype=np.float)
-        for node in range(graph.number_of_nodes()):
-            for k in commlabel2comm.keys():
-                phi[commlabel2comm[k], node] = emission_prob[k][str(node)]
-        phi = (phi.T / np.sum(phi, 1)).T
+        id2node = {nodeId: str(node) for nodeId, node in enumerate(graph.id2node)}
+        node2id = {node: nodeId for nodeId, node in id2node.items()}
 
-        theta = None
+        membership = pairs_membership(nodes, comms, graph.number_of_nodes(), self.K)
+        phi = membership_to_phi(membership, sparse=self.sparse_phi)
 
-        id2node = {int(node): node for node in graph.nodes()}
+        theta = None
 
-        chains = hmm.chains
-        self.community_walks = []
-        for i in range(len(self.walks)):
-            community_walk = []
-            for w in chains[i].latent_sequence:
-                community_walk.append(commlabel2comm[w])
-            self.community_walks.append(community_walk)
+        # Generate community walks
+        node_walks = self._node_walks(node2id)
+        self.community_walks = IndexedWalks(
+            indexes=sticky_community_walks(node_walks.indexes, node_walks.offsets, membership),
+            offsets=node_walks.offsets
+        )
 
         return phi, theta, id2node
 
-    def _bayesianhdphmm(self, params):
+    def _hmm(self, params):
+        """
+        The communities of the states of the best of the independent HDPHMM chains over the walks (see tne.hmm). A
+        chain runs at most 'bayesianhmm_number_of_steps' steps and stops earlier once its log-likelihood changes by
+        less than 'hmm_tolerance'. The 'hmm_chains' chains share a budget of 'hmm_cores' cores. phi is the emission
+        matrix of the states and the community walks are their latent sequences. The initial and the transition
+        probabilities are kept to decode the walks of the updates.
+        """
 
-        if 'graph_path' not in params:
-            raise ValueError("For {} algorithm, the graph path is needed!".format(self.comm_detection_method))
-        graph = nx.read_gml(params['graph_path'])
+        graph = self._load_graph(params)
 
-        # initialise object with overestimate of true number of latent states
-        hmm = bayesian_hmm.HDPHMM(self.walks, sticky=False)
-        hmm.initialise()
+        sample = hdphmm_chains(self.walks, params['bayesianhmm_number_of_steps'], chains=params.get('hmm_chains', 1),
+                               cores=params.get('hmm_cores', self._detection_workers or self.workers),
+                               tolerance=params.get('hmm_tolerance', 1e-3), seed=params.get('hmm_seed', 1),
+                               metrics=self.metrics)
+        self.K = len(sample['states'])
 
-        n = params['bayesianhmm_number_of_steps']
-        results = hmm.mcmc(n=n, burn_in=n - 1, save_every=1, ncores=3, verbose=False)
+        id2node = {nodeId: str(node) for nodeId, node in enumerate(graph.id2node)}
+        phi = emission_matrix(sample['parameters']['p_emission'], sample['states'], id2node, sparse=self.sparse_phi)
+        self._hmm_probabilities = state_probabilities(sample['parameters'], sample['states'])
 
-        map_index = -1
-        parameters_map = results['parameters'][map_index]
-        commlabel2comm = {}
-        comm = 0
-        for commlabel in parameters_map['p_initial'].keys():
-            if commlabel is not None:
-                commlabel2comm[commlabel] = comm
-                comm += 1
-
-        self.K = len(commlabel2comm.keys())
+        theta = None
 
-        parameters_map = results['parameters'][map_index]
-        emission_prob = parameters_map['p_emission']
+        self.community_walks = IndexedWalks(indexes=sample['labels'], offsets=sample['offsets'])
 
-        phi = np.zeros(shape=(self.K, graph.number_of_nodes()), dtype=np.float)
-        for node in range(graph.number_of_nodes()):
-            for k in commlabel2comm.keys():
-                phi[commlabel2comm[k], node] = emission_prob[k][str(node)]
-        phi = (phi.T / np.sum(phi, 1)).T
+        return phi, theta, id2node
 
-        theta = None
+    def _bayesianhmm(self, params):
 
-        id2node = {int(node): node for node in graph.nodes()}
+        return self._hmm(params)
 
-        chains = hmm.chains
-        self.community_walks = []
-        for i in range(len(self.walks)):
-            community_walk = []
-            for w in chains[i].latent_sequence:
-                community_walk.append(commlabel2comm[w])
-            self.community_walks.append(community_walk)
+    def _bayesianhdphmm(self, params):
 
-        return phi, theta, id2node
+        return self._hmm(params)
 
     '''
     def _hdp(self, params):
@@ -528,68 +888,80 @@ class TNE:
         
     '''
 
-    def write_embeddings(self, embedding_file_path, concatenate_method):
+    def get_concatenated_embeddings(self, concatenate_method, chunk_size=100000):
+        """
+        Return the node labels sorted by their frequencies and the matrix of their node embeddings combined with the
+        community embeddings by the given method. For the average method, the community part is the product of the
+        column-normalized phi with the community embeddings, computed over chunks of chunk_size nodes so that the
+        intermediate matrices stay bounded.
+        """
 
+        self.fit_communities()
         if self.phi is None or self.id2node is None:
             raise ValueError("An error has occured in learning community labels!")
 
-        print("--> Embeddings are being written to the file: {}".format(embedding_file_path))
+        words, indexes = self._sorted_vocabulary()
+        node_embs = self.model.wv.syn0[indexes]
+        node2id = {node: nodeId for nodeId, node in self.id2node.items()}
+        node_ids = np.asarray([node2id[word] for word in words], dtype=np.int64)
 
-        if concatenate_method == "max":
+        if concatenate_method in ("max", "sum", "min"):
 
-            id2comm = np.argmax(self.phi, axis=0)
-            node2comm = {self.id2node[nodeId]: id2comm[nodeId] for nodeId in range(len(id2comm))}
-            with open(embedding_file_path, 'w') as f:
-                f.write("{} {}\n".format(len(self.model.wv.vocab), self.model.wv.syn0.shape[1] + self.model.wv.syn0_community.shape[1]))
-                # store in sorted order: most frequent words at the top
-                for word, vocab in sorted(iteritems(self.model.wv.vocab), key=lambda item: -item[1].count):
-                    row = np.concatenate((self.model.wv.syn0[vocab.index], self.model.wv.syn0_community[node2comm[word]]))
-                    f.write("{} {}\n".format(word, ' '.join(str(val) for val in row)))
+            id2comm = phi_argmin(self.phi) if concatenate_method == "min" else phi_argmax(self.phi)
+            comm_embs = self.model.wv.syn0_community[id2comm[node_ids]]
 
-        elif concatenate_method == "sum":
+            if concatenate_method == "sum":
+                return words, 1.0*node_embs + 1.0*comm_embs
 
-            id2comm = np.argmax(self.phi, axis=0)
-            node2comm = {self.id2node[nodeId]: id2comm[nodeId] for nodeId in range(len(id2comm))}
-            with open(embedding_file_path, 'w') as f:
-                f.write("{} {}\n".format(len(self.model.wv.vocab), self.model.wv.syn0.shape[1] + self.model.wv.syn0_community.shape[1]))
-                # store in sorted order: most frequent words at the top
-                for word, vocab in sorted(iteritems(self.model.wv.vocab), key=lambda item: -item[1].count):
-                    row = 1.0*np.asarray(self.model.wv.syn0[vocab.index]) + 1.0*np.asarray(self.model.wv.syn0_community[node2comm[word]])
-                    f.write("{} {}\n".format(word, ' '.join(str(val) for val in row)))
+            return words, np.concatenate((node_embs, comm_embs), axis=1)
 
         elif concatenate_method == "average":
 
-            phi = self.phi / np.sum(self.phi, 0)
-
-            comm_embs = np.zeros(shape=(len(self.model.wv.vocab), self.model.wv.syn0_community.shape[1]), dtype=np.float)
-            for nodeId in range(np.shape(phi)[1]):
-                for comm in range(np.shape(phi)[0]):
-                    comm_emb = np.asarray(self.model.wv.syn0_community[comm])
-                    comm_embs[int(self.id2node[nodeId]), :] += phi[comm, nodeId] * comm_emb
-
-            with open(embedding_file_path, 'w') as f:
-                f.write("{} {}\n".format(len(self.model.wv.vocab), self.model.wv.syn0.shape[1] + self.model.wv.syn0_community.shape[1]))
-                for word, vocab in sorted(iteritems(self.model.wv.vocab), key=lambda item: -item[1].count):
-                    row = np.concatenate((self.model.wv.syn0[vocab.index], comm_embs[int(word), :]))
-                    f.write("{} {}\n".format(word, ' '.join(str(val) for val in row)))
-
-        elif concatenate_method == "min":
-
-            id2comm = np.argmin(self.phi, axis=0)
-            node2comm = {self.id2node[nodeId]: id2comm[nodeId] for nodeId in range(len(id2comm))}
-            with open(embedding_file_path, 'w') as f:
-                f.write("{} {}\n".format(len(self.model.wv.vocab),
-                                         self.model.wv.syn0.shape[1] + self.model.wv.syn0_community.shape[1]))
-                # store in sorted order: most frequent words at the top
-                for word, vocab in sorted(iteritems(self.model.wv.vocab), key=lambda item: -item[1].count):
-                    row = np.concatenate(
-                        (self.model.wv.syn0[vocab.index], self.model.wv.syn0_community[node2comm[word]]))
-                    f.write("{} {}\n".format(word, ' '.join(str(val) for val in row)))
+            syn0_community = self.model.wv.syn0_community
+            # The float32 type of the weights, so that the output is not twice as large as the embeddings
+            embeddings = np.empty(shape=(len(words), node_embs.shape[1] + syn0_community.shape[1]),
+                                  dtype=node_embs.dtype)
+            embeddings[:, :node_embs.shape[1]] = node_embs
+            for start in range(0, len(words), chunk_size):
+                phi = normalize_phi_columns(self.phi[:, node_ids[start:start + chunk_size]])
+                embeddings[start:start + chunk_size, node_embs.shape[1]:] = phi.T.dot(syn0_community)
+
+            return words, embeddings
 
         else:
 
             raise ValueError("Invalid Concatenation Method Name!")
 
+    def write_embeddings(self, embedding_file_path, concatenate_method, file_format="text", float16=False):
+        """
+        Write the concatenated embeddings in the text or binary format of word2vec, or as a numpy matrix with the
+        array of node labels (see utils.export). The float16 option is supported by the numpy format only.
+        """
+
+        words, embeddings = self.get_concatenated_embeddings(concatenate_method)
+
+        print("--> Embeddings are being written to the file: {}".format(embedding_file_path))
+        with self.metrics.stage('export'):
+            save_embeddings(embedding_file_path, words, embeddings, file_format=file_format, float16=float16)
+
+    def get_search_index(self, concatenate_method="average", index="exact", **index_params):
+        """
+        Return a nearest-neighbour index (see tne.search) over the concatenated embeddings of the nodes, the exact
+        one or the approximate inverted file index ("ivf"). The dominant community of each node is stored, so that
+        the queries can be restricted to the nodes of the same community.
+        """
+
+        if index not in SEARCH_INDEXES:
+            raise ValueError("Invalid index name: {}".format(index))
+
+        words, embeddings = self.get_concatenated_embeddings(concatenate_method)
+        node2id = {node: nodeId for nodeId, node in self.id2node.items()}
+        node_ids = np.asarray([node2id[word] for word in words], dtype=np.int64)
+        communities = phi_argmax(self.phi)[node_ids]
+
+        index_class = ExactIndex if index == "exact" else IVFIndex
+        return index_class(words, embeddings, communities=communities, **index_params)
+
 
 class CombineSentences(object):
 
@@ -603,3 +975,25 @@ class CombineSentences(object):
         for node_walk, comm_walk in zip(self.node_walks, self.community_walks):
             yield [(v, int(t)) for (v, t) in zip(node_walk, comm_walk)]
 
+
+class CombineIndexedSentences(object):
+    """
+    Integer-native counterpart of CombineSentences. The vocabulary indexes of the nodes and their community labels
+    are kept as two aligned flat int32 arrays with the walk offsets, so that the training jobs are index ranges over
+    these arrays.
+    """
+
+    def __init__(self, indexed_walks, community_walks):
+        assert indexed_walks.number_of_tokens() == len(community_walks), "Node and community corpus sizes must be equal!"
+
+        self.indexes = np.ascontiguousarray(indexed_walks.indexes, dtype=np.int32)
+        self.communities = np.ascontiguousarray(community_walks, dtype=np.int32)
+        self.offsets = np.ascontiguousarray(indexed_walks.offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield np.column_stack((self.indexes[self.offsets[i]:self.offsets[i + 1]],
+                                   self.communities[self.offsets[i]:self.offsets[i + 1]]))
@@ -0,0 +1,193 @@
+import time
+import numpy as np
+from multiprocessing import Pool
+from utils.corpus import ArrayWalkCorpus
+
+# The walker is shared with the worker processes through the pool initializer
+_worker_walker = None
+
+
+def _alias_setup(probs):
+    """
+    Construct the alias table of a discrete distribution (Vose's method), so that a sample can be drawn in O(1) time
+    by _alias_draw.
+    """
+
+    n = len(probs)
+    accept = np.asarray(probs, dtype=np.float64) * n / np.sum(probs)
+    alias = np.zeros(shape=(n, ), dtype=np.int32)
+
+    small = [i for i in range(n) if accept[i] < 1.0]
+    large = [i for i in range(n) if accept[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        alias[s] = l
+        accept[l] = accept[l] + accept[s] - 1.0
+        if accept[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+
+    # The remaining entries are equal to 1 up to numerical errors
+    for i in small + large:
+        accept[i] = 1.0
+
+    return accept.astype(np.float32), alias
+
+
+def _alias_draw(offsets, lengths, accept, alias, rng):
+    # Draw a sample for each table whose entries start at the given offsets
+    k = (rng.random_sample(len(offsets)) * lengths).astype(np.int64)
+    pos = offsets + k
+    return np.where(rng.random_sample(len(offsets)) < accept[pos], k, alias[pos])
+
+
+class RandomWalker(object):
+    """
+    Random walk generator over a CSRGraph. If p = q = 1, the walks are first-order (uniform for unweighted graphs and
+    weight-proportional otherwise), else the second-order biased walks of node2vec are generated with the return
+    parameter p and the in-out parameter q. All transition probabilities are precomputed into alias tables.
+    """
+
+    def __init__(self, graph, p=1.0, q=1.0):
+
+        if p <= 0 or q <= 0:
+            raise ValueError("The parameters p and q must be positive!")
+
+        self.graph = graph
+        self.p = p
+        self.q = q
+        self.biased = (p != 1.0 or q != 1.0)
+
+        self.node_accept, self.node_alias = None, None
+        self.edge_offsets, self.edge_accept, self.edge_alias = None, None, None
+
+        self._preprocess_transition_probs()
+
+    def _preprocess_transition_probs(self):
+
+        graph = self.graph
+        indptr, indices, weights = graph.indptr, graph.indices, graph.weights
+        degrees = graph.degrees()
+
+        # Alias tables of the first-order transitions, stored in the same positions as the edges of the CSR structure
+        self.node_accept = np.ones(shape=(len(indices), ), dtype=np.float32)
+        self.node_alias = np.zeros(shape=(len(indices), ), dtype=np.int32)
+        if graph.is_weighted():
+            for node in range(graph.number_of_nodes()):
+                if degrees[node] > 0:
+                    accept, alias = _alias_setup(weights[indptr[node]:indptr[node + 1]])
+                    self.node_accept[indptr[node]:indptr[node + 1]] = accept
+                    self.node_alias[indptr[node]:indptr[node + 1]] = alias
+
+        if not self.biased:
+            return
+
+        # Alias tables of the second-order transitions: the table of the edge (t, v) is defined over the neighbours
+        # of v, and it is stored starting from position edge_offsets[e] where e is the position of (t, v) in the CSR
+        table_sizes = degrees[indices]
+        self.edge_offsets = np.zeros(shape=(len(indices), ), dtype=np.int64)
+        np.cumsum(table_sizes[:-1], out=self.edge_offsets[1:])
+        self.edge_accept = np.ones(shape=(int(np.sum(table_sizes)), ), dtype=np.float32)
+        self.edge_alias = np.zeros(shape=(int(np.sum(table_sizes)), ), dtype=np.int32)
+        for t in range(graph.number_of_nodes()):
+            t_nb = indices[indptr[t]:indptr[t + 1]]
+            for e in range(indptr[t], indptr[t + 1]):
+                v = indices[e]
+                v_nb = indices[indptr[v]:indptr[v + 1]]
+                if len(v_nb) == 0:
+                    continue
+                unnormalized_probs = np.where(np.isin(v_nb, t_nb, assume_unique=True), 1.0, 1.0 / self.q)
+                unnormalized_probs[v_nb == t] = 1.0 / self.p
+                unnormalized_probs *= weights[indptr[v]:indptr[v + 1]]
+                accept, alias = _alias_setup(unnormalized_probs)
+                self.edge_accept[self.edge_offsets[e]:self.edge_offsets[e] + len(v_nb)] = accept
+                self.edge_alias[self.edge_offsets[e]:self.edge_offsets[e] + len(v_nb)] = alias
+
+    def simulate_walks(self, start_nodes, walk_length, seed):
+        """
+        Simulate a walk from each of the given start nodes. All walks are advanced together, one step at a time.
+        Returns the flat array of node indices and the walk offsets.
+        """
+
+        rng = np.random.RandomState(seed)
+        indptr, indices = self.graph.indptr, self.graph.indices
+        degrees = self.graph.degrees()
+
+        walks = np.full(shape=(len(start_nodes), walk_length), fill_value=-1, dtype=np.int64)
+        walks[:, 0] = start_nodes
+        # The CSR positions of the last traversed edges, required for the second-order transitions
+        last_edges = np.zeros(shape=(len(start_nodes), ), dtype=np.int64)
+        active = np.arange(len(start_nodes))
+        for step in range(1, walk_length):
+            current = walks[active, step - 1]
+            # A walk ends when it reaches a node without any outgoing edge
+            has_neighbors = degrees[current] > 0
+            active, current = active[has_neighbors], current[has_neighbors]
+            if len(active) == 0:
+                break
+
+            if step == 1 or not self.biased:
+                k = _alias_draw(indptr[current], degrees[current], self.node_accept, self.node_alias, rng)
+            else:
+                k = _alias_draw(self.edge_offsets[last_edges[active]], degrees[current],
+                                self.edge_accept, self.edge_alias, rng)
+
+            last_edges[active] = indptr[current] + k
+            walks[active, step] = indices[last_edges[active]]
+
+        lengths = np.sum(walks >= 0, axis=1)
+        offsets = np.zeros(shape=(len(start_nodes) + 1, ), dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return walks[walks >= 0].astype(np.uint32), offsets
+
+
+def _init_worker(walker):
+    global _worker_walker
+    _worker_walker = walker
+
+
+def _simulate_walks_job(job):
+    start_nodes, walk_length, seed = job
+    return _worker_walker.simulate_walks(start_nodes, walk_length, seed)
+
+
+def generate_walks(graph, number_of_walks, walk_length, p=1.0, q=1.0, workers=1, seed=1, chunk_size=10000):
+    """
+    Generate number_of_walks walks starting from each node of the given CSRGraph. The start nodes are shuffled for
+    each round and split into chunks which are distributed over a pool of worker processes. Every chunk has its own
+    seed, so the output does not depend on the number of workers. The walks are returned as an ArrayWalkCorpus which
+    can be passed to TNE directly or saved as a binary corpus file.
+    """
+
+    initial_time = time.time()
+    walker = RandomWalker(graph, p=p, q=q)
+    print("--> The transition probabilities have been computed in {:.2f} secs.".format(time.time() - initial_time))
+
+    initial_time = time.time()
+    rng = np.random.RandomState(seed)
+    start_nodes = np.concatenate([rng.permutation(graph.number_of_nodes()) for _ in range(number_of_walks)])
+    jobs = [(start_nodes[i:i + chunk_size], walk_length, seed + jobId + 1)
+            for jobId, i in enumerate(range(0, len(start_nodes), chunk_size))]
+
+    if workers > 1:
+        pool = Pool(processes=workers, initializer=_init_worker, initargs=(walker, ))
+        try:
+            results = pool.map(_simulate_walks_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [walker.simulate_walks(*job) for job in jobs]
+
+    tokens = np.concatenate([chunk_tokens for chunk_tokens, _ in results])
+    offsets = np.zeros(shape=(len(start_nodes) + 1, ), dtype=np.int64)
+    pos, walkId = 0, 0
+    for chunk_tokens, chunk_offsets in results:
+        offsets[walkId + 1:walkId + len(chunk_offsets)] = chunk_offsets[1:] + pos
+        pos += len(chunk_tokens)
+        walkId += len(chunk_offsets) - 1
+    print("--> {} walks have been generated in {:.2f} secs.".format(len(start_nodes), time.time() - initial_time))
+
+    return ArrayWalkCorpus(tokens=tokens, offsets=offsets, id2token=np.asarray(graph.id2node).astype(str))
@@ -0,0 +1,197 @@
+import os
+import numpy as np
+
+# Suffixes of the files forming a binary corpus: a flat array of token ids, the offsets of walks in that array and
+# the array mapping token ids back to node labels
+_TOKENS_SUFFIX = ".tokens.npy"
+_OFFSETS_SUFFIX = ".offsets.npy"
+_VOCAB_SUFFIX = ".vocab.npy"
+
+
+class WalkCorpus(object):
+    """
+    Restartable iterable over a text corpus file in which each line is a walk of whitespace separated node labels.
+    The file is read lazily, so only a single walk is kept in memory at a time.
+    """
+
+    def __init__(self, corpus_path):
+
+        if not os.path.exists(corpus_path):
+            raise ValueError("The corpus file does not exist: {}".format(corpus_path))
+
+        self.corpus_path = corpus_path
+        self._number_of_walks = None
+
+    def __iter__(self):
+        with open(self.corpus_path, 'r') as f:
+            for line in f:
+                yield line.split()
+
+    def __len__(self):
+        if self._number_of_walks is None:
+            with open(self.corpus_path, 'r') as f:
+                self._number_of_walks = sum(1 for _ in f)
+
+        return self._number_of_walks
+
+
+class ArrayWalkCorpus(object):
+    """
+    Restartable iterable over walks stored as a single uint32 array of token ids together with an offsets array, so
+    that the i-th walk is tokens[offsets[i]:offsets[i+1]]. The token ids are mapped back to node labels by id2token.
+    """
+
+    def __init__(self, tokens, offsets, id2token):
+
+        self.tokens = tokens
+        self.offsets = offsets
+        self.id2token = id2token
+
+    def __iter__(self):
+        id2token = self.id2token.tolist()
+        for i in range(len(self)):
+            yield [id2token[t] for t in self.walk(i)]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def walk(self, i):
+        """Return the token ids of the i-th walk without converting them into node labels."""
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def number_of_tokens(self):
+        return len(self.tokens)
+
+    def save(self, output_path):
+        """Write the walks in the binary corpus format, which can be opened later by BinaryWalkCorpus."""
+
+        output_folder = os.path.dirname(output_path)
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        np.save(output_path + _TOKENS_SUFFIX, np.asarray(self.tokens, dtype=np.uint32))
+        np.save(output_path + _OFFSETS_SUFFIX, np.asarray(self.offsets, dtype=np.int64))
+        np.save(output_path + _VOCAB_SUFFIX, np.asarray(self.id2token).astype(str))
+
+
+class BinaryWalkCorpus(ArrayWalkCorpus):
+    """
+    Binary corpus read from the disk. The token and offset arrays are memory-mapped, hence opening a corpus is cheap
+    regardless of its size.
+    """
+
+    def __init__(self, corpus_path, mmap=True):
+
+        if not is_binary_corpus(corpus_path):
+            raise ValueError("The binary corpus files do not exist: {}".format(corpus_path))
+
+        mmap_mode = 'r' if mmap else None
+        self.corpus_path = corpus_path
+        super(BinaryWalkCorpus, self).__init__(tokens=np.load(corpus_path + _TOKENS_SUFFIX, mmap_mode=mmap_mode),
+                                               offsets=np.load(corpus_path + _OFFSETS_SUFFIX, mmap_mode=mmap_mode),
+                                               id2token=np.load(corpus_path + _VOCAB_SUFFIX))
+
+
+class IndexedWalks(object):
+    """
+    Walks mapped once to the vocabulary indexes of a model, stored as a flat int32 array together with the walk
+    offsets. Tokens missing in the vocabulary are marked with -1, so that the positions of the tokens are preserved.
+    """
+
+    def __init__(self, indexes, offsets):
+
+        self.indexes = indexes
+        self.offsets = offsets
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.walk(i)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def walk(self, i):
+        return self.indexes[self.offsets[i]:self.offsets[i + 1]]
+
+    def number_of_tokens(self):
+        return len(self.indexes)
+
+
+def index_walks(walks, token2index):
+    """
+    Map the tokens of the walks to their indexes given by the dictionary token2index. For array based corpora, only
+    the distinct tokens are looked up and the walks are mapped with a single fancy indexing operation.
+    """
+
+    if isinstance(walks, ArrayWalkCorpus):
+        id2index = np.asarray([token2index.get(token, -1) for token in walks.id2token.tolist()], dtype=np.int32)
+        return IndexedWalks(indexes=id2index[walks.tokens], offsets=np.asarray(walks.offsets, dtype=np.int64))
+
+    chunks, lengths = [], []
+    for walk in walks:
+        chunks.append(np.fromiter((token2index.get(token, -1) for token in walk), dtype=np.int32, count=len(walk)))
+        lengths.append(len(walk))
+    offsets = np.zeros(shape=(len(lengths) + 1, ), dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    indexes = np.concatenate(chunks) if chunks else np.zeros(shape=(0, ), dtype=np.int32)
+
+    return IndexedWalks(indexes=indexes, offsets=offsets)
+
+
+def is_binary_corpus(corpus_path):
+
+    return all(os.path.exists(corpus_path + suffix) for suffix in (_TOKENS_SUFFIX, _OFFSETS_SUFFIX, _VOCAB_SUFFIX))
+
+
+def load_corpus(corpus_path):
+    """Open a corpus file in a streaming fashion, the format is detected from the files found on the disk."""
+
+    if is_binary_corpus(corpus_path):
+        return BinaryWalkCorpus(corpus_path)
+
+    return WalkCorpus(corpus_path)
+
+
+def write_binary_corpus(walks, output_path):
+    """
+    Write the given walks in the binary corpus format. The walks are iterated twice, once for counting the tokens and
+    once for filling the memory-mapped token array, so the walks can be any restartable iterable such as WalkCorpus.
+    """
+
+    token2id = {}
+    number_of_walks, number_of_tokens = 0, 0
+    for walk in walks:
+        for token in walk:
+            if token not in token2id:
+                token2id[token] = len(token2id)
+        number_of_walks += 1
+        number_of_tokens += len(walk)
+
+    if len(token2id) > np.iinfo(np.uint32).max:
+        raise ValueError("The number of distinct tokens exceeds the uint32 range!")
+
+    output_folder = os.path.dirname(output_path)
+    if output_folder and not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    if number_of_tokens == 0:
+        raise ValueError("The corpus does not contain any token!")
+
+    tokens = np.lib.format.open_memmap(output_path + _TOKENS_SUFFIX, mode='w+', dtype=np.uint32,
+                                       shape=(number_of_tokens, ))
+    offsets = np.zeros(shape=(number_of_walks + 1, ), dtype=np.int64)
+    pos = 0
+    for walkId, walk in enumerate(walks):
+        tokens[pos:pos + len(walk)] = [token2id[token] for token in walk]
+        pos += len(walk)
+        offsets[walkId + 1] = pos
+    tokens.flush()
+    del tokens
+
+    id2token = np.empty(shape=(len(token2id), ), dtype=object)
+    for token, tokenId in token2id.items():
+        id2token[tokenId] = token
+    np.save(output_path + _OFFSETS_SUFFIX, offsets)
+    np.save(output_path + _VOCAB_SUFFIX, id2token.astype(str))
+
+    return BinaryWalkCorpus(output_path)
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+
+EXPORT_FORMATS = ['text', 'binary', 'numpy']
+
+# Suffixes of the files written in the numpy format: the embedding matrix and the array of node labels
+_VECTORS_SUFFIX = ".npy"
+_NODES_SUFFIX = ".nodes.npy"
+
+
+def _create_parent_folder(file_path):
+
+    folder = os.path.dirname(file_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+
+def save_text(file_path, labels, vectors):
+    """Write the vectors in the text format of word2vec, one line per label."""
+
+    _create_parent_folder(file_path)
+    with open(file_path, 'w') as f:
+        f.write("{} {}\n".format(vectors.shape[0], vectors.shape[1]))
+        for label, row in zip(labels, vectors):
+            f.write("{} {}\n".format(label, ' '.join(str(val) for val in row)))
+
+
+def save_word2vec_binary(file_path, labels, vectors):
+    """
+    Write the vectors in the binary format of word2vec: a text header followed by, for each label, the label, a space
+    and the raw little-endian float32 values of its vector.
+    """
+
+    _create_parent_folder(file_path)
+    vectors = np.asarray(vectors, dtype='<f4')
+    with open(file_path, 'wb') as f:
+        f.write("{} {}\n".format(vectors.shape[0], vectors.shape[1]).encode('utf8'))
+        for label, row in zip(labels, vectors):
+            f.write(str(label).encode('utf8') + b" " + row.tobytes() + b"\n")
+
+
+def save_numpy(file_path, labels, vectors, float16=False):
+    """
+    Write the vectors as a raw .npy matrix together with a .npy array of the node labels of its rows, so that the
+    matrix can be memory-mapped by load_numpy. The values are stored in float16 if float16 is True.
+    """
+
+    _create_parent_folder(file_path)
+    np.save(file_path + _VECTORS_SUFFIX, np.asarray(vectors, dtype=np.float16 if float16 else np.float32))
+    np.save(file_path + _NODES_SUFFIX, np.asarray(labels).astype(str))
+
+
+def load_numpy(file_path, mmap=True):
+    """Read the node labels and the (memory-mapped) embedding matrix written by save_numpy."""
+
+    vectors = np.load(file_path + _VECTORS_SUFFIX, mmap_mode='r' if mmap else None)
+    labels = np.load(file_path + _NODES_SUFFIX)
+
+    return labels, vectors
+
+
+def save_embeddings(file_path, labels, vectors, file_format='text', float16=False):
+
+    if file_format == 'text':
+        save_text(file_path, labels, vectors)
+    elif file_format == 'binary':
+        if float16:
+            raise ValueError("The binary word2vec format supports only float32 values!")
+        save_word2vec_binary(file_path, labels, vectors)
+    elif file_format == 'numpy':
+        save_numpy(file_path, labels, vectors, float16=float16)
+    else:
+        raise ValueError("Invalid embedding file format: {}".format(file_format))
@@ -0,0 +1,218 @@
+import os
+import json
+import numpy as np
+import networkx as nx
+
+# Suffixes of the files of the CSR snapshot written next to a graph file: the CSR arrays, the node labels of the
+# node indices and the description of the graph file they have been built from
+_INDPTR_SUFFIX = ".indptr.npy"
+_INDICES_SUFFIX = ".indices.npy"
+_WEIGHTS_SUFFIX = ".weights.npy"
+_NODES_SUFFIX = ".nodes.npy"
+_SNAPSHOT_SUFFIX = ".csr.json"
+_SNAPSHOT_VERSION = 1
+
+
+class CSRGraph(object):
+    """
+    Compact adjacency structure of a graph. The neighbours of the node with index i are
+    indices[indptr[i]:indptr[i+1]] and the corresponding edge weights are stored in the same positions of weights.
+    Node indices are mapped back to the node labels of the source file through id2node.
+    """
+
+    def __init__(self, indptr, indices, weights, id2node, directed=False):
+
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.id2node = id2node
+        self.directed = directed
+
+    def number_of_nodes(self):
+        return len(self.indptr) - 1
+
+    def number_of_edges(self):
+        return len(self.indices) if self.directed else len(self.indices) // 2
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def neighbor_weights(self, i):
+        return self.weights[self.indptr[i]:self.indptr[i + 1]]
+
+    def is_weighted(self):
+        return not np.all(self.weights == self.weights[0]) if len(self.weights) else False
+
+
+def _sort_node_labels(labels):
+    # Keep the numerical order if the node labels are integers, so that index i corresponds to the node label "i"
+    if all(label.lstrip('-').isdigit() for label in labels):
+        return sorted(labels, key=int)
+
+    return list(labels)
+
+
+def _edges_to_csr(source, target, weights, id2node, directed):
+
+    if not directed:
+        # Store each undirected edge in both directions, self-loops only once
+        mask = source != target
+        source, target = np.concatenate((source, target[mask])), np.concatenate((target, source[mask]))
+        weights = np.concatenate((weights, weights[mask]))
+
+    order = np.lexsort((target, source))
+    indptr = np.zeros(shape=(len(id2node) + 1, ), dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=len(id2node)), out=indptr[1:])
+
+    return CSRGraph(indptr=indptr, indices=target[order].astype(np.int32), weights=weights[order].astype(np.float32),
+                    id2node=id2node, directed=directed)
+
+
+def _read_edgelist(graph_path, directed):
+
+    node2id = {}
+    source, target, weights = [], [], []
+    with open(graph_path, 'r') as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+            for token in tokens[:2]:
+                if token not in node2id:
+                    node2id[token] = len(node2id)
+            source.append(node2id[tokens[0]])
+            target.append(node2id[tokens[1]])
+            weights.append(float(tokens[2]) if len(tokens) > 2 else 1.0)
+
+    # Relabel the nodes so that the node indices follow the sorted order of the node labels
+    id2node = np.asarray(_sort_node_labels(list(node2id.keys())))
+    relabel = np.empty(shape=(len(id2node), ), dtype=np.int64)
+    relabel[[node2id[node] for node in id2node]] = np.arange(len(id2node))
+
+    return _edges_to_csr(relabel[np.asarray(source, dtype=np.int64)], relabel[np.asarray(target, dtype=np.int64)],
+                         np.asarray(weights, dtype=np.float32), id2node, directed)
+
+
+def _read_gml(graph_path):
+
+    graph = nx.read_gml(graph_path)
+
+    id2node = np.asarray(_sort_node_labels([str(node) for node in graph.nodes()]))
+    node2id = {node: i for i, node in enumerate(id2node)}
+    source = np.fromiter((node2id[str(u)] for u, _ in graph.edges()), dtype=np.int64, count=graph.number_of_edges())
+    target = np.fromiter((node2id[str(v)] for _, v in graph.edges()), dtype=np.int64, count=graph.number_of_edges())
+    weights = np.fromiter((data.get('weight', 1.0) for _, _, data in graph.edges(data=True)), dtype=np.float32,
+                          count=graph.number_of_edges())
+
+    return _edges_to_csr(source, target, weights, id2node, graph.is_directed())
+
+
+def csr_to_networkx(graph):
+    """Return the networkx graph over the node indices of the CSRGraph, with the edge weights as 'weight'."""
+
+    source = np.repeat(np.arange(graph.number_of_nodes(), dtype=np.int64), graph.degrees())
+    # Each undirected edge is stored in both directions
+    mask = np.ones(shape=(len(source), ), dtype=bool) if graph.directed else source <= graph.indices
+
+    nx_graph = nx.DiGraph() if graph.directed else nx.Graph()
+    nx_graph.add_nodes_from(range(graph.number_of_nodes()))
+    nx_graph.add_weighted_edges_from(zip(source[mask].tolist(), np.asarray(graph.indices)[mask].tolist(),
+                                         np.asarray(graph.weights)[mask].tolist()))
+
+    return nx_graph
+
+
+def _describe_source(graph_path, directed):
+    # The snapshot is valid as long as the graph file has the same size and modification time
+    stat = os.stat(graph_path)
+    return {'version': _SNAPSHOT_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'directed': directed}
+
+
+def _save_array(file_path, array):
+    # Replace the file instead of overwriting it, so that the processes which memory-mapped it keep the old content
+    temp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(temp_path, file_path)
+
+
+def write_snapshot(graph, graph_path, directed=False):
+    """
+    Write the CSR arrays and the node labels of the graph parsed from graph_path next to it, together with the
+    description of the file, so that read_snapshot can memory-map them instead of parsing the file again.
+    """
+
+    snapshot_path = graph_path + _SNAPSHOT_SUFFIX
+    description = _describe_source(graph_path, directed)
+    description['graph_directed'] = graph.directed
+
+    # The description is removed first and written last, so an incomplete snapshot is never read
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    _save_array(graph_path + _INDPTR_SUFFIX, np.asarray(graph.indptr, dtype=np.int64))
+    _save_array(graph_path + _INDICES_SUFFIX, np.asarray(graph.indices, dtype=np.int32))
+    _save_array(graph_path + _WEIGHTS_SUFFIX, np.asarray(graph.weights, dtype=np.float32))
+    _save_array(graph_path + _NODES_SUFFIX, np.asarray(graph.id2node).astype(str))
+    temp_path = "{}.{}.tmp".format(snapshot_path, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(description, f)
+    os.replace(temp_path, snapshot_path)
+
+
+def read_snapshot(graph_path, directed=False, mmap=True):
+    """
+    Return the CSRGraph of the snapshot written next to graph_path, whose arrays are memory-mapped, or None if there
+    is no snapshot or the graph file has changed since it was written.
+    """
+
+    snapshot_path = graph_path + _SNAPSHOT_SUFFIX
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        with open(snapshot_path, 'r') as f:
+            description = json.load(f)
+    except ValueError:
+        return None
+    if any(description.get(key) != value for key, value in _describe_source(graph_path, directed).items()):
+        return None
+
+    mmap_mode = 'r' if mmap else None
+    return CSRGraph(indptr=np.load(graph_path + _INDPTR_SUFFIX, mmap_mode=mmap_mode),
+                    indices=np.load(graph_path + _INDICES_SUFFIX, mmap_mode=mmap_mode),
+                    weights=np.load(graph_path + _WEIGHTS_SUFFIX, mmap_mode=mmap_mode),
+                    id2node=np.load(graph_path + _NODES_SUFFIX, mmap_mode=mmap_mode),
+                    directed=description['graph_directed'])
+
+
+def load_csr_graph(graph_path, directed=False, snapshot=True):
+    """
+    Read a graph in gml or edgelist format into a CSRGraph. The format is determined by the file extension, any file
+    not ending with .gml is parsed as an edgelist with an optional third column of edge weights. If snapshot is
+    True, the parsed graph is written as a CSR snapshot next to the file (see write_snapshot), and the next loads
+    memory-map the snapshot instead of parsing the file, until the file is modified.
+    """
+
+    if not os.path.exists(graph_path):
+        raise ValueError("The graph file does not exist: {}".format(graph_path))
+
+    if snapshot:
+        graph = read_snapshot(graph_path, directed=directed)
+        if graph is not None:
+            return graph
+
+    if os.path.splitext(graph_path)[1].lower() == ".gml":
+        graph = _read_gml(graph_path)
+    else:
+        graph = _read_edgelist(graph_path, directed=directed)
+
+    if snapshot:
+        try:
+            write_snapshot(graph, graph_path, directed=directed)
+        except (IOError, OSError) as e:
+            # e.g. the folder of the graph is read-only, the graph is parsed again next time
+            print("--> The CSR snapshot of the graph could not be written: {}".format(e))
+
+    return graph
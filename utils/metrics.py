@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import numpy as np
+
+# The upper bounds of the buckets of the histograms: from 10 microseconds to about 3 hours by powers of two for the
+# durations in seconds, and from 0 to about a million for the counts such as the queue depths
+DURATION_BOUNDS = [1e-5 * 2 ** i for i in range(31)]
+COUNT_BOUNDS = [0] + [2 ** i for i in range(21)]
+
+
+class Histogram(object):
+    """Counts of the observed values in fixed buckets, together with their number, sum, minimum and maximum."""
+
+    def __init__(self, bounds=None):
+
+        self.bounds = np.asarray(bounds if bounds is not None else DURATION_BOUNDS, dtype=np.float64)
+        self.buckets = np.zeros(shape=(len(self.bounds) + 1, ), dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value):
+
+        self.buckets[np.searchsorted(self.bounds, value, side='left')] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """Return the upper bound of the bucket containing the q-th percentile, q being in [0, 100]."""
+
+        if self.count == 0:
+            return None
+        position = np.searchsorted(np.cumsum(self.buckets), q / 100.0 * self.count, side='left')
+
+        return float(self.bounds[position]) if position < len(self.bounds) else self.max
+
+    def to_dict(self):
+
+        if self.count == 0:
+            return {'count': 0}
+
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count, 'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'buckets': {"{:g}".format(bound): int(count) for bound, count in
+                            zip(list(self.bounds) + [float('inf')], self.buckets) if count > 0}}
+
+
+class Stage(object):
+    """The wall and the CPU time of a stage measured by Metrics.stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = None
+        self.cpu_seconds = None
+
+
+class Metrics(object):
+    """
+    Counters, histograms and events of a run. The events and the final summary are written as JSON lines into the
+    file at file_path, if it is given, and they are only kept in memory otherwise. If profile_folder is given, each
+    stage is profiled by cProfile in the thread running it and its statistics are written into <stage>.prof files,
+    which can be read by pstats or snakeviz. A thread has a single profiler, so a stage nested in another stage of
+    the same thread is only timed, and its calls are in the profile of the outermost stage. The methods can be
+    called from multiple threads.
+    """
+
+    def __init__(self, file_path=None, profile_folder=None):
+
+        self.file_path = file_path
+        self.profile_folder = profile_folder
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._start_time = time.time()
+        # The number of the running stages of each thread
+        self._local = threading.local()
+
+        if self.profile_folder is not None and not os.path.exists(self.profile_folder):
+            os.makedirs(self.profile_folder)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, bounds=None):
+        """Add the value into the histogram of the given name, whose buckets are created with the given bounds."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(bounds)
+            self.histograms[name].add(value)
+
+    def emit(self, event, **fields):
+        """Write an event with the given fields as a JSON line."""
+
+        if self.file_path is None:
+            return
+
+        record = {'event': event, 'time': time.time(), 'elapsed': time.time() - self._start_time}
+        record.update(fields)
+        line = json.dumps(record, default=_to_json)
+        with self._lock:
+            if self._file is None:
+                folder = os.path.dirname(self.file_path)
+                if folder and not os.path.exists(folder):
+                    os.makedirs(folder)
+                self._file = open(self.file_path, 'a')
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def stage(self, name):
+        """
+        Return a context manager measuring the block as the stage of the given name: its wall and CPU time are added
+        to the counters '<name>.seconds' and '<name>.cpu_seconds', a 'stage' event is emitted and the block is
+        profiled if a profile folder is set and no other stage is running in the thread. The Stage object it returns
+        holds the measured times.
+        """
+        return _StageContext(self, Stage(name))
+
+    def summary(self):
+
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()}}
+
+    def close(self):
+        """Write the summary of the counters and the histograms, and close the file."""
+
+        self.emit('summary', **self.summary())
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _StageContext(object):
+
+    def __init__(self, metrics, stage):
+
+        self.metrics = metrics
+        self.stage = stage
+        self.profiler = None
+
+    def __enter__(self):
+
+        self.wall_time, self.cpu_time = time.time(), time.process_time()
+        depth = getattr(self.metrics._local, 'depth', 0)
+        self.metrics._local.depth = depth + 1
+        # The profiler of the outermost stage of the thread records the nested stages
+        if self.metrics.profile_folder is not None and depth == 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        return self.stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.metrics._local.depth -= 1
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.join(self.metrics.profile_folder, "{}.prof".format(self.stage.name)))
+
+        # The CPU time is the one of the whole process, so it includes the threads of the concurrent stages
+        self.stage.seconds = time.time() - self.wall_time
+        self.stage.cpu_seconds = time.process_time() - self.cpu_time
+        self.metrics.increment("{}.seconds".format(self.stage.name), self.stage.seconds)
+        self.metrics.increment("{}.cpu_seconds".format(self.stage.name), self.stage.cpu_seconds)
+        self.metrics.emit('stage', stage=self.stage.name, seconds=self.stage.seconds,
+                          cpu_seconds=self.stage.cpu_seconds, failed=exc_type is not None)
+
+        return False
+
+
+def _to_json(value):
+    # The numpy scalars and arrays in the fields
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)